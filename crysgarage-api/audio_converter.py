@@ -1,114 +1,280 @@
 """
 Simple Audio Converter for CrysGarage
 Converts audio files between different formats and sample rates
+
+WAV/FLAC/OGG are written in-process from NumPy buffers through libsndfile;
+MP3/AAC stream raw float PCM into a single ffmpeg process. Every output is
+written to a temporary name, fsync'd and atomically renamed into place.
+Inputs are decoded through audio_decoder, whatever their extension says.
+soundfile and scipy are imported on first use to keep API startup fast.
 """
 
 import os
 import logging
-from pydub import AudioSegment
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from math import gcd
+
+import numpy as np
+
+from audio_decoder import iter_blocks, probe, read_audio
 
 logger = logging.getLogger(__name__)
 
+BLOCK_FRAMES = 65536
+
+FILE_EXTENSIONS = {
+    "MP3": "mp3",
+    "WAV": "wav",
+    "FLAC": "flac",
+    "AAC": "aac",
+    "OGG": "ogg",
+}
+
+WAV_SUBTYPES = {16: "PCM_16", 24: "PCM_24", 32: "FLOAT"}
+FLAC_SUBTYPES = {16: "PCM_16", 24: "PCM_24", 32: "PCM_24"}
+
+
+def _fsync_path(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FFmpegSink:
+    """Write float32 frames into one ffmpeg encoder process over stdin"""
+
+    def __init__(self, output_path: str, output_format: str, sample_rate: int, channels: int, bitrate_kbps: int):
+        if output_format == "MP3":
+            # LAME tops out at 320 kbps
+            codec_args = ["-c:a", "libmp3lame", "-b:a", f"{min(bitrate_kbps, 320)}k", "-f", "mp3"]
+        else:
+            codec_args = ["-c:a", "aac", "-b:a", f"{bitrate_kbps}k", "-f", "adts"]
+
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+             "-f", "f32le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+             *codec_args, output_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self._stderr,
+        )
+
+    def write(self, block: np.ndarray):
+        self._process.stdin.write(memoryview(np.ascontiguousarray(block, dtype="<f4")).cast("B"))
+
+    def close(self):
+        self._process.stdin.close()
+        returncode = self._process.wait()
+        self._stderr.seek(0)
+        message = self._stderr.read().decode("utf-8", "replace").strip()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with {returncode}: {message}")
+
 
 class AudioConverter:
     """Convert audio files to different formats and sample rates"""
-    
+
     def __init__(self):
         self.supported_formats = ["MP3", "WAV", "FLAC", "AAC", "OGG"]
         logger.info("AudioConverter initialized")
-    
-    def convert_audio(self, input_path: str, output_path: str, output_format: str, sample_rate: int = 44100):
+
+    def _open_sink(self, path: str, output_format: str, sample_rate: int, channels: int,
+                   mp3_bitrate_kbps: int, aac_bitrate_kbps: int, wav_bit_depth: int):
+        import soundfile as sf
+
+        if output_format == "WAV":
+            return sf.SoundFile(path, "w", samplerate=sample_rate, channels=channels,
+                                format="WAV", subtype=WAV_SUBTYPES[wav_bit_depth])
+        if output_format == "FLAC":
+            return sf.SoundFile(path, "w", samplerate=sample_rate, channels=channels,
+                                format="FLAC", subtype=FLAC_SUBTYPES[wav_bit_depth])
+        if output_format == "OGG":
+            return sf.SoundFile(path, "w", samplerate=sample_rate, channels=channels,
+                                format="OGG", subtype="VORBIS")
+        if output_format == "MP3":
+            return FFmpegSink(path, "MP3", sample_rate, channels, mp3_bitrate_kbps)
+        if output_format == "AAC":
+            return FFmpegSink(path, "AAC", sample_rate, channels, aac_bitrate_kbps)
+        raise ValueError(f"Unsupported format: {output_format}")
+
+    def write_blocks(self, blocks, output_path: str, output_format: str, sample_rate: int, channels: int,
+                     mp3_bitrate_kbps: int = 320, aac_bitrate_kbps: int = 256, wav_bit_depth: int = 16) -> str:
+        """
+        Encode an iterable of (frames, channels) float32 blocks and publish the file atomically
+
+        The data goes to a temporary file in the destination directory, which is
+        fsync'd and then renamed over output_path, so readers never see a partial file.
+        """
+        output_format = output_format.upper()
+        if wav_bit_depth not in WAV_SUBTYPES:
+            raise ValueError(f"Unsupported bit depth: {wav_bit_depth}")
+
+        output_dir = os.path.dirname(os.path.abspath(output_path))
+        # ffmpeg picks the muxer from -f, libsndfile from format=, so the suffix only aids debugging
+        fd, tmp_path = tempfile.mkstemp(
+            dir=output_dir, prefix=".encoding_", suffix=f".{FILE_EXTENSIONS.get(output_format, 'tmp')}"
+        )
+        os.close(fd)
+
+        try:
+            sink = self._open_sink(tmp_path, output_format, sample_rate, channels,
+                                   mp3_bitrate_kbps, aac_bitrate_kbps, wav_bit_depth)
+            try:
+                for block in blocks:
+                    sink.write(block)
+            finally:
+                sink.close()
+
+            _fsync_path(tmp_path)
+            os.replace(tmp_path, output_path)
+            _fsync_path(output_dir)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return output_path
+
+    def encode(self, data: np.ndarray, sample_rate: int, output_path: str, output_format: str, **options) -> str:
+        """Encode a (frames, channels) float32 buffer; options as for write_blocks"""
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        blocks = (data[start:start + BLOCK_FRAMES] for start in range(0, data.shape[0], BLOCK_FRAMES))
+        return self.write_blocks(blocks, output_path, output_format, sample_rate, data.shape[1], **options)
+
+    @staticmethod
+    def resample(data: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+        """Polyphase resampling of a (frames, channels) buffer to float32"""
+        if source_rate == target_rate:
+            return data
+        import scipy.signal
+
+        divisor = gcd(source_rate, target_rate)
+        resampled = scipy.signal.resample_poly(data, target_rate // divisor, source_rate // divisor, axis=0)
+        return resampled.astype(np.float32, copy=False)
+
+    def convert_audio(self, input_path: str, output_path: str, output_format: str, sample_rate: int = 44100,
+                      mp3_bitrate_kbps: int = 320, wav_bit_depth: int = 16, copy_on_failure: bool = True):
         """
         Convert audio file to specified format and sample rate with robust validation
-        
+
         Args:
             input_path: Path to input audio file
             output_path: Path to save converted audio
             output_format: Output format (MP3, WAV, FLAC, AAC, OGG)
             sample_rate: Target sample rate (default 44100)
-            
+            mp3_bitrate_kbps: MP3 bitrate (default 320)
+            wav_bit_depth: WAV/FLAC bit depth, 16, 24 or 32 (float)
+            copy_on_failure: If the conversion fails, copy the input to output_path
+                unconverted instead of raising
+
         Returns:
             str: Path to converted file
         """
         try:
             logger.info(f"🔄 Converting {input_path} to {output_format} at {sample_rate}Hz")
-            
+
             # Verify input file exists and has content
             if not os.path.exists(input_path):
                 raise ValueError(f"Input file does not exist: {input_path}")
-            
+
             input_size = os.path.getsize(input_path)
             logger.info(f"📊 Input file size: {input_size / (1024*1024):.2f} MB")
-            
+
             if input_size < 100:
                 raise ValueError(f"Input file too small ({input_size} bytes), possibly corrupted")
-            
-            # Load audio file
-            logger.info(f"📂 Loading audio for conversion...")
-            audio = AudioSegment.from_file(input_path)
-            logger.info(f"✓ Loaded: duration={len(audio)/1000:.2f}s, channels={audio.channels}, frame_rate={audio.frame_rate}Hz")
-            
-            # Resample if needed
-            if audio.frame_rate != sample_rate:
-                logger.info(f"🔄 Resampling from {audio.frame_rate}Hz to {sample_rate}Hz...")
-                audio = audio.set_frame_rate(sample_rate)
-                logger.info(f"✓ Resampled to {sample_rate}Hz")
-            
-            # Export in requested format with explicit parameters
-            format_lower = output_format.lower()
-            logger.info(f"💾 Exporting to {format_lower} format...")
-            
-            if format_lower == "mp3":
-                export_handle = audio.export(output_path, format="mp3", bitrate="320k", parameters=["-q:a", "0"])
-            elif format_lower == "wav":
-                export_handle = audio.export(output_path, format="wav")
-            elif format_lower == "flac":
-                export_handle = audio.export(output_path, format="flac", parameters=["-compression_level", "5"])
-            elif format_lower == "aac":
-                export_handle = audio.export(output_path, format="adts", codec="aac", bitrate="256k")
-            elif format_lower == "ogg":
-                export_handle = audio.export(output_path, format="ogg", codec="libvorbis", parameters=["-q:a", "6"])
+
+            options = {"mp3_bitrate_kbps": mp3_bitrate_kbps, "wav_bit_depth": wav_bit_depth}
+
+            info = probe(input_path)
+            logger.info(f"✓ Opened {info['format']}: duration={info['duration']:.2f}s, channels={info['channels']}, frame_rate={info['sample_rate']}Hz")
+
+            if info["sample_rate"] == sample_rate:
+                # Stream straight through without holding the file in memory
+                blocks = iter_blocks(input_path, BLOCK_FRAMES, info=info)
+                self.write_blocks(blocks, output_path, output_format, sample_rate, info["channels"], **options)
             else:
-                raise ValueError(f"Unsupported format: {output_format}")
-            
-            # Ensure the export handle is closed and data is flushed
-            if export_handle:
-                export_handle.close()
-            
-            # Force sync to disk
-            if os.path.exists(output_path):
-                # Touch the file to ensure it's accessible and flushed
-                with open(output_path, 'rb') as f:
-                    f.read(1)
-                if hasattr(os, 'sync'):
-                    os.sync()
-            
+                logger.info(f"🔄 Resampling from {info['sample_rate']}Hz to {sample_rate}Hz...")
+                data, source_rate = read_audio(input_path, info=info)
+                data = self.resample(data, source_rate, sample_rate)
+                self.encode(data, sample_rate, output_path, output_format, **options)
+
             # Validate output file
-            if not os.path.exists(output_path):
-                raise ValueError(f"Output file was not created: {output_path}")
-            
             output_size = os.path.getsize(output_path)
             if output_size < 100:
                 raise ValueError(f"Output file is too small ({output_size} bytes), conversion may have failed")
-            
+
             logger.info(f"✅ Conversion complete: {output_path}")
             logger.info(f"📊 Output file size: {output_size / (1024*1024):.2f} MB ({output_size} bytes)")
-            
+
             return output_path
-            
+
         except Exception as e:
             logger.error(f"❌ Audio conversion failed: {e}", exc_info=True)
+            if not copy_on_failure:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
             # Fallback: just copy the file if conversion fails
             import shutil
             logger.warning(f"⚠️ Conversion failed, copying original file instead")
             shutil.copy2(input_path, output_path)
-            
+
             # Validate fallback
             if os.path.exists(output_path):
-                if hasattr(os, 'sync'):
-                    os.sync()
                 output_size = os.path.getsize(output_path)
                 logger.info(f"✅ Fallback copy complete: {output_size / (1024*1024):.2f} MB")
-            
+
             return output_path
 
+    def export_formats(self, input_path: str, output_paths: dict, sample_rate: int = 44100,
+                       mp3_bitrate_kbps: int = 320, wav_bit_depth: int = 16) -> dict:
+        """
+        Decode and resample input_path once, then encode every requested format concurrently
+
+        Args:
+            input_path: Mastered audio file
+            output_paths: Mapping of output format (MP3, WAV, ...) to destination path
+            sample_rate: Target sample rate shared by all outputs
+
+        Returns:
+            dict: decode_seconds and a per-format list of path, size and encode_seconds
+        """
+        unsupported = [fmt for fmt in output_paths if fmt.upper() not in self.supported_formats]
+        if unsupported:
+            raise ValueError(f"Unsupported format(s): {', '.join(unsupported)}")
+
+        started = time.perf_counter()
+        data, source_rate = read_audio(input_path)
+        data = self.resample(data, source_rate, sample_rate)
+        decode_seconds = time.perf_counter() - started
+        logger.info(f"📂 Decoded {input_path} once for {len(output_paths)} format(s) in {decode_seconds:.2f}s")
+
+        options = {"mp3_bitrate_kbps": mp3_bitrate_kbps, "wav_bit_depth": wav_bit_depth}
+
+        def encode_one(output_format: str, output_path: str) -> dict:
+            encode_started = time.perf_counter()
+            self.encode(data, sample_rate, output_path, output_format, **options)
+            return {
+                "format": output_format.upper(),
+                "path": output_path,
+                "size": os.path.getsize(output_path),
+                "encode_seconds": time.perf_counter() - encode_started,
+            }
+
+        # libsndfile calls and ffmpeg pipe writes release the GIL, so threads encode in parallel
+        with ThreadPoolExecutor(max_workers=len(output_paths)) as pool:
+            futures = [pool.submit(encode_one, fmt, path) for fmt, path in output_paths.items()]
+            outputs = [future.result() for future in futures]
+
+        for output in outputs:
+            logger.info(f"✅ {output['format']}: {output['size'] / (1024*1024):.2f} MB in {output['encode_seconds']:.2f}s")
+
+        return {"decode_seconds": decode_seconds, "outputs": outputs}
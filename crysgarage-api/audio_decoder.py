@@ -0,0 +1,314 @@
+"""
+Format-sniffing audio decoder for CrysGarage
+Identifies the container from its header bytes and decodes straight to float32
+(frames, channels): WAV/FLAC/OGG/AIFF through libsndfile, MP3/AAC/M4A through
+one streaming ffmpeg pipe. Frame ranges are read without decoding the rest.
+Already decoded intermediates (see decoded_store) are memory-mapped instead.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DECODE_BLOCK_FRAMES = 65536
+# Enough to see past most ID3v2 tags without reading embedded cover art
+SNIFF_BYTES = 64 * 1024
+
+SNDFILE_FORMATS = {"WAV", "FLAC", "OGG", "AIFF"}
+FFMPEG_FORMATS = {"MP3", "AAC", "M4A"}
+
+# Decoded intermediate: raw little-endian float32 frames, described by a JSON sidecar
+RAW_SUFFIX = ".f32"
+RAW_META_SUFFIX = ".json"
+
+FORMAT_EXTENSIONS = {
+    "WAV": "wav",
+    "FLAC": "flac",
+    "OGG": "ogg",
+    "AIFF": "aiff",
+    "MP3": "mp3",
+    "AAC": "aac",
+    "M4A": "m4a",
+}
+
+
+def sniff_header(header: bytes) -> Optional[str]:
+    """Container of a file from its first bytes, or None if unrecognised"""
+    if len(header) >= 12 and header[:4] in (b"RIFF", b"RF64") and header[8:12] == b"WAVE":
+        return "WAV"
+    if header[:4] == b"fLaC":
+        return "FLAC"
+    if header[:4] == b"OggS":
+        return "OGG"
+    if len(header) >= 12 and header[:4] == b"FORM" and header[8:12] in (b"AIFF", b"AIFC"):
+        return "AIFF"
+    if len(header) >= 8 and header[4:8] == b"ftyp":
+        return "M4A"
+    if header[:3] == b"ID3" and len(header) >= 10:
+        # Synchsafe tag size, plus the optional footer; look at what follows the tag
+        size = 10 + ((header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9])
+        if header[5] & 0x10:
+            size += 10
+        if len(header) > size + 1:
+            return sniff_header(header[size:]) or "MP3"
+        return "MP3"
+    if len(header) >= 2 and header[0] == 0xFF:
+        if header[1] & 0xF6 == 0xF0:
+            # ADTS sync word with layer 00
+            return "AAC"
+        if header[1] & 0xE0 == 0xE0 and header[1] & 0x06:
+            # MPEG audio frame sync with layer I/II/III
+            return "MP3"
+    return None
+
+
+def sniff_format(path: str) -> Optional[str]:
+    with open(path, "rb") as f:
+        return sniff_header(f.read(SNIFF_BYTES))
+
+
+def _use_sndfile(container: Optional[str]) -> bool:
+    # Unrecognised headers are tried with libsndfile first, it fails fast
+    return container not in FFMPEG_FORMATS
+
+
+def _ffprobe(path: str) -> dict:
+    completed = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0",
+         "-show_entries", "stream=sample_rate,channels,duration:format=duration", "-of", "json", path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=False,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {path}: {completed.stderr.decode('utf-8', 'replace').strip()}")
+    data = json.loads(completed.stdout or b"{}")
+    if not data.get("streams"):
+        raise RuntimeError(f"No audio stream in {path}")
+    stream = data["streams"][0]
+    sample_rate = int(stream["sample_rate"])
+    duration = float(stream.get("duration") or data.get("format", {}).get("duration") or 0.0)
+    return {
+        "sample_rate": sample_rate,
+        "channels": int(stream["channels"]),
+        "frames": int(round(duration * sample_rate)),
+        "duration": duration,
+    }
+
+
+def raw_info(path: str) -> Optional[dict]:
+    """Metadata of a decoded intermediate, or None if path is not a complete one"""
+    if not path.endswith(RAW_SUFFIX):
+        return None
+    try:
+        with open(path + RAW_META_SUFFIX, "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return dict(meta, decoder="memmap")
+
+
+def probe(path: str) -> dict:
+    """
+    Stream metadata without decoding any audio
+
+    Returns:
+        dict: format, decoder ("sndfile", "ffmpeg" or "memmap"), sample_rate,
+              channels, frames and duration. Frame counts from ffmpeg are estimates.
+    """
+    info = raw_info(path)
+    if info is not None:
+        return info
+
+    container = sniff_format(path)
+    if _use_sndfile(container):
+        import soundfile as sf
+
+        try:
+            info = sf.info(path)
+            return {
+                "format": container or info.format,
+                "decoder": "sndfile",
+                "sample_rate": info.samplerate,
+                "channels": info.channels,
+                "frames": info.frames,
+                "duration": info.frames / info.samplerate,
+            }
+        except RuntimeError:
+            if container is not None:
+                raise
+
+    info = _ffprobe(path)
+    info.update(format=container, decoder="ffmpeg")
+    return info
+
+
+class _FFmpegSource:
+    """Decode one file to float32 frames over an ffmpeg stdout pipe"""
+
+    def __init__(self, path: str, sample_rate: int, channels: int, start_frame: int = 0):
+        self.channels = channels
+        seek_args = ["-ss", f"{start_frame / sample_rate:.6f}"] if start_frame else []
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", *seek_args, "-i", path,
+             "-map", "0:a:0", "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "pipe:1"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=self._stderr,
+        )
+
+    def read(self, frames: int) -> np.ndarray:
+        frame_bytes = 4 * self.channels
+        raw = self._process.stdout.read(frames * frame_bytes)
+        usable = len(raw) - len(raw) % frame_bytes
+        return np.frombuffer(raw[:usable], dtype="<f4").reshape(-1, self.channels).copy()
+
+    def close(self, check: bool = True):
+        if check:
+            self._process.stdout.close()
+            returncode = self._process.wait()
+        else:
+            # Caller stopped early; nothing more is needed from ffmpeg
+            self._process.kill()
+            self._process.wait()
+            self._process.stdout.close()
+            returncode = 0
+        self._stderr.seek(0)
+        message = self._stderr.read().decode("utf-8", "replace").strip()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg decode exited with {returncode}: {message}")
+
+
+def map_raw(path: str, info: dict, start_frame: int = 0, frames: Optional[int] = None) -> np.ndarray:
+    """
+    Map a decoded intermediate as (frames, channels) float32 without reading it
+
+    The mapping is copy-on-write: callers may modify the array in place, and
+    only the pages they touch are copied, never the file.
+    """
+    channels = info["channels"]
+    start_frame = min(start_frame, info["frames"])
+    count = info["frames"] - start_frame if frames is None or frames < 0 else min(frames, info["frames"] - start_frame)
+    if count <= 0:
+        return np.zeros((0, channels), dtype=np.float32)
+    mapped = np.memmap(path, dtype="<f4", mode="c", offset=start_frame * channels * 4, shape=(count, channels))
+    return np.asarray(mapped)
+
+
+def decode_to_raw(path: str, raw_path: str, block_frames: int = DECODE_BLOCK_FRAMES) -> dict:
+    """
+    Decode path once into a decoded intermediate at raw_path (ending in RAW_SUFFIX)
+
+    Both files are written under temporary names and renamed, sidecar last, so
+    a concurrent reader sees either a complete intermediate or none.
+
+    Returns:
+        dict: The sidecar metadata, as raw_info() reports it
+    """
+    info = probe(path)
+    suffix = f".{os.getpid()}.tmp"
+    frames = 0
+    try:
+        with open(raw_path + suffix, "wb") as f:
+            for block in iter_blocks(path, block_frames, info=info):
+                block.astype("<f4", copy=False).tofile(f)
+                frames += len(block)
+        meta = {
+            "format": info["format"],
+            "sample_rate": info["sample_rate"],
+            "channels": info["channels"],
+            "frames": frames,
+            "duration": frames / info["sample_rate"],
+        }
+        with open(raw_path + RAW_META_SUFFIX + suffix, "w") as f:
+            json.dump(meta, f)
+        os.replace(raw_path + suffix, raw_path)
+        os.replace(raw_path + RAW_META_SUFFIX + suffix, raw_path + RAW_META_SUFFIX)
+    finally:
+        for leftover in (raw_path + suffix, raw_path + RAW_META_SUFFIX + suffix):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return dict(meta, decoder="memmap")
+
+
+def iter_blocks(path: str, block_frames: int = DECODE_BLOCK_FRAMES, start_frame: int = 0,
+                frames: Optional[int] = None, info: Optional[dict] = None):
+    """
+    Yield (frames, channels) float32 blocks of path
+
+    Args:
+        start_frame: First frame to decode; earlier audio is skipped, not decoded
+        frames: Stop after this many frames (default: to the end)
+        info: Result of probe(path), if the caller already has it
+    """
+    info = info or probe(path)
+    remaining = frames if frames is not None else -1
+
+    if info["decoder"] == "memmap":
+        data = map_raw(path, info, start_frame, frames)
+        for start in range(0, len(data), block_frames):
+            # Copied out: stages edit blocks in place, and writing into the
+            # copy-on-write map would keep a private copy of every page touched
+            yield data[start:start + block_frames].copy()
+        return
+
+    if info["decoder"] == "sndfile":
+        import soundfile as sf
+
+        with sf.SoundFile(path) as source:
+            if start_frame:
+                source.seek(start_frame)
+            yield from source.blocks(blocksize=block_frames, frames=remaining, dtype="float32", always_2d=True)
+        return
+
+    source = _FFmpegSource(path, info["sample_rate"], info["channels"], start_frame)
+    finished = False
+    try:
+        while remaining != 0:
+            want = block_frames if remaining < 0 else min(block_frames, remaining)
+            block = source.read(want)
+            if not len(block):
+                break
+            if remaining > 0:
+                remaining -= len(block)
+            yield block
+        finished = True
+    finally:
+        source.close(check=finished and remaining != 0)
+
+
+def read_audio(path: str, start_frame: int = 0, frames: Optional[int] = None,
+               info: Optional[dict] = None):
+    """
+    Decode path (or a frame range of it) into memory
+
+    Returns:
+        tuple: (float32 array of shape (frames, channels), sample_rate)
+    """
+    info = info or probe(path)
+
+    if info["decoder"] == "memmap":
+        return map_raw(path, info, start_frame, frames), info["sample_rate"]
+
+    if info["decoder"] == "sndfile":
+        import soundfile as sf
+
+        with sf.SoundFile(path) as source:
+            if start_frame:
+                source.seek(start_frame)
+            data = source.read(frames if frames is not None else -1, dtype="float32", always_2d=True)
+        return data, info["sample_rate"]
+
+    blocks = list(iter_blocks(path, start_frame=start_frame, frames=frames, info=info))
+    if not blocks:
+        return np.zeros((0, info["channels"]), dtype=np.float32), info["sample_rate"]
+    return np.concatenate(blocks), info["sample_rate"]
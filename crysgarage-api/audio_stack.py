@@ -0,0 +1,101 @@
+"""
+Lazy loading and warm-up of the heavy audio stack for CrysGarage
+scipy, soundfile and pyloudnorm take seconds to import, so
+the API starts without them and loads them in the background instead
+"""
+
+import importlib
+import importlib.util
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HEAVY_MODULES = ("numpy", "scipy.signal", "soundfile", "pyloudnorm")
+# Project modules that pull the heavy stack in at import time
+DSP_MODULES = ("audio_decoder", "analysis", "mastering_chain", "genre_presets", "loudness", "preview", "matching")
+
+
+def _installed(name: str) -> bool:
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+# Checked from package metadata only, so this costs no heavy import
+AUDIO_PROCESSING_AVAILABLE = all(_installed(name.split(".")[0]) for name in HEAVY_MODULES)
+if not AUDIO_PROCESSING_AVAILABLE:
+    logger.warning("Audio processing libraries not available")
+
+_lock = threading.Lock()
+_state = {"state": "cold", "seconds": None, "error": None}
+
+
+def status() -> dict:
+    """Warm-up state for /health: cold, warming, ready or failed"""
+    return dict(_state)
+
+
+def _exercise_dsp():
+    """Run every DSP path once on a tiny file so lazy initialisation and JIT happen now"""
+    import numpy as np
+    import soundfile as sf
+    from audio_decoder import read_audio
+    from analysis import analyze_audio
+    from loudness import measure_file_loudness
+    from mastering_chain import MasteringChain
+
+    sr = 44100
+    noise = (0.1 * np.random.default_rng(0).standard_normal((sr, 2))).astype(np.float32)
+    fd, path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        sf.write(path, noise, sr)
+        audio, rate = read_audio(path)
+        analyze_audio(audio.T, rate)
+        measure_file_loudness(path)
+        MasteringChain(rate, audio.shape[1], gain_db=6.0, dither_bits=16).process(audio[:4096])
+    finally:
+        os.remove(path)
+
+
+def warm_up() -> dict:
+    """
+    Import the heavy modules and exercise them once; safe to call repeatedly
+
+    Also used as the process pool initializer, so every worker is warm before
+    it takes its first job. Workers are spawned rather than forked, so they
+    never inherit a half-finished import from the API process's warm-up thread.
+    """
+    with _lock:
+        if _state["state"] in ("ready", "failed"):
+            return status()
+        if not AUDIO_PROCESSING_AVAILABLE:
+            _state.update(state="failed", error="audio libraries not installed")
+            return status()
+
+        _state["state"] = "warming"
+        started = time.perf_counter()
+        try:
+            for name in HEAVY_MODULES + DSP_MODULES:
+                importlib.import_module(name)
+            _exercise_dsp()
+        except Exception as e:
+            logger.error(f"Audio stack warm-up failed: {e}", exc_info=True)
+            _state.update(state="failed", error=str(e), seconds=time.perf_counter() - started)
+            return status()
+
+        _state.update(state="ready", seconds=time.perf_counter() - started)
+        logger.info(f"Audio stack ready in {_state['seconds']:.2f}s (pid {os.getpid()})")
+        return status()
+
+
+def start_background_warm_up() -> threading.Thread:
+    """Warm up on a daemon thread so startup and /health never wait for it"""
+    thread = threading.Thread(target=warm_up, name="audio-stack-warmup", daemon=True)
+    thread.start()
+    return thread
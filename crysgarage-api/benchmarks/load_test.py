@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+CrysGarage load test
+Sends a mix of /master (per tier), /analyze-upload, /health and /tiers requests
+to the API at fixed rates. Reports throughput, p50/p95/p99 latency and error
+rates per endpoint, plus peak RSS and event loop stalls, and compares them with
+a stored baseline.
+
+Runs fully offline. By default the FastAPI app is served in this process through
+httpx's ASGI transport, with its startup and shutdown hooks. --url points it at
+a local uvicorn instead. Requires httpx.
+
+    python benchmarks/load_test.py                                  # 60 s default mix
+    python benchmarks/load_test.py --rate master_free=1 --rate health=20 --duration 30
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --server-pid 1234
+    python benchmarks/load_test.py --update-baseline                # record a new baseline
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "load_baseline.json")
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "crysgarage-load")
+
+# Requests per second for each endpoint, as Poisson arrivals
+ENDPOINTS = {
+    "master_free": {"path": "/master", "upload": True, "data": {"tier": "free"}},
+    "master_professional": {"path": "/master", "upload": True, "data": {"tier": "professional"}},
+    "master_advanced": {"path": "/master", "upload": True, "data": {"tier": "advanced"}},
+    "analyze": {"path": "/analyze-upload", "upload": True, "data": {}},
+    "health": {"path": "/health", "upload": False},
+    "tiers": {"path": "/tiers", "upload": False},
+}
+DEFAULT_RATES = {
+    "master_free": 0.1,
+    "master_professional": 0.1,
+    "master_advanced": 0.05,
+    "analyze": 0.2,
+    "health": 5.0,
+    "tiers": 2.0,
+}
+LOAD_GENRE = "afrobeats"
+
+# The event loop counts as stalled while it wakes up this much later than scheduled
+STALL_THRESHOLD = 0.05
+LAG_PROBE_INTERVAL = 0.02
+RSS_SAMPLE_INTERVAL = 0.2
+
+# Allowed p95 latency growth and absolute error rate before a run counts as a regression
+DEFAULT_LATENCY_THRESHOLD = 0.25
+DEFAULT_MAX_ERROR_RATE = 0.01
+# p95 growth below this many seconds is scheduler noise, not a regression
+LATENCY_FLOOR = 0.01
+
+
+class Uploads:
+    """
+    Synthetic WAV uploads, one rendering shared by every request
+
+    Each request gets a copy with its last two frames replaced by a per-run
+    nonce and a counter, so content hashes differ, even from earlier runs, and
+    the result cache and decoded store never short-circuit the work.
+    """
+
+    def __init__(self, seconds: float, sample_rate: int = 44100, channels: int = 2):
+        import numpy as np
+        import soundfile as sf
+
+        sys.path.insert(0, BENCH_DIR)
+        from synthetic_audio import GENERATORS
+
+        frames = int(seconds * sample_rate)
+        audio = GENERATORS["music"](0, frames, sample_rate, channels, np.random.default_rng(1234))
+        buffer = io.BytesIO()
+        sf.write(buffer, np.clip(audio, -1.0, 1.0), sample_rate, format="WAV", subtype="PCM_16")
+        self._wav = buffer.getvalue()
+        self._nonce = os.urandom(4)
+        self._count = 0
+
+    def next(self) -> bytes:
+        self._count += 1
+        body = bytearray(self._wav)
+        body[-8:] = self._nonce + (self._count & 0xFFFFFFFF).to_bytes(4, "little")
+        return bytes(body)
+
+
+class LagProbe:
+    """Sleep for a fixed interval on the event loop and record how late each wakeup is"""
+
+    def __init__(self, interval: float = LAG_PROBE_INTERVAL):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - scheduled))
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> dict:
+        self._task.cancel()
+        return {
+            "loop_lag_max_seconds": max(self.lags, default=0.0),
+            "loop_lag_p99_seconds": percentile(self.lags, 99),
+            "loop_stall_seconds": sum(lag for lag in self.lags if lag > STALL_THRESHOLD),
+        }
+
+
+def _tree_rss_bytes(root_pid: int) -> int:
+    """Resident memory of root_pid and all its descendants, from /proc"""
+    parents = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                # The command name may contain spaces; fields resume after its closing paren
+                fields = f.read().rpartition(")")[2].split()
+            parents[int(name)] = (int(fields[1]), int(fields[21]))
+        except (OSError, IndexError, ValueError):
+            continue
+
+    tree = {root_pid}
+    grew = True
+    while grew:
+        grew = False
+        for pid, (ppid, _) in parents.items():
+            if ppid in tree and pid not in tree:
+                tree.add(pid)
+                grew = True
+    page = os.sysconf("SC_PAGE_SIZE")
+    return sum(parents[pid][1] * page for pid in tree if pid in parents)
+
+
+class RssSampler:
+    """Peak resident memory of a process tree (the worker pool included), sampled on a thread"""
+
+    def __init__(self, pid: int, interval: float = RSS_SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.peak_bytes = max(self.peak_bytes, _tree_rss_bytes(self.pid))
+            except OSError:
+                pass
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if os.path.isdir("/proc"):
+            self._thread.start()
+
+    def stop(self) -> float:
+        """Peak in MB; without /proc, the peak of this process alone"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+            return self.peak_bytes / (1024 * 1024)
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def percentile(values: list, q: float):
+    """Nearest-rank percentile, or None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100.0 * len(ordered)) - 1)]
+
+
+async def _send(client, name: str, uploads: Uploads, genre: str, samples: list):
+    endpoint = ENDPOINTS[name]
+    started = time.perf_counter()
+    try:
+        if endpoint["upload"]:
+            data = dict(endpoint["data"], genre=genre, user_id="load-test", target_format="WAV")
+            files = {"audio": ("load.wav", uploads.next(), "audio/wav")}
+            response = await client.post(endpoint["path"], data=data, files=files)
+        else:
+            response = await client.get(endpoint["path"])
+        outcome = response.status_code
+    except Exception as e:
+        outcome = type(e).__name__
+    samples.append((name, outcome, time.perf_counter() - started))
+
+
+async def _drive(client, name: str, rate: float, duration: float, seed: int, uploads: Uploads, genre: str,
+                 samples: list, pending: set, max_in_flight: int, dropped: dict):
+    """Open-loop Poisson arrivals: requests are sent on schedule whether or not earlier ones finished"""
+    loop = asyncio.get_event_loop()
+    rng = random.Random(seed)
+    deadline = loop.time() + duration
+    next_at = loop.time()
+    while True:
+        next_at += rng.expovariate(rate)
+        if next_at >= deadline:
+            return
+        await asyncio.sleep(max(0.0, next_at - loop.time()))
+        if len(pending) >= max_in_flight:
+            # The client is saturated; count the arrival rather than queue it here
+            dropped[name] = dropped.get(name, 0) + 1
+            continue
+        task = asyncio.ensure_future(_send(client, name, uploads, genre, samples))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+
+def summarize(samples: list, dropped: dict, elapsed: float) -> dict:
+    endpoints = {}
+    for name in sorted({sample[0] for sample in samples} | set(dropped)):
+        mine = [sample for sample in samples if sample[0] == name]
+        ok = [latency for _, outcome, latency in mine if isinstance(outcome, int) and outcome < 400]
+        rejected = sum(1 for _, outcome, _ in mine if outcome == 429)
+        errors = len(mine) - len(ok) - rejected
+        endpoints[name] = {
+            "requests": len(mine),
+            "ok": len(ok),
+            "errors": errors,
+            "rejected": rejected,
+            "dropped": dropped.get(name, 0),
+            "error_rate": errors / len(mine) if mine else 0.0,
+            "throughput_rps": len(ok) / elapsed if elapsed > 0 else 0.0,
+            "p50_seconds": percentile(ok, 50),
+            "p95_seconds": percentile(ok, 95),
+            "p99_seconds": percentile(ok, 99),
+            "max_seconds": max(ok, default=None),
+            "outcomes": {str(outcome): sum(1 for _, o, _ in mine if o == outcome)
+                         for outcome in sorted({o for _, o, _ in mine}, key=str)},
+        }
+    return endpoints
+
+
+async def _server_lag(client) -> dict:
+    """Lag sum and max from a server's /metrics (uvicorn mode, one API process)"""
+    response = await client.get("/metrics")
+    values = {}
+    for line in response.text.splitlines():
+        if line.startswith(("crysgarage_event_loop_lag_seconds_sum", "crysgarage_event_loop_lag_max_seconds")):
+            name, _, value = line.partition(" ")
+            values[name] = float(value)
+    return values
+
+
+async def _wait_ready(client, timeout: float = 300.0):
+    """Wait for the API's audio stack warm-up, so the first masters do not pay for it"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        state = (await client.get("/health")).json().get("warmup", {}).get("state")
+        if state in ("ready", "failed", None):
+            return
+        await asyncio.sleep(0.25)
+
+
+async def run_load(args, rates: dict) -> dict:
+    import httpx
+
+    uploads = Uploads(args.audio_seconds)
+    samples, pending, dropped = [], set(), {}
+    timeout = httpx.Timeout(args.timeout)
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=timeout)
+        lifespan = None
+        server_pid = args.server_pid
+    else:
+        os.environ.setdefault("PROCESSED_FILES_DIR", os.path.join(args.workdir, "processed"))
+        os.environ.setdefault("UPLOAD_DIR", os.path.join(args.workdir, "uploads"))
+        sys.path.insert(0, API_DIR)
+        import main
+
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://load-test",
+                                   timeout=timeout)
+        lifespan = main.app.router.lifespan_context(main.app)
+        server_pid = os.getpid()
+
+    rss = RssSampler(server_pid) if server_pid else None
+    probe = LagProbe()
+    async with client:
+        if lifespan is not None:
+            await lifespan.__aenter__()
+        try:
+            await _wait_ready(client)
+            before = await _server_lag(client) if args.url else None
+            if rss is not None:
+                rss.start()
+            probe.start()
+            started = time.perf_counter()
+            await asyncio.gather(*[
+                _drive(client, name, rate, args.duration, args.seed + i, uploads, args.genre, samples, pending,
+                       args.max_in_flight, dropped)
+                for i, (name, rate) in enumerate(sorted(rates.items())) if rate > 0
+            ])
+            if pending:
+                await asyncio.wait(set(pending), timeout=args.drain)
+            elapsed = time.perf_counter() - started
+            lag = probe.stop()
+            for task in list(pending):
+                task.cancel()
+            unfinished = len(pending)
+            if args.url:
+                # The harness's own loop says nothing about the server's; use its monitor instead
+                after = await _server_lag(client)
+                key = "crysgarage_event_loop_lag_seconds_sum"
+                lag = {
+                    "loop_lag_max_seconds": after.get("crysgarage_event_loop_lag_max_seconds"),
+                    "loop_stall_seconds": after.get(key, 0.0) - before.get(key, 0.0),
+                }
+        finally:
+            if lifespan is not None:
+                await lifespan.__aexit__(None, None, None)
+
+    return {
+        "duration_seconds": elapsed,
+        "unfinished": unfinished,
+        "throughput_rps": sum(1 for _, outcome, _ in samples if isinstance(outcome, int) and outcome < 400) / elapsed,
+        "peak_rss_mb": rss.stop() if rss is not None else None,
+        **lag,
+        "endpoints": summarize(samples, dropped, elapsed),
+    }
+
+
+def compare(result: dict, baseline: dict, latency_threshold: float, max_error_rate: float) -> list:
+    """Return human-readable regressions of result against baseline and the error budget"""
+    regressions = []
+    for name, stats in result["endpoints"].items():
+        if stats["error_rate"] > max_error_rate:
+            regressions.append(f"{name}: error rate {stats['error_rate']:.1%} > {max_error_rate:.1%}")
+        reference = baseline.get("endpoints", {}).get(name)
+        if reference is None or reference.get("p95_seconds") is None or stats["p95_seconds"] is None:
+            continue
+        limit = max(reference["p95_seconds"] * (1 + latency_threshold), reference["p95_seconds"] + LATENCY_FLOOR)
+        if stats["p95_seconds"] > limit:
+            regressions.append(
+                f"{name}: p95 {stats['p95_seconds']:.3f}s vs baseline {reference['p95_seconds']:.3f}s"
+            )
+    reference = baseline.get("loop_stall_seconds")
+    # A floor so a baseline of almost no stall does not flag scheduler noise
+    if reference is not None and result["loop_stall_seconds"] > max(reference * (1 + latency_threshold), 0.25):
+        regressions.append(
+            f"event loop stalled {result['loop_stall_seconds']:.2f}s vs baseline {reference:.2f}s"
+        )
+    return regressions
+
+
+def _format_seconds(value) -> str:
+    return f"{value:.3f}" if value is not None else "-"
+
+
+def print_report(result: dict):
+    print(f"{'endpoint':<22} {'reqs':>6} {'ok':>6} {'err%':>6} {'429':>5} {'rps':>7} "
+          f"{'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'max s':>8}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:<22} {stats['requests']:>6} {stats['ok']:>6} {stats['error_rate'] * 100:>6.1f} "
+              f"{stats['rejected']:>5} {stats['throughput_rps']:>7.2f} {_format_seconds(stats['p50_seconds']):>8} "
+              f"{_format_seconds(stats['p95_seconds']):>8} {_format_seconds(stats['p99_seconds']):>8} "
+              f"{_format_seconds(stats['max_seconds']):>8}")
+        if stats["dropped"]:
+            print(f"  {stats['dropped']} arrivals dropped at --max-in-flight")
+    peak = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "-"
+    print(f"total {result['throughput_rps']:.2f} rps over {result['duration_seconds']:.1f}s, "
+          f"peak RSS {peak}, loop lag max {_format_seconds(result['loop_lag_max_seconds'])}s, "
+          f"stalled {result['loop_stall_seconds']:.2f}s, unfinished {result['unfinished']}")
+
+
+def _parse_rates(values: list) -> dict:
+    if not values:
+        return dict(DEFAULT_RATES)
+    rates = {name: 0.0 for name in ENDPOINTS}
+    for value in values:
+        name, _, rate = value.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {name!r}; choose from {', '.join(ENDPOINTS)}")
+        rates[name] = float(rate)
+    return rates
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", action="append", metavar="ENDPOINT=RPS",
+                        help=f"Request rate per endpoint, repeatable; unlisted endpoints get none "
+                             f"(endpoints: {', '.join(ENDPOINTS)})")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of arrivals")
+    parser.add_argument("--drain", type=float, default=600.0, help="Seconds to wait for requests still running")
+    parser.add_argument("--audio-seconds", type=float, default=10.0, help="Length of each synthetic upload")
+    parser.add_argument("--genre", default=LOAD_GENRE)
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=600.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--url", help="Local uvicorn to load instead of the in-process app")
+    parser.add_argument("--server-pid", type=int, help="With --url: sample this process tree's RSS")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="In-process mode: PROCESSED_FILES_DIR and UPLOAD_DIR")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="Write results as the new baseline")
+    parser.add_argument("--output", help="Also write raw results as JSON here")
+    parser.add_argument("--latency-threshold", type=float, default=DEFAULT_LATENCY_THRESHOLD)
+    parser.add_argument("--max-error-rate", type=float, default=DEFAULT_MAX_ERROR_RATE)
+    args = parser.parse_args(argv)
+
+    try:
+        rates = _parse_rates(args.rate)
+    except (argparse.ArgumentTypeError, ValueError) as e:
+        parser.error(str(e))
+
+    result = asyncio.run(run_load(args, rates))
+    result["rates"] = rates
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    baseline = {}
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; only the error budget is checked")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("rates") != rates:
+            print("Baseline was recorded with different rates; its latencies may not be comparable")
+    regressions = compare(result, baseline, args.latency_threshold, args.max_error_rate)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
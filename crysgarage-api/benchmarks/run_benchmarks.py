@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+CrysGarage benchmark suite
+Measures wall time, peak RSS and realtime factor for mastering, analysis and
+format conversion on synthetic audio (mastering also per stage), plus API import and audio-stack warm-up
+time, and compares them with a stored baseline
+
+Runs fully offline. Every case executes in a fresh interpreter so peak RSS is
+not polluted by earlier cases.
+
+    python benchmarks/run_benchmarks.py                     # quick suite
+    python benchmarks/run_benchmarks.py --suite full        # 30 s to 20 min, 44.1/48/96 kHz
+    python benchmarks/run_benchmarks.py --update-baseline   # record a new baseline
+
+The first run on a machine (no baseline file yet) records the baseline
+instead of comparing. MP3 and AAC conversion cases are skipped when ffmpeg
+is not installed.
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "crysgarage-bench")
+
+# Allowed slowdown / growth before a case counts as a regression
+DEFAULT_TIME_THRESHOLD = 0.20
+DEFAULT_RSS_THRESHOLD = 0.25
+# Preset used by the master_genre cases
+BENCH_GENRE = "afrobeats"
+# Output formats encoded through the ffmpeg binary
+FFMPEG_OUTPUT_FORMATS = ("MP3", "AAC")
+
+
+def _case(path: str, signal: str, sample_rate: int, channels: int, seconds: float, fmt: str = "WAV") -> dict:
+    return {
+        "path": path,
+        "signal": signal,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "seconds": seconds,
+        "format": fmt,
+    }
+
+
+def case_key(case: dict) -> str:
+    return "{path}:{signal}:{sample_rate}:{channels}ch:{seconds:g}s:{format}".format(**case)
+
+
+STARTUP_CASES = [
+    # Cold `import main`: must stay cheap because /health waits on it
+    _case("import_main", "none", 0, 0, 0),
+    # Background import + first-call warm-up of scipy/soundfile/pyloudnorm
+    _case("warm_up", "none", 0, 0, 0),
+]
+
+
+def build_suite(name: str) -> list:
+    if name == "quick":
+        cases = list(STARTUP_CASES) + [
+            _case("master", "music", 44100, 2, 30),
+            _case("master_streaming", "music", 44100, 2, 30),
+            _case("master_genre", "music", 44100, 2, 30),
+            _case("analyze", "music", 44100, 2, 30),
+            _case("analyze", "music", 44100, 1, 30),
+        ]
+        cases += [_case("convert", "music", 44100, 2, 30, fmt) for fmt in ("MP3", "WAV", "FLAC", "OGG", "AAC")]
+        return cases
+
+    cases = list(STARTUP_CASES)
+    for seconds in (30, 180, 600, 1200):
+        for sample_rate in (44100, 48000, 96000):
+            cases.append(_case("master", "music", sample_rate, 2, seconds))
+            cases.append(_case("master_streaming", "music", sample_rate, 2, seconds))
+            cases.append(_case("master_genre", "music", sample_rate, 2, seconds))
+            cases.append(_case("analyze", "music", sample_rate, 2, seconds))
+        cases.append(_case("master", "sine", 44100, 1, seconds))
+        cases.append(_case("analyze", "noise", 48000, 1, seconds))
+        for fmt in ("MP3", "WAV", "FLAC", "OGG", "AAC"):
+            cases.append(_case("convert", "music", 48000, 2, seconds, fmt))
+    return cases
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_case_in_child(case: dict, workdir: str) -> dict:
+    """Body of the child interpreter: run one case and measure it"""
+    sys.path.insert(0, API_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    os.environ.setdefault("PROCESSED_FILES_DIR", os.path.join(workdir, "processed"))
+    os.environ.setdefault("UPLOAD_DIR", os.path.join(workdir, "uploads"))
+
+    if case["path"] == "import_main":
+        run = lambda: __import__("main")
+        return _measure(run, case)
+    if case["path"] == "warm_up":
+        import audio_stack
+        run = audio_stack.warm_up
+        return _measure(run, case)
+
+    from synthetic_audio import ensure_signal
+
+    input_path = ensure_signal(workdir, case["signal"], case["sample_rate"], case["channels"], case["seconds"])
+    output_dir = os.path.join(workdir, "out")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Import outside the timed region; import cost is measured separately
+    stats = None
+    if case["path"] in ("master", "master_streaming", "master_genre"):
+        import main
+        stats = {}
+        run = lambda: main.process_audio_file(
+            input_path, os.path.join(output_dir, "master.wav"), tier="professional",
+            genre=BENCH_GENRE if case["path"] == "master_genre" else "default",
+            streaming=case["path"] == "master_streaming", stats=stats,
+        )
+    elif case["path"] == "analyze":
+        from analysis import analyze_file
+        run = lambda: analyze_file(input_path)
+    elif case["path"] == "convert":
+        from audio_converter import AudioConverter, FILE_EXTENSIONS
+        converter = AudioConverter()
+        output_path = os.path.join(output_dir, f"converted.{FILE_EXTENSIONS[case['format']]}")
+        # A failed encode must fail the case, not time a file copy
+        run = lambda: converter.convert_audio(input_path, output_path, case["format"], 44100,
+                                              copy_on_failure=False)
+    else:
+        raise ValueError(f"Unknown benchmark path: {case['path']}")
+
+    return _measure(run, case, stats)
+
+
+def _measure(run, case: dict, stats: dict = None) -> dict:
+    rss_before = _peak_rss_mb()
+    started = time.perf_counter()
+    run()
+    wall = time.perf_counter() - started
+    peak_rss = _peak_rss_mb()
+
+    result = {
+        "wall_seconds": wall,
+        "peak_rss_mb": peak_rss,
+        "rss_growth_mb": peak_rss - rss_before,
+        "realtime_factor": case["seconds"] / wall if case["seconds"] and wall > 0 else None,
+    }
+    if stats and stats.get("stages"):
+        # Per-stage throughput as a realtime factor: audio seconds per second spent in the stage
+        result["stage_realtime_factors"] = {
+            stage: case["seconds"] / seconds if seconds > 0 else None
+            for stage, seconds in stats["stages"].items()
+        }
+    return result
+
+
+def skip_reason(case: dict):
+    """Why case cannot run on this machine, or None"""
+    if case["path"] == "convert" and case["format"] in FFMPEG_OUTPUT_FORMATS and shutil.which("ffmpeg") is None:
+        return "ffmpeg not installed"
+    return None
+
+
+def run_case(case: dict, workdir: str) -> dict:
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", json.dumps(case), "--workdir", workdir],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{case_key(case)} failed:\n{completed.stderr}")
+    # Libraries may log to stdout; the result is always the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results: dict, baseline: dict, time_threshold: float, rss_threshold: float) -> list:
+    """Return human-readable regressions of results against baseline"""
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        if result["wall_seconds"] > reference["wall_seconds"] * (1 + time_threshold):
+            regressions.append(
+                f"{key}: wall {result['wall_seconds']:.3f}s vs baseline {reference['wall_seconds']:.3f}s"
+            )
+        if result["peak_rss_mb"] > reference["peak_rss_mb"] * (1 + rss_threshold):
+            regressions.append(
+                f"{key}: peak RSS {result['peak_rss_mb']:.0f} MB vs baseline {reference['peak_rss_mb']:.0f} MB"
+            )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", choices=("quick", "full"), default="quick")
+    parser.add_argument("--only", help="Run only cases whose key contains this substring")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="Where synthetic inputs and outputs live")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="Write results as the new baseline")
+    parser.add_argument("--output", help="Also write raw results as JSON here")
+    parser.add_argument("--time-threshold", type=float, default=DEFAULT_TIME_THRESHOLD)
+    parser.add_argument("--rss-threshold", type=float, default=DEFAULT_RSS_THRESHOLD)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_case_in_child(json.loads(args.child), args.workdir)))
+        return 0
+
+    cases = build_suite(args.suite)
+    if args.only:
+        cases = [case for case in cases if args.only in case_key(case)]
+
+    results = {}
+    print(f"{'case':<52} {'wall s':>9} {'peak MB':>9} {'x realtime':>11}")
+    for case in cases:
+        key = case_key(case)
+        reason = skip_reason(case)
+        if reason is not None:
+            print(f"{key:<52} skipped: {reason}")
+            continue
+        result = run_case(case, args.workdir)
+        results[key] = result
+        realtime = f"{result['realtime_factor']:.1f}" if result["realtime_factor"] is not None else "-"
+        print(f"{key:<52} {result['wall_seconds']:>9.3f} {result['peak_rss_mb']:>9.0f} {realtime:>11}")
+        for stage, factor in result.get("stage_realtime_factors", {}).items():
+            stage_realtime = f"{factor:.1f}" if factor is not None else "-"
+            print(f"  {stage:<50} {'':>9} {'':>9} {stage_realtime:>11}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        # The first run on a machine records its baseline; later runs compare against it
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline {'updated' if args.update_baseline else 'recorded'}: {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.time_threshold, args.rss_threshold)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
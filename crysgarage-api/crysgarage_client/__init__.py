@@ -0,0 +1,12 @@
+"""
+CrysGarage Python client
+Sync (CrysGarageClient) and asyncio (AsyncCrysGarageClient) clients with
+connection pooling, streamed uploads and downloads, retries and job polling.
+Requires httpx.
+"""
+
+from ._common import CrysGarageError, JobFailed
+from .aio import AsyncCrysGarageClient
+from .client import CrysGarageClient
+
+__all__ = ["AsyncCrysGarageClient", "CrysGarageClient", "CrysGarageError", "JobFailed"]
@@ -0,0 +1,97 @@
+"""
+Shared pieces of the sync and async CrysGarage clients: errors, retry policy
+and request helpers that do no I/O
+"""
+
+import random
+
+import httpx
+
+DEFAULT_BASE_URL = "https://crysgarage.studio/api/v1"
+# Submissions return quickly; long reads only happen on downloads
+DEFAULT_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+DEFAULT_MAX_CONNECTIONS = 20
+
+# Responses worth retrying: queue full, proxy errors and restarts
+RETRY_STATUSES = {429, 502, 503, 504}
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 60.0
+
+# Files at least this large go through the resumable upload endpoints
+RESUMABLE_THRESHOLD = 64 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 5.0
+FINISHED_STATUSES = {"completed", "failed", "cancelled"}
+
+EXPORT_FIELDS = ("target_format", "target_sample_rate", "mp3_bitrate_kbps", "wav_bit_depth")
+
+
+class CrysGarageError(Exception):
+    """An error response from the API"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float = None):
+        super().__init__(f"HTTP {status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class JobFailed(CrysGarageError):
+    """A job finished as failed or cancelled; job holds its last status"""
+
+    def __init__(self, job: dict):
+        super().__init__(500, job.get("error") or job["status"])
+        self.job = job
+
+
+def retry_after_seconds(response: httpx.Response):
+    value = response.headers.get("retry-after", "")
+    return float(value) if value.isdigit() else None
+
+
+def error_from_response(response: httpx.Response) -> CrysGarageError:
+    try:
+        detail = response.json().get("detail", response.text)
+    except ValueError:
+        detail = response.text
+    return CrysGarageError(response.status_code, str(detail), retry_after_seconds(response))
+
+
+def should_retry(response: httpx.Response) -> bool:
+    return response.status_code in RETRY_STATUSES
+
+
+def retry_delay(attempt: int, backoff: float, response: httpx.Response = None) -> float:
+    """Seconds before retry number attempt: the server's Retry-After, else jittered exponential backoff"""
+    if response is not None:
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return min(retry_after, MAX_BACKOFF)
+    return min(MAX_BACKOFF, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def form_fields(tier: str, genre: str, export: dict = None) -> dict:
+    """Form data for mastering requests; export uses the /master field names"""
+    fields = {"tier": tier, "genre": genre}
+    for name, value in (export or {}).items():
+        if name not in EXPORT_FIELDS:
+            raise ValueError(f"Unknown export option: {name} (expected one of {', '.join(EXPORT_FIELDS)})")
+        if value is not None:
+            fields[name] = str(value)
+    return fields
+
+
+def download_params(tier: str = None, format: str = None) -> dict:
+    return {name: value for name, value in (("tier", tier), ("format", format)) if value is not None}
+
+
+def next_poll_interval(interval: float) -> float:
+    return min(interval * 1.5, MAX_POLL_INTERVAL)
+
+
+def batch_entry(path: str) -> dict:
+    return {"path": path, "job_id": None, "status": "pending", "result": None, "error": None, "output_path": None}
@@ -0,0 +1,245 @@
+"""
+Asyncio CrysGarage client
+Same API as CrysGarageClient on one pooled httpx.AsyncClient; resumable chunk
+reads and download writes run in the default executor so they do not stall the loop
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+import httpx
+
+from ._common import (
+    DEFAULT_BACKOFF,
+    DEFAULT_BASE_URL,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_TIMEOUT,
+    DOWNLOAD_CHUNK_SIZE,
+    FINISHED_STATUSES,
+    POLL_INTERVAL,
+    RESUMABLE_THRESHOLD,
+    UPLOAD_CHUNK_SIZE,
+    CrysGarageError,
+    JobFailed,
+    batch_entry,
+    download_params,
+    error_from_response,
+    form_fields,
+    next_poll_interval,
+    retry_delay,
+    should_retry,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _read_range(path: str, offset: int, size: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+class AsyncCrysGarageClient:
+    """
+    Non-blocking client for the CrysGarage API
+
+    Usage:
+        async with AsyncCrysGarageClient() as client:
+            results = await client.master_many(paths, tier="professional", download_dir="out")
+
+    Retries, resumable uploads and resumable downloads behave as in CrysGarageClient.
+    """
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, timeout=DEFAULT_TIMEOUT,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS, max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF, headers: dict = None, http_client: httpx.AsyncClient = None):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._http = http_client or httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers=headers,
+        )
+
+    async def close(self):
+        await self._http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _request(self, method: str, url: str, files: dict = None, **kwargs) -> httpx.Response:
+        """
+        Send a request with retries
+
+        files maps form field -> local path, streamed from disk on every attempt.
+        """
+        attempt = 0
+        while True:
+            handles = {}
+            try:
+                for field, path in (files or {}).items():
+                    handles[field] = (os.path.basename(path), open(path, "rb"))
+                response = await self._http.request(method, url, files=handles or None, **kwargs)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_delay(attempt, self.backoff)
+                logger.warning(f"{method} {url} failed ({e!r}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code < 400:
+                    return response
+                if not should_retry(response) or attempt >= self.max_retries:
+                    raise error_from_response(response)
+                delay = retry_delay(attempt, self.backoff, response)
+                logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            finally:
+                for _, handle in handles.values():
+                    handle.close()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def health(self) -> dict:
+        return (await self._request("GET", "/health")).json()
+
+    async def tiers(self) -> dict:
+        return (await self._request("GET", "/tiers")).json()
+
+    async def queue_stats(self) -> dict:
+        return (await self._request("GET", "/queue/stats")).json()
+
+    async def job(self, job_id: str) -> dict:
+        return (await self._request("GET", f"/jobs/{job_id}")).json()
+
+    async def submit(self, path: str, tier: str = "professional", genre: str = "default",
+                     export: dict = None) -> str:
+        """Upload path and queue it for mastering; returns the job id (see CrysGarageClient.submit)"""
+        if os.path.getsize(path) >= RESUMABLE_THRESHOLD:
+            return await self.upload_resumable(path, tier, genre, export)
+        response = await self._request("POST", "/jobs", files={"audio": path}, data=form_fields(tier, genre, export))
+        return response.json()["job_id"]
+
+    async def upload_resumable(self, path: str, tier: str = "advanced", genre: str = "default",
+                               export: dict = None, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+        """Upload path in checksummed, resumable chunks, then queue it; returns the job id"""
+        loop = asyncio.get_event_loop()
+        size = os.path.getsize(path)
+        session = (await self._request("POST", "/uploads", data={
+            "filename": os.path.basename(path), "size": str(size), "tier": tier,
+        })).json()
+        upload_url = f"/uploads/{session['upload_id']}"
+
+        offset = session["offset"]
+        conflicts = 0
+        while offset < size:
+            chunk = await loop.run_in_executor(None, _read_range, path, offset, chunk_size)
+            headers = {
+                "Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{size}",
+                "X-Chunk-SHA256": hashlib.sha256(chunk).hexdigest(),
+            }
+            try:
+                offset = (await self._request("PUT", upload_url, content=chunk, headers=headers)).json()["offset"]
+                conflicts = 0
+            except CrysGarageError as e:
+                # Same recovery as the sync client: resync the offset and resend
+                if e.status_code not in (400, 409) or conflicts >= self.max_retries:
+                    raise
+                await asyncio.sleep(retry_delay(conflicts, self.backoff))
+                conflicts += 1
+                offset = int((await self._request("HEAD", upload_url)).headers["upload-offset"])
+
+        response = await self._request("POST", f"{upload_url}/finalize", data=form_fields(tier, genre, export))
+        return response.json()["job_id"]
+
+    async def wait(self, job_id: str, timeout: float = None, poll_interval: float = POLL_INTERVAL) -> dict:
+        """Poll a job until it finishes and return its result; raises JobFailed or TimeoutError"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            job = await self.job(job_id)
+            if job["status"] in FINISHED_STATUSES:
+                if job["status"] != "completed":
+                    raise JobFailed(job)
+                return job["result"]
+            if deadline is not None and time.monotonic() + poll_interval > deadline:
+                raise TimeoutError(f"Job {job_id} still {job['status']} after {timeout}s")
+            await asyncio.sleep(poll_interval)
+            poll_interval = next_poll_interval(poll_interval)
+
+    async def master(self, path: str, tier: str = "professional", genre: str = "default", export: dict = None,
+                     timeout: float = None) -> dict:
+        """Submit path and wait for the finished master"""
+        return await self.wait(await self.submit(path, tier, genre, export), timeout=timeout)
+
+    async def download(self, file_id: str, output_path: str, tier: str = None, format: str = None) -> str:
+        """Stream a finished master to output_path, resuming interrupted transfers (see CrysGarageClient.download)"""
+        loop = asyncio.get_event_loop()
+        part_path = output_path + ".part"
+        params = download_params(tier, format)
+        etag = None
+        attempt = 0
+        while True:
+            headers = {}
+            if etag is not None and os.path.exists(part_path):
+                headers = {"Range": f"bytes={os.path.getsize(part_path)}-", "If-Range": etag}
+            try:
+                async with self._http.stream("GET", f"/download/{file_id}", params=params,
+                                             headers=headers) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                        if not should_retry(response) or attempt >= self.max_retries:
+                            raise error_from_response(response)
+                        delay = retry_delay(attempt, self.backoff, response)
+                    else:
+                        etag = response.headers.get("etag")
+                        with open(part_path, "ab" if response.status_code == 206 else "wb") as f:
+                            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                                await loop.run_in_executor(None, f.write, chunk)
+                        os.replace(part_path, output_path)
+                        return output_path
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_delay(attempt, self.backoff)
+                logger.warning(f"Download of {file_id} interrupted ({e!r}), resuming in {delay:.1f}s")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _master_one(self, entry: dict, tier: str, genre: str, export: dict, download_dir: str,
+                          timeout: float) -> dict:
+        try:
+            entry["job_id"] = await self.submit(entry["path"], tier, genre, export)
+            entry["result"] = await self.wait(entry["job_id"], timeout=timeout)
+            if download_dir is not None:
+                extension = os.path.splitext(entry["result"]["processed_file"])[1]
+                name = os.path.splitext(os.path.basename(entry["path"]))[0]
+                entry["output_path"] = await self.download(
+                    entry["result"]["file_id"], os.path.join(download_dir, f"{name}_mastered{extension}"),
+                    tier=tier, format=extension.lstrip(".").upper() or None,
+                )
+            entry["status"] = "completed"
+        except Exception as e:
+            logger.error(f"Mastering {entry['path']} failed: {e}")
+            entry.update(status="failed", error=str(e))
+        return entry
+
+    async def master_many(self, paths: list, tier: str = "professional", genre: str = "default",
+                          export: dict = None, download_dir: str = None, concurrency: int = 4,
+                          timeout: float = None) -> list:
+        """Master many files with at most concurrency in flight (see CrysGarageClient.master_many)"""
+        if download_dir is not None:
+            os.makedirs(download_dir, exist_ok=True)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(entry: dict) -> dict:
+            async with semaphore:
+                return await self._master_one(entry, tier, genre, export, download_dir, timeout)
+
+        return await asyncio.gather(*[bounded(batch_entry(path)) for path in paths])
@@ -0,0 +1,258 @@
+"""
+Synchronous CrysGarage client
+One pooled httpx.Client shared by every call (and every thread in master_many)
+"""
+
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from ._common import (
+    DEFAULT_BACKOFF,
+    DEFAULT_BASE_URL,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_TIMEOUT,
+    DOWNLOAD_CHUNK_SIZE,
+    FINISHED_STATUSES,
+    POLL_INTERVAL,
+    RESUMABLE_THRESHOLD,
+    UPLOAD_CHUNK_SIZE,
+    CrysGarageError,
+    JobFailed,
+    batch_entry,
+    download_params,
+    error_from_response,
+    form_fields,
+    next_poll_interval,
+    retry_delay,
+    should_retry,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CrysGarageClient:
+    """
+    Blocking client for the CrysGarage API
+
+    Usage:
+        with CrysGarageClient() as client:
+            result = client.master("song.wav", tier="professional")
+            client.download(result["file_id"], "song_mastered.wav", tier="professional")
+
+    Transport errors and 429/502/503/504 responses are retried with
+    exponential backoff (honouring Retry-After). Retrying a submission is safe:
+    the server deduplicates identical uploads through its result cache.
+    """
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, timeout=DEFAULT_TIMEOUT,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS, max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF, headers: dict = None, http_client: httpx.Client = None):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._http = http_client or httpx.Client(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers=headers,
+        )
+
+    def close(self):
+        self._http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, method: str, url: str, files: dict = None, **kwargs) -> httpx.Response:
+        """
+        Send a request with retries
+
+        files maps form field -> local path; the files are reopened on every
+        attempt and streamed from disk, never read into memory.
+        """
+        attempt = 0
+        while True:
+            handles = {}
+            try:
+                for field, path in (files or {}).items():
+                    handles[field] = (os.path.basename(path), open(path, "rb"))
+                response = self._http.request(method, url, files=handles or None, **kwargs)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_delay(attempt, self.backoff)
+                logger.warning(f"{method} {url} failed ({e!r}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code < 400:
+                    return response
+                if not should_retry(response) or attempt >= self.max_retries:
+                    raise error_from_response(response)
+                delay = retry_delay(attempt, self.backoff, response)
+                logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            finally:
+                for _, handle in handles.values():
+                    handle.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def health(self) -> dict:
+        return self._request("GET", "/health").json()
+
+    def tiers(self) -> dict:
+        return self._request("GET", "/tiers").json()
+
+    def queue_stats(self) -> dict:
+        return self._request("GET", "/queue/stats").json()
+
+    def job(self, job_id: str) -> dict:
+        return self._request("GET", f"/jobs/{job_id}").json()
+
+    def submit(self, path: str, tier: str = "professional", genre: str = "default", export: dict = None) -> str:
+        """
+        Upload path and queue it for mastering; returns the job id
+
+        export takes the /master options (target_format, target_sample_rate,
+        mp3_bitrate_kbps, wav_bit_depth). Files of RESUMABLE_THRESHOLD bytes or
+        more use the resumable upload endpoints.
+        """
+        if os.path.getsize(path) >= RESUMABLE_THRESHOLD:
+            return self.upload_resumable(path, tier, genre, export)
+        response = self._request("POST", "/jobs", files={"audio": path}, data=form_fields(tier, genre, export))
+        return response.json()["job_id"]
+
+    def upload_resumable(self, path: str, tier: str = "advanced", genre: str = "default", export: dict = None,
+                         chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+        """
+        Upload path in checksummed chunks, resuming from the server's offset after
+        any failure, then queue it; returns the job id
+        """
+        size = os.path.getsize(path)
+        session = self._request("POST", "/uploads", data={
+            "filename": os.path.basename(path), "size": str(size), "tier": tier,
+        }).json()
+        upload_url = f"/uploads/{session['upload_id']}"
+
+        offset = session["offset"]
+        conflicts = 0
+        with open(path, "rb") as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                headers = {
+                    "Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{size}",
+                    "X-Chunk-SHA256": hashlib.sha256(chunk).hexdigest(),
+                }
+                try:
+                    offset = self._request("PUT", upload_url, content=chunk, headers=headers).json()["offset"]
+                    conflicts = 0
+                except CrysGarageError as e:
+                    # 409: a retried chunk already landed, or the previous attempt is still
+                    # being written; 400: the chunk arrived damaged. Resync and resend.
+                    if e.status_code not in (400, 409) or conflicts >= self.max_retries:
+                        raise
+                    time.sleep(retry_delay(conflicts, self.backoff))
+                    conflicts += 1
+                    offset = int(self._request("HEAD", upload_url).headers["upload-offset"])
+
+        response = self._request("POST", f"{upload_url}/finalize", data=form_fields(tier, genre, export))
+        return response.json()["job_id"]
+
+    def wait(self, job_id: str, timeout: float = None, poll_interval: float = POLL_INTERVAL) -> dict:
+        """Poll a job until it finishes and return its result; raises JobFailed or TimeoutError"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            job = self.job(job_id)
+            if job["status"] in FINISHED_STATUSES:
+                if job["status"] != "completed":
+                    raise JobFailed(job)
+                return job["result"]
+            if deadline is not None and time.monotonic() + poll_interval > deadline:
+                raise TimeoutError(f"Job {job_id} still {job['status']} after {timeout}s")
+            time.sleep(poll_interval)
+            poll_interval = next_poll_interval(poll_interval)
+
+    def master(self, path: str, tier: str = "professional", genre: str = "default", export: dict = None,
+               timeout: float = None) -> dict:
+        """Submit path and wait for the finished master"""
+        return self.wait(self.submit(path, tier, genre, export), timeout=timeout)
+
+    def download(self, file_id: str, output_path: str, tier: str = None, format: str = None) -> str:
+        """
+        Stream a finished master to output_path
+
+        The body goes to output_path + ".part" and is renamed when complete. After
+        a dropped connection the download resumes with a Range request, guarded by
+        If-Range so a replaced file is fetched again from the start.
+        """
+        part_path = output_path + ".part"
+        params = download_params(tier, format)
+        etag = None
+        attempt = 0
+        while True:
+            headers = {}
+            if etag is not None and os.path.exists(part_path):
+                headers = {"Range": f"bytes={os.path.getsize(part_path)}-", "If-Range": etag}
+            try:
+                with self._http.stream("GET", f"/download/{file_id}", params=params, headers=headers) as response:
+                    if response.status_code >= 400:
+                        response.read()
+                        if not should_retry(response) or attempt >= self.max_retries:
+                            raise error_from_response(response)
+                        delay = retry_delay(attempt, self.backoff, response)
+                    else:
+                        etag = response.headers.get("etag")
+                        with open(part_path, "ab" if response.status_code == 206 else "wb") as f:
+                            for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                                f.write(chunk)
+                        os.replace(part_path, output_path)
+                        return output_path
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_delay(attempt, self.backoff)
+                logger.warning(f"Download of {file_id} interrupted ({e!r}), resuming in {delay:.1f}s")
+            attempt += 1
+            time.sleep(delay)
+
+    def _master_one(self, entry: dict, tier: str, genre: str, export: dict, download_dir: str,
+                    timeout: float) -> dict:
+        try:
+            entry["job_id"] = self.submit(entry["path"], tier, genre, export)
+            entry["result"] = self.wait(entry["job_id"], timeout=timeout)
+            if download_dir is not None:
+                extension = os.path.splitext(entry["result"]["processed_file"])[1]
+                name = os.path.splitext(os.path.basename(entry["path"]))[0]
+                entry["output_path"] = self.download(
+                    entry["result"]["file_id"], os.path.join(download_dir, f"{name}_mastered{extension}"),
+                    tier=tier, format=extension.lstrip(".").upper() or None,
+                )
+            entry["status"] = "completed"
+        except Exception as e:
+            logger.error(f"Mastering {entry['path']} failed: {e}")
+            entry.update(status="failed", error=str(e))
+        return entry
+
+    def master_many(self, paths: list, tier: str = "professional", genre: str = "default", export: dict = None,
+                    download_dir: str = None, concurrency: int = 4, timeout: float = None) -> list:
+        """
+        Master many files with at most concurrency in flight
+
+        Returns one dict per path, in input order: path, job_id, status
+        ("completed"/"failed"), result, error and output_path (when download_dir
+        is given). One failed track never aborts the rest.
+        """
+        if download_dir is not None:
+            os.makedirs(download_dir, exist_ok=True)
+        entries = [batch_entry(path) for path in paths]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda entry: self._master_one(entry, tier, genre, export, download_dir, timeout), entries))
+        return entries
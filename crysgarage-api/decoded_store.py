@@ -0,0 +1,160 @@
+"""
+Decoded audio store for CrysGarage
+Decodes each upload once into a raw float32 intermediate keyed by its content
+hash. Analysis, mastering, previews and conversion in any worker process then
+map it with np.memmap instead of decoding the upload again.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from audio_decoder import RAW_META_SUFFIX, RAW_SUFFIX, decode_to_raw, raw_info
+from metrics import REGISTRY, stage_timer
+
+logger = logging.getLogger(__name__)
+
+DECODED_BYTES = REGISTRY.gauge("crysgarage_decoded_store_bytes", "Bytes held by decoded intermediates")
+DECODED_ENTRIES = REGISTRY.gauge("crysgarage_decoded_store_entries", "Decoded intermediates on disk")
+DECODED_LOOKUPS = REGISTRY.counter(
+    "crysgarage_decoded_store_lookups_total", "Decoded intermediate lookups by outcome", ["result"]
+)
+DECODED_EVICTIONS = REGISTRY.counter(
+    "crysgarage_decoded_store_evictions_total", "Decoded intermediates removed", ["reason"]
+)
+
+
+class DecodedStore:
+    """
+    Content-addressed decoded intermediates with reference counting
+
+    The API process acquire()s a key before handing its path to a job and
+    release()s it when the job is done; sweep() only removes entries nobody
+    holds. ensure() does the actual decode and is safe to call from any
+    process: the first caller decodes, later ones find the finished files.
+    """
+
+    def __init__(self, store_dir: str, ttl: float = 3600.0, quota_bytes: int = 10 * 1024 * 1024 * 1024):
+        self.store_dir = store_dir
+        self.ttl = ttl
+        self.quota_bytes = quota_bytes
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._refs = {}
+        # Last use per key; production disks are mounted noatime
+        self._last_use = {}
+
+    def path(self, key: str) -> str:
+        if not key or os.path.basename(key) != key or key.startswith("."):
+            raise ValueError(f"Invalid decoded store key: {key!r}")
+        return os.path.join(self.store_dir, key + RAW_SUFFIX)
+
+    def get(self, key: str):
+        """Path of a complete intermediate for key, or None"""
+        path = self.path(key)
+        return path if raw_info(path) is not None else None
+
+    def ensure(self, key: str, source_path: str, timings: dict = None) -> str:
+        """Path of the intermediate for key, decoding source_path into it if missing"""
+        path = self.path(key)
+        if raw_info(path) is None:
+            with stage_timer(timings, "decode"):
+                info = decode_to_raw(source_path, path)
+            logger.info(f"Decoded {source_path} once into {path} ({info['frames']} frames, {info['channels']} ch)")
+        return path
+
+    def acquire(self, key: str) -> str:
+        """Pin key against sweeps and return its path; the intermediate may not exist yet"""
+        path = self.path(key)
+        with self._lock:
+            self._refs[key] = self._refs.get(key, 0) + 1
+            self._last_use[key] = time.time()
+        DECODED_LOOKUPS.inc(result="hit" if raw_info(path) is not None else "miss")
+        return path
+
+    def release(self, key: str):
+        with self._lock:
+            remaining = self._refs.get(key, 0) - 1
+            if remaining > 0:
+                self._refs[key] = remaining
+            else:
+                self._refs.pop(key, None)
+            self._last_use[key] = time.time()
+
+    def _remove(self, key: str, reason: str) -> int:
+        removed = 0
+        path = self.path(key)
+        for file_path in (path + RAW_META_SUFFIX, path):
+            try:
+                removed += os.path.getsize(file_path)
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._last_use.pop(key, None)
+        DECODED_EVICTIONS.inc(reason=reason)
+        logger.info(f"Removed decoded intermediate {key} ({reason}, {removed} bytes)")
+        return removed
+
+    def _entries(self) -> list:
+        """(last_use, key, bytes) of every intermediate on disk, least recently used first"""
+        entries = []
+        for name in os.listdir(self.store_dir):
+            if not name.endswith(RAW_SUFFIX):
+                continue
+            key = name[:-len(RAW_SUFFIX)]
+            path = os.path.join(self.store_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            last_use = self._last_use.get(key, stat.st_mtime)
+            entries.append((last_use, key, stat.st_size))
+        entries.sort()
+        return entries
+
+    def sweep(self, now: float = None) -> int:
+        """
+        Remove unreferenced intermediates idle for longer than ttl, then the
+        least recently used ones until the store fits its quota. Returns bytes freed.
+        """
+        now = now if now is not None else time.time()
+        # Half-written files left by a worker that died mid-decode
+        for name in os.listdir(self.store_dir):
+            path = os.path.join(self.store_dir, name)
+            try:
+                if name.endswith(".tmp") and now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        entries = self._entries()
+        total = sum(size for _, _, size in entries)
+        freed = 0
+        for last_use, key, size in entries:
+            with self._lock:
+                if self._refs.get(key):
+                    continue
+            if now - last_use > self.ttl:
+                reason = "expired"
+            elif total > self.quota_bytes:
+                reason = "quota"
+            else:
+                continue
+            freed += self._remove(key, reason)
+            total -= size
+
+        DECODED_BYTES.set(total)
+        DECODED_ENTRIES.set(len(self._entries()))
+        return freed
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        with self._lock:
+            pinned = len(self._refs)
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for _, _, size in entries),
+            "pinned": pinned,
+        }
@@ -0,0 +1,218 @@
+"""
+File downloads for CrysGarage
+Serves finished masters with byte ranges, strong ETags and conditional GETs.
+The body goes out through the ASGI zero-copy (sendfile) extension when the server
+offers it, or through the reverse proxy via X-Accel-Redirect when configured
+"""
+
+import logging
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+# Fallback read size when neither sendfile nor the proxy can serve the file
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Internal nginx location aliased to the served root, e.g. "/protected-masters/".
+# When set, nginx streams the file itself (sendfile, ranges) and Python sends no body.
+ACCEL_REDIRECT_PREFIX = os.environ.get("DOWNLOAD_ACCEL_REDIRECT_PREFIX", "")
+
+MEDIA_TYPES = {
+    ".wav": "audio/wav",
+    ".flac": "audio/flac",
+    ".mp3": "audio/mpeg",
+    ".aac": "audio/aac",
+    ".m4a": "audio/mp4",
+    ".ogg": "audio/ogg",
+    ".aiff": "audio/aiff",
+}
+
+
+def file_etag(st: os.stat_result) -> str:
+    """
+    Strong ETag from inode, mtime and size
+
+    Masters are published with os.replace, so new content always means a new
+    inode and mtime; the validator never needs to read the file.
+    """
+    return f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified_since(header: str, st: os.stat_result) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(st.st_mtime) <= since
+
+
+def parse_range(header: Optional[str], size: int):
+    """
+    Resolve a Range header against a file of size bytes
+
+    Returns:
+        tuple: inclusive (start, end) for a single satisfiable range, or None to
+               serve the whole file (no header, malformed or multi-range)
+
+    Raises:
+        ValueError: The range lies entirely past the end of the file
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    if not (first or last) or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+        return None
+
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start > end:
+        return None
+    if start >= size:
+        raise ValueError(f"range starts past end of file ({start} >= {size})")
+    return start, min(end, size - 1)
+
+
+class FileRangeResponse(Response):
+    """Send length bytes of an open file from start, without buffering it in Python when possible"""
+
+    def __init__(self, source, start: int, length: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.source = source
+        self.start = start
+        self.length = length
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope["method"] == "HEAD" or self.length == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": self.source,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+                return
+
+            fd = self.source.fileno()
+            offset = self.start
+            remaining = self.length
+            while remaining > 0:
+                chunk = await run_in_threadpool(os.pread, fd, min(READ_CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank underneath us; close the body so the client sees a short read
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            self.source.close()
+
+
+def file_response(request, path: str, root: str, attachment: bool = False,
+                  cache_control: Optional[str] = None) -> Response:
+    """
+    Build a GET/HEAD response for path, honouring Range, If-Range, If-None-Match
+    and If-Modified-Since
+
+    Args:
+        request: Incoming request (only method and headers are used)
+        path: File to serve; must live under root
+        root: Served directory, also the base for X-Accel-Redirect paths
+        attachment: Content-Disposition attachment instead of inline
+        cache_control: Cache-Control value, e.g. for immutable files
+    """
+    try:
+        # Open first and fstat the handle so headers and body describe the same file
+        source = open(path, "rb", buffering=0)
+    except (FileNotFoundError, IsADirectoryError):
+        raise HTTPException(status_code=404, detail=f"File not found: {os.path.basename(path)}")
+
+    try:
+        st = os.fstat(source.fileno())
+        size = st.st_size
+        etag = file_etag(st)
+        filename = os.path.basename(path)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f'{"attachment" if attachment else "inline"}; filename="{filename}"',
+        }
+        if cache_control:
+            headers["Cache-Control"] = cache_control
+        media_type = MEDIA_TYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            not_modified = _etag_matches(if_none_match, etag, weak=True)
+        else:
+            since = request.headers.get("if-modified-since")
+            not_modified = since is not None and _not_modified_since(since, st)
+        if not_modified:
+            source.close()
+            return Response(status_code=304, headers=headers)
+
+        if ACCEL_REDIRECT_PREFIX:
+            source.close()
+            relative = os.path.relpath(path, root).replace(os.sep, "/")
+            headers["X-Accel-Redirect"] = ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative
+            return Response(status_code=200, headers=headers, media_type=media_type)
+
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and if_range is not None and if_range.strip() not in (etag, headers["Last-Modified"]):
+            # The client's partial copy is stale; send the whole new file
+            range_header = None
+
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            source.close()
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+
+        if byte_range is None:
+            start, length, status_code = 0, size, 200
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(length)
+
+        return FileRangeResponse(source, start, length, status_code, headers, media_type)
+    except BaseException:
+        source.close()
+        raise
@@ -1,44 +1,42 @@
 #!/usr/bin/env python3
-import requests
-import json
-
-class CrysGarageAPI:
-    def __init__(self, base_url="https://crysgarage.studio/api/v1"):
-        self.base_url = base_url
-        self.session = requests.Session()
-    
-    def health_check(self):
-        response = self.session.get(f"{self.base_url}/../health")
-        return response.json()
-    
-    def get_info(self):
-        response = self.session.get(f"{self.base_url}/info")
-        return response.json()
-    
-    def get_tiers(self):
-        response = self.session.get(f"{self.base_url}/tiers")
-        return response.json()
-    
-    def master_audio(self, file_path, tier="professional", genre="default"):
-        url = f"{self.base_url}/master"
-        
-        with open(file_path, 'rb') as f:
-            files = {'file': f}
-            data = {'tier': tier, 'genre': genre}
-            response = self.session.post(url, files=files, data=data)
-            return response.json()
-    
-    def download_file(self, file_id, output_path):
-        url = f"{self.base_url}/download/{file_id}"
-        response = self.session.get(url)
-        
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
-        
-        return output_path
+"""
+CrysGarage client examples (pip install httpx)
+
+    python examples/python_client.py                          # health, tiers, queue
+    python examples/python_client.py song.wav                 # master one track
+    python examples/python_client.py --async a.wav b.flac     # batch with asyncio
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crysgarage_client import AsyncCrysGarageClient, CrysGarageClient
+
+
+def master_sync(paths):
+    with CrysGarageClient() as client:
+        print("Health:", client.health())
+        print("Tiers:", client.tiers())
+        print("Queue:", client.queue_stats())
+        for entry in client.master_many(paths, tier="professional", export={"target_format": "MP3"},
+                                        download_dir="mastered"):
+            print(entry["path"], entry["status"], entry["output_path"] or entry["error"])
+
+
+async def master_async(paths):
+    async with AsyncCrysGarageClient() as client:
+        results = await client.master_many(paths, tier="professional", export={"target_format": "WAV"},
+                                           download_dir="mastered", concurrency=8)
+        for entry in results:
+            print(entry["path"], entry["status"], entry["output_path"] or entry["error"])
+
 
 if __name__ == "__main__":
-    api = CrysGarageAPI()
-    print("Health Check:", api.health_check())
-    print("API Info:", api.get_info())
-    print("Tiers:", api.get_tiers())
+    args = sys.argv[1:]
+    if args and args[0] == "--async":
+        asyncio.run(master_async(args[1:]))
+    else:
+        master_sync(args)
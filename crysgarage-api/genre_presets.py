@@ -0,0 +1,245 @@
+"""
+Genre presets for CrysGarage
+A tonal EQ curve followed by three-band dynamics, run block by block on float32
+audio ahead of the mastering chain. Filter banks are designed once per
+(genre, sample rate) and cached.
+"""
+
+import functools
+import logging
+from collections import namedtuple
+
+import numpy as np
+import scipy.signal
+
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Low shelf, mid peak and high shelf centre frequencies (Hz)
+EQ_FREQUENCIES = (100.0, 1000.0, 8000.0)
+# Shelf slope S = 1, the steepest without overshoot
+EQ_SHELF_Q = 1.0 / np.sqrt(2.0)
+EQ_MID_Q = 0.7
+# Linkwitz-Riley crossovers between the low, mid and high dynamics bands (Hz)
+CROSSOVERS = (200.0, 2500.0)
+# Tracks are aligned to this loudness before the dynamics, so thresholds mean
+# the same thing for every track; the alignment is undone afterwards
+ALIGNMENT_LUFS = -14.0
+PROCESS_BLOCK_FRAMES = 65536
+
+# eq_db: low shelf, mid peak, high shelf. thresholds_db and ratios: low, mid, high band.
+# Values follow the frontend's genre presets.
+GENRE_PRESETS = {
+    "afrobeats": {"eq_db": (2.0, 1.0, 0.5), "thresholds_db": (-20.0, -18.0, -16.0), "ratios": (3.0, 4.0, 5.0),
+                  "attack_ms": 2.0, "release_ms": 200.0},
+    "trap": {"eq_db": (3.5, 1.2, 0.6), "thresholds_db": (-18.0, -16.0, -14.0), "ratios": (4.0, 6.0, 8.0),
+             "attack_ms": 1.0, "release_ms": 80.0},
+    "drill": {"eq_db": (3.0, 1.8, 0.7), "thresholds_db": (-16.0, -16.0, -16.0), "ratios": (5.0, 5.0, 5.0),
+              "attack_ms": 1.0, "release_ms": 100.0},
+    "dubstep": {"eq_db": (4.0, 1.0, 0.8), "thresholds_db": (-12.0, -12.0, -12.0), "ratios": (8.0, 8.0, 8.0),
+                "attack_ms": 1.0, "release_ms": 50.0},
+    "gospel": {"eq_db": (1.5, 2.0, 1.0), "thresholds_db": (-22.0, -22.0, -22.0), "ratios": (2.5, 2.5, 2.5),
+               "attack_ms": 10.0, "release_ms": 150.0},
+    "r-b": {"eq_db": (1.2, 2.5, 1.8), "thresholds_db": (-24.0, -24.0, -24.0), "ratios": (2.2, 2.2, 2.2),
+            "attack_ms": 15.0, "release_ms": 200.0},
+    "lofi-hiphop": {"eq_db": (0.8, 1.5, 1.2), "thresholds_db": (-26.0, -26.0, -26.0), "ratios": (1.8, 1.8, 1.8),
+                    "attack_ms": 25.0, "release_ms": 300.0},
+    "hip-hop": {"eq_db": (3.0, 1.5, 0.8), "thresholds_db": (-20.0, -18.0, -16.0), "ratios": (3.0, 5.0, 7.0),
+                "attack_ms": 1.0, "release_ms": 100.0},
+    "house": {"eq_db": (2.5, 1.0, 1.5), "thresholds_db": (-17.0, -17.0, -17.0), "ratios": (4.5, 4.5, 4.5),
+              "attack_ms": 2.0, "release_ms": 150.0},
+    "highlife": {"eq_db": (1.5, 1.5, 1.0), "thresholds_db": (-20.0, -20.0, -20.0), "ratios": (3.0, 3.0, 3.0),
+                 "attack_ms": 5.0, "release_ms": 180.0},
+    "pop": {"eq_db": (1.5, 0.5, 2.0), "thresholds_db": (-20.0, -18.0, -18.0), "ratios": (3.0, 3.0, 3.0),
+            "attack_ms": 5.0, "release_ms": 150.0},
+    "rock": {"eq_db": (1.0, 1.5, 1.5), "thresholds_db": (-18.0, -18.0, -18.0), "ratios": (3.5, 3.5, 3.5),
+             "attack_ms": 5.0, "release_ms": 120.0},
+    "electronic": {"eq_db": (3.0, 0.0, 2.0), "thresholds_db": (-16.0, -18.0, -18.0), "ratios": (5.0, 4.0, 4.0),
+                   "attack_ms": 1.0, "release_ms": 80.0},
+    "jazz": {"eq_db": (0.5, 0.5, 0.5), "thresholds_db": (-28.0, -28.0, -28.0), "ratios": (1.5, 1.5, 1.5),
+             "attack_ms": 20.0, "release_ms": 250.0},
+    "classical": {"eq_db": (0.0, 0.0, 0.5), "thresholds_db": (-30.0, -30.0, -30.0), "ratios": (1.3, 1.3, 1.3),
+                  "attack_ms": 30.0, "release_ms": 300.0},
+    "reggae": {"eq_db": (3.0, 0.5, 0.5), "thresholds_db": (-20.0, -20.0, -20.0), "ratios": (3.0, 2.5, 2.5),
+               "attack_ms": 5.0, "release_ms": 200.0},
+}
+
+GENRE_ALIASES = {
+    "hiphop": "hip-hop",
+    "rnb": "r-b",
+    "r&b": "r-b",
+    "lofi": "lofi-hiphop",
+    "edm": "electronic",
+}
+
+FilterBank = namedtuple("FilterBank", [
+    "eq",               # SOS cascade of the tonal EQ
+    "low",              # LR4 low-pass at the first crossover, then an allpass matching the second
+    "split",            # LR4 high-pass at the first crossover, shared by the mid and high bands
+    "mid",              # LR4 low-pass at the second crossover
+    "high",             # LR4 high-pass at the second crossover
+    "threshold_power",  # (3, 1) band thresholds as mean-square power
+    "exponents",        # (3, 1) -(1 - 1/ratio) / 2: gain per unit of power over the threshold
+    "attack",           # detector one-pole coefficient
+    "release",          # gain release one-pole coefficient
+])
+
+
+def preset_name(genre: str):
+    """Canonical preset name for a genre form value, or None if it has no preset"""
+    if not genre:
+        return None
+    name = genre.strip().lower().replace("_", "-").replace(" ", "-")
+    name = GENRE_ALIASES.get(name, name)
+    return name if name in GENRE_PRESETS else None
+
+
+def _biquad(kind: str, freq: float, gain_db: float, q: float, sr: int) -> np.ndarray:
+    """One SOS row from the RBJ audio EQ cookbook"""
+    amp = 10.0 ** (gain_db / 40.0)
+    w0 = 2.0 * np.pi * freq / sr
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2.0 * q)
+    if kind == "peak":
+        b = [1.0 + alpha * amp, -2.0 * cos_w0, 1.0 - alpha * amp]
+        a = [1.0 + alpha / amp, -2.0 * cos_w0, 1.0 - alpha / amp]
+    else:
+        root = 2.0 * np.sqrt(amp) * alpha
+        sign = 1.0 if kind == "low_shelf" else -1.0
+        b = [amp * ((amp + 1) - sign * (amp - 1) * cos_w0 + root),
+             sign * 2.0 * amp * ((amp - 1) - sign * (amp + 1) * cos_w0),
+             amp * ((amp + 1) - sign * (amp - 1) * cos_w0 - root)]
+        a = [(amp + 1) + sign * (amp - 1) * cos_w0 + root,
+             -sign * 2.0 * ((amp - 1) + sign * (amp + 1) * cos_w0),
+             (amp + 1) + sign * (amp - 1) * cos_w0 - root]
+    return np.concatenate([b, a]) / a[0]
+
+
+def _linkwitz_riley(freq: float, btype: str, sr: int) -> np.ndarray:
+    """4th-order Linkwitz-Riley: two identical 2nd-order Butterworth sections"""
+    section = scipy.signal.butter(2, freq, btype=btype, fs=sr, output="sos")
+    return np.concatenate([section, section])
+
+
+def _allpass(freq: float, sr: int) -> np.ndarray:
+    """The allpass an LR4 low-pass plus high-pass at freq sum to"""
+    _, a = scipy.signal.butter(2, freq, fs=sr)
+    return np.concatenate([a[::-1], a])[np.newaxis, :] / a[0]
+
+
+@functools.lru_cache(maxsize=64)
+def design_filter_bank(genre: str, sr: int) -> FilterBank:
+    """
+    Filter coefficients for a preset at one sample rate
+
+    genre must be a canonical name (see preset_name). The result is cached and
+    shared between processors, so its arrays must not be modified.
+    """
+    preset = GENRE_PRESETS[genre]
+    # Keep every band below Nyquist for low sample rates
+    nyquist_guard = 0.45 * sr
+    low_f, mid_f, high_f = (min(freq, nyquist_guard) for freq in EQ_FREQUENCIES)
+    low_eq, mid_eq, high_eq = preset["eq_db"]
+    eq = np.stack([
+        _biquad("low_shelf", low_f, low_eq, EQ_SHELF_Q, sr),
+        _biquad("peak", mid_f, mid_eq, EQ_MID_Q, sr),
+        _biquad("high_shelf", high_f, high_eq, EQ_SHELF_Q, sr),
+    ])
+
+    first, second = (min(freq, nyquist_guard) for freq in CROSSOVERS)
+    ratios = np.asarray(preset["ratios"], dtype=np.float64)
+    return FilterBank(
+        eq=eq.astype(np.float32),
+        low=np.concatenate([_linkwitz_riley(first, "lowpass", sr), _allpass(second, sr)]).astype(np.float32),
+        split=_linkwitz_riley(first, "highpass", sr).astype(np.float32),
+        mid=_linkwitz_riley(second, "lowpass", sr).astype(np.float32),
+        high=_linkwitz_riley(second, "highpass", sr).astype(np.float32),
+        threshold_power=(10.0 ** (np.asarray(preset["thresholds_db"]) / 10.0))[:, np.newaxis].astype(np.float32),
+        exponents=(-(1.0 - 1.0 / ratios) / 2.0)[:, np.newaxis].astype(np.float32),
+        attack=float(np.exp(-1.0 / (preset["attack_ms"] * sr / 1000.0))),
+        release=float(np.exp(-1.0 / (preset["release_ms"] * sr / 1000.0))),
+    )
+
+
+class GenreProcessor:
+    """
+    Tonal EQ -> LR4 three-band split -> per-band compression, in place on blocks
+
+    Filter state carries across process() calls, so feeding a track in any
+    block sizes gives the same result. All channels run through each SOS
+    cascade together, and each band's compressor is linked across channels.
+    """
+
+    def __init__(self, genre: str, sample_rate: int, channels: int, input_loudness: float = None):
+        self.genre = preset_name(genre)
+        if self.genre is None:
+            raise ValueError(f"No preset for genre: {genre}")
+        self.bank = design_filter_bank(self.genre, sample_rate)
+
+        align_db = ALIGNMENT_LUFS - input_loudness if input_loudness is not None and np.isfinite(input_loudness) else 0.0
+        self._align = np.float32(10.0 ** (align_db / 20.0))
+        self._unalign = 1.0 / float(self._align)
+
+        def state(sos):
+            return np.zeros((sos.shape[0], 2, channels), dtype=np.float32)
+
+        self._zi = {name: state(getattr(self.bank, name)) for name in ("eq", "low", "split", "mid", "high")}
+        self._attack_ba = (np.array([1.0 - self.bank.attack], dtype=np.float32),
+                           np.array([1.0, -self.bank.attack], dtype=np.float32))
+        self._release_ba = (np.array([1.0 - self.bank.release], dtype=np.float32),
+                            np.array([1.0, -self.bank.release], dtype=np.float32))
+        self._detector_zi = np.zeros((3, 1), dtype=np.float32)
+        # Release starts settled at unity gain
+        self._release_zi = np.tile(scipy.signal.lfilter_zi(*self._release_ba), (3, 1)).astype(np.float32)
+        self.max_reduction_db = np.zeros(3)
+
+    def _filter(self, name: str, data: np.ndarray) -> np.ndarray:
+        out, self._zi[name] = scipy.signal.sosfilt(getattr(self.bank, name), data, axis=0, zi=self._zi[name])
+        return out
+
+    def _band_gains(self, bands) -> np.ndarray:
+        """(3, frames) linear gain per band from a linked RMS detector"""
+        power = np.stack([np.max(np.square(band), axis=1) for band in bands])
+        power, self._detector_zi = scipy.signal.lfilter(*self._attack_ba, power, axis=1, zi=self._detector_zi)
+        # Power over the threshold raised to -slope / 2 is the gain computer in the linear domain
+        power /= self.bank.threshold_power
+        np.maximum(power, 1.0, out=power)
+        gains = np.power(power, self.bank.exponents, out=power)
+
+        # Reductions apply at the detector's speed, recovery follows the release
+        released, self._release_zi = scipy.signal.lfilter(*self._release_ba, gains, axis=1, zi=self._release_zi)
+        np.minimum(gains, released, out=gains)
+        np.maximum(self.max_reduction_db, -20.0 * np.log10(gains.min(axis=1)), out=self.max_reduction_db)
+        return gains
+
+    def _process_block(self, block: np.ndarray, timings: dict):
+        with stage_timer(timings, "genre_eq"):
+            block *= self._align
+            shaped = self._filter("eq", block)
+        with stage_timer(timings, "genre_dynamics"):
+            upper = self._filter("split", shaped)
+            bands = (self._filter("low", shaped), self._filter("mid", upper), self._filter("high", upper))
+            gains = self._band_gains(bands)
+            gains *= self._unalign
+            np.multiply(bands[0], gains[0, :, np.newaxis], out=block)
+            for band, gain in zip(bands[1:], gains[1:]):
+                band *= gain[:, np.newaxis]
+                block += band
+
+    def process(self, data: np.ndarray, timings: dict = None) -> np.ndarray:
+        """
+        Process (frames, channels) float32 audio in place and return it
+
+        Long inputs are worked through in PROCESS_BLOCK_FRAMES slices, so the
+        filter temporaries stay small.
+        """
+        for start in range(0, len(data), PROCESS_BLOCK_FRAMES):
+            self._process_block(data[start:start + PROCESS_BLOCK_FRAMES], timings)
+        return data
+
+
+def process_blocks(blocks, processor: GenreProcessor, timings: dict = None):
+    """Yield each block after running it through processor"""
+    for block in blocks:
+        yield processor.process(block, timings)
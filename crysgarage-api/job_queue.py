@@ -0,0 +1,447 @@
+"""
+Shared job queue for CrysGarage
+A durable queue in one SQLite file that any number of API processes enqueue
+into and any number of worker processes lease from, on one host or several
+sharing a filesystem. Leases expire unless the worker holding them keeps
+extending them, so work from a crashed worker is picked up again.
+
+Run workers with:
+    python job_queue.py --queue /var/www/mastering/queue.sqlite3 --processes 4
+"""
+
+import argparse
+import importlib
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# A lease not extended for this long is considered abandoned
+VISIBILITY_TIMEOUT = 60.0
+# Leases a job may take before it is failed; only lost leases count, errors are final
+MAX_ATTEMPTS = 3
+# Idle worker sleep between lease attempts
+POLL_INTERVAL = 0.2
+# A worker missing heartbeats this long no longer counts towards concurrency caps
+WORKER_TTL = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    tier TEXT,
+    fn TEXT NOT NULL,
+    payload BLOB,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    aging_seconds REAL,
+    max_share REAL,
+    deadline REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    result BLOB,
+    error TEXT,
+    meta BLOB
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, lease_expires);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    started_at REAL,
+    seen_at REAL
+);
+"""
+
+STATUS_FIELDS = ("job_id", "status", "created_at", "started_at", "finished_at", "error", "attempts", "worker")
+STATUS_COLUMNS = ", ".join(STATUS_FIELDS + ("tier", "result", "meta"))
+
+
+def qualified_name(fn) -> str:
+    """module:function reference a worker can import, also for functions of a script run as __main__"""
+    module = fn.__module__
+    if module == "__main__":
+        module = os.path.splitext(os.path.basename(sys.modules["__main__"].__file__))[0]
+    return f"{module}:{fn.__qualname__}"
+
+
+def resolve(name: str):
+    module, _, qualname = name.partition(":")
+    target = importlib.import_module(module)
+    for attribute in qualname.split("."):
+        target = getattr(target, attribute)
+    return target
+
+
+class JobQueue:
+    """
+    SQLite-backed job table with leases
+
+    Every write runs in its own IMMEDIATE transaction, so concurrent
+    processes serialize on the database lock rather than on each other.
+    Payloads and results are pickled; the queue only carries work between
+    processes of this service.
+    """
+
+    def __init__(self, path: str, visibility_timeout: float = VISIBILITY_TIMEOUT, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # WAL lets status reads proceed while a worker holds the write lock
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _write(self, fn):
+        """Run fn(conn) inside one IMMEDIATE transaction"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return value
+
+    def _read(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def enqueue(self, fn, args=(), kwargs=None, tier: str = None, meta: dict = None, priority: int = 0,
+                aging_seconds: float = None, max_share: float = None, deadline: float = None,
+                job_id: str = None) -> str:
+        """
+        Queue fn(*args, **kwargs)
+
+        Args:
+            fn: Top-level function, or its "module:function" name
+            tier: Tier the job counts against; None for untiered work
+            priority: 0 is most urgent
+            aging_seconds: Every aging_seconds a job waits improves its priority by one
+            max_share: Share of live workers the tier's running jobs may occupy
+            deadline: Epoch seconds by which the job should finish
+        """
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        payload = pickle.dumps((tuple(args), kwargs or {}), protocol=pickle.HIGHEST_PROTOCOL)
+        name = fn if isinstance(fn, str) else qualified_name(fn)
+        self._write(lambda conn: conn.execute(
+            "INSERT INTO jobs (job_id, tier, fn, payload, status, priority, aging_seconds, max_share, deadline, "
+            "created_at, max_attempts, meta) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, tier, name, payload, priority, aging_seconds, max_share, deadline, now,
+             self.max_attempts, pickle.dumps(meta or {})),
+        ))
+        return job_id
+
+    def add_completed(self, result, meta: dict = None) -> str:
+        """Record a job that is already done (e.g. a cache hit) so any process can report it"""
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        self._write(lambda conn: conn.execute(
+            "INSERT INTO jobs (job_id, fn, status, created_at, started_at, finished_at, max_attempts, "
+            "result, meta) VALUES (?, '', 'completed', ?, ?, ?, 0, ?, ?)",
+            (job_id, now, now, now, pickle.dumps(result), pickle.dumps(meta or {})),
+        ))
+        return job_id
+
+    def lease(self, worker: str):
+        """
+        Take the most urgent runnable job for worker, or None
+
+        Queued jobs and jobs whose lease expired are candidates; a tier at its
+        share of live workers is skipped. Returns a dict with job_id, fn, args,
+        kwargs and attempts.
+        """
+        def take(conn):
+            now = time.time()
+            live = conn.execute("SELECT COUNT(*) FROM workers WHERE seen_at > ?", (now - WORKER_TTL,)).fetchone()[0]
+            running = dict(conn.execute(
+                "SELECT tier, COUNT(*) FROM jobs WHERE status = 'running' AND lease_expires > ? GROUP BY tier",
+                (now,),
+            ).fetchall())
+            candidates = conn.execute(
+                "SELECT job_id, tier, fn, payload, attempts, max_attempts, max_share FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_expires <= ?) "
+                "ORDER BY priority - COALESCE(CAST((? - created_at) / aging_seconds AS INTEGER), 0), "
+                "COALESCE(deadline, created_at), created_at LIMIT 64",
+                (now, now),
+            ).fetchall()
+            for row in candidates:
+                if row["attempts"] >= row["max_attempts"]:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', finished_at = ?, payload = NULL, "
+                        "error = ? WHERE job_id = ?",
+                        (now, f"Worker lost the job {row['attempts']} times", row["job_id"]),
+                    )
+                    continue
+                tier = row["tier"]
+                if tier is not None and row["max_share"] is not None:
+                    cap = max(1, math.ceil(row["max_share"] * max(live, 1)))
+                    if running.get(tier, 0) >= cap:
+                        continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?, started_at = ?, "
+                    "attempts = attempts + 1 WHERE job_id = ?",
+                    (worker, now + self.visibility_timeout, now, row["job_id"]),
+                )
+                args, kwargs = pickle.loads(row["payload"])
+                return {"job_id": row["job_id"], "fn": row["fn"], "args": args, "kwargs": kwargs,
+                        "attempts": row["attempts"] + 1}
+            return None
+
+        return self._write(take)
+
+    def extend(self, job_id: str, worker: str) -> bool:
+        """Push worker's lease on job_id out by the visibility timeout; False if the lease was lost"""
+        def extend_lease(conn):
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.visibility_timeout, job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+        return self._write(extend_lease)
+
+    def complete(self, job_id: str, worker: str, result) -> bool:
+        """Store the result unless worker's lease was lost meanwhile"""
+        blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        return self._write(lambda conn: conn.execute(
+            "UPDATE jobs SET status = 'completed', finished_at = ?, result = ?, payload = NULL, "
+            "lease_expires = NULL WHERE job_id = ? AND worker = ? AND status = 'running'",
+            (time.time(), blob, job_id, worker),
+        ).rowcount == 1)
+
+    def fail(self, job_id: str, worker: str, error: str) -> bool:
+        """Record the error the job raised; jobs clean up their inputs, so this is final"""
+        return self._write(lambda conn: conn.execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, error = ?, payload = NULL, "
+            "lease_expires = NULL WHERE job_id = ? AND worker = ? AND status = 'running'",
+            (time.time(), error, job_id, worker),
+        ).rowcount == 1)
+
+    def _status(self, row) -> dict:
+        info = {field: row[field] for field in STATUS_FIELDS}
+        info["tier"] = row["tier"]
+        info["result"] = pickle.loads(row["result"]) if row["result"] is not None else None
+        info.update(pickle.loads(row["meta"]) if row["meta"] else {})
+        return info
+
+    def get(self, job_id: str) -> dict:
+        """Status dict shaped like JobManager.status, or None if the id is unknown"""
+        rows = self._read(f"SELECT {STATUS_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,))
+        return self._status(rows[0]) if rows else None
+
+    def finished(self, job_ids: list) -> dict:
+        """Status of every job among job_ids that has completed or failed, by id"""
+        done = {}
+        ids = list(job_ids)
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows = self._read(
+                f"SELECT {STATUS_COLUMNS} FROM jobs WHERE status IN ('completed', 'failed') "
+                f"AND job_id IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            done.update((row["job_id"], self._status(row)) for row in rows)
+        return done
+
+    def counts(self) -> dict:
+        """{tier: {"queued": n, "running": n, "oldest_enqueued_at": t}} for unfinished jobs"""
+        now = time.time()
+        counts = {}
+        rows = self._read(
+            "SELECT tier, SUM(status = 'queued' OR lease_expires <= ?) AS queued, "
+            "SUM(status = 'running' AND lease_expires > ?) AS running, MIN(created_at) AS oldest "
+            "FROM jobs WHERE status IN ('queued', 'running') GROUP BY tier",
+            (now, now),
+        )
+        for row in rows:
+            counts[row["tier"]] = {"queued": row["queued"], "running": row["running"],
+                                   "oldest_enqueued_at": row["oldest"]}
+        return counts
+
+    def service_seconds(self, tier: str, recent: int = 20):
+        """Mean run time of tier's last recent completed jobs, or None"""
+        rows = self._read(
+            "SELECT AVG(finished_at - started_at) FROM (SELECT finished_at, started_at FROM jobs "
+            "WHERE tier = ? AND status = 'completed' AND started_at IS NOT NULL "
+            "ORDER BY finished_at DESC LIMIT ?)",
+            (tier, recent),
+        )
+        return rows[0][0]
+
+    def heartbeat(self, worker: str):
+        """Register worker as live (see live_workers)"""
+        now = time.time()
+        self._write(lambda conn: conn.execute(
+            "INSERT INTO workers (worker, host, pid, started_at, seen_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(worker) DO UPDATE SET seen_at = excluded.seen_at",
+            (worker, socket.gethostname(), os.getpid(), now, now),
+        ))
+
+    def retire(self, worker: str):
+        self._write(lambda conn: conn.execute("DELETE FROM workers WHERE worker = ?", (worker,)))
+
+    def live_workers(self) -> int:
+        return self._read("SELECT COUNT(*) FROM workers WHERE seen_at > ?", (time.time() - WORKER_TTL,))[0][0]
+
+    def prune(self, job_ttl: float) -> int:
+        """Drop jobs finished more than job_ttl ago and workers gone silent; returns jobs removed"""
+        now = time.time()
+
+        def delete(conn):
+            conn.execute("DELETE FROM workers WHERE seen_at < ?", (now - max(WORKER_TTL, job_ttl),))
+            return conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - job_ttl,)).rowcount
+
+        return self._write(delete)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class QueueWorker:
+    """
+    Lease jobs from a JobQueue and run them in this process, one at a time
+
+    A background thread keeps the current lease and the worker's registration
+    fresh, so long renders are not handed to a second worker.
+    """
+
+    def __init__(self, queue: JobQueue, poll_interval: float = POLL_INTERVAL):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._current = None
+        self._stop = threading.Event()
+
+    def _keep_alive(self):
+        interval = min(self.queue.visibility_timeout / 3.0, WORKER_TTL / 3.0)
+        while not self._stop.wait(interval):
+            try:
+                self.queue.heartbeat(self.worker_id)
+                job_id = self._current
+                if job_id is not None and not self.queue.extend(job_id, self.worker_id):
+                    logger.warning(f"Lost the lease on job {job_id}; another worker may run it")
+            except sqlite3.Error as e:
+                logger.error(f"Queue heartbeat failed: {e}")
+
+    def run_once(self) -> bool:
+        """Lease and run one job; False when nothing was runnable"""
+        job = self.queue.lease(self.worker_id)
+        if job is None:
+            return False
+        job_id = job["job_id"]
+        self._current = job_id
+        started = time.perf_counter()
+        try:
+            result = resolve(job["fn"])(*job["args"], **job["kwargs"])
+        except Exception as e:
+            logger.error(f"Job {job_id} ({job['fn']}) failed: {e}", exc_info=True)
+            self.queue.fail(job_id, self.worker_id, str(e))
+        else:
+            if not self.queue.complete(job_id, self.worker_id, result):
+                logger.warning(f"Job {job_id} finished after its lease moved to another worker; result dropped")
+            else:
+                logger.info(f"Job {job_id} ({job['fn']}) done in {time.perf_counter() - started:.2f}s "
+                            f"(attempt {job['attempts']})")
+        finally:
+            self._current = None
+        return True
+
+    def run(self):
+        """Serve jobs until stop() or SIGTERM"""
+        self.queue.heartbeat(self.worker_id)
+        keep_alive = threading.Thread(target=self._keep_alive, name="queue-heartbeat", daemon=True)
+        keep_alive.start()
+        logger.info(f"Queue worker {self.worker_id} serving {self.queue.path}")
+        try:
+            while not self._stop.is_set():
+                if not self.run_once():
+                    self._stop.wait(self.poll_interval)
+        finally:
+            self._stop.set()
+            self.queue.retire(self.worker_id)
+
+    def stop(self):
+        self._stop.set()
+
+
+def _worker_main(path: str, visibility_timeout: float, warm_up: bool):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+    worker = QueueWorker(JobQueue(path, visibility_timeout=visibility_timeout))
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if warm_up:
+        import audio_stack
+        audio_stack.warm_up()
+    worker.run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run CrysGarage queue workers")
+    parser.add_argument("--queue", default=os.environ.get("JOB_QUEUE_PATH"), help="SQLite queue file (JOB_QUEUE_PATH)")
+    parser.add_argument("--processes", type=int, default=int(os.environ.get("MASTERING_WORKERS", "0")) or None,
+                        help="Worker processes (default: MASTERING_WORKERS or one per core)")
+    parser.add_argument("--visibility-timeout", type=float,
+                        default=float(os.environ.get("JOB_VISIBILITY_TIMEOUT", VISIBILITY_TIMEOUT)))
+    parser.add_argument("--no-warm-up", action="store_true", help="Skip importing the audio stack up front")
+    args = parser.parse_args(argv)
+    if not args.queue:
+        parser.error("--queue or JOB_QUEUE_PATH is required")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+    count = args.processes or os.cpu_count() or 1
+    context = multiprocessing.get_context("spawn")
+    worker_args = (args.queue, args.visibility_timeout, not args.no_warm_up)
+    stopping = threading.Event()
+
+    def start(index: int):
+        process = context.Process(target=_worker_main, args=worker_args, name=f"queue-worker-{index}")
+        process.start()
+        return process
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    processes = [start(i) for i in range(count)]
+    logger.info(f"Started {count} queue workers on {args.queue}")
+
+    # Replace workers that die; their leases expire and the jobs run again elsewhere
+    while not stopping.wait(1.0):
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                logger.warning(f"Queue worker {process.name} exited with {process.exitcode}; restarting")
+                processes[i] = start(i)
+
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
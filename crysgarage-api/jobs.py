@@ -0,0 +1,346 @@
+"""
+Background job subsystem for CrysGarage
+Runs CPU-bound mastering work in a bounded process pool so the event loop stays responsive
+"""
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+
+def _default_worker_count() -> int:
+    configured = int(os.environ.get("MASTERING_WORKERS", "0"))
+    if configured > 0:
+        return configured
+    # Leave one core for the event loop and uploads
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class JobManager:
+    """Submit callables to a process pool and track them by job id"""
+
+    def __init__(self, max_workers: int = None, job_ttl: float = 3600.0, initializer=None):
+        self.max_workers = max_workers or _default_worker_count()
+        self.job_ttl = job_ttl
+        self.initializer = initializer
+        self._executor = None
+        self._jobs = {}
+        logger.info(f"JobManager initialized with {self.max_workers} workers")
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # Created on first use so importing the app never starts workers.
+        # Spawned (not forked) so workers never inherit locks or half-imported
+        # modules from threads running in the API process.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.initializer,
+            )
+        return self._executor
+
+    def prewarm(self):
+        """Start every worker now so their initializer runs before the first real job"""
+        for _ in range(self.max_workers):
+            self.executor.submit(_ping)
+
+    async def submit(self, fn, *args, meta: dict = None, **kwargs) -> str:
+        """
+        Schedule fn(*args, **kwargs) in the process pool
+
+        Args:
+            fn: Picklable top-level function to run in a worker process
+            meta: Extra fields echoed back in the job status (tier, genre, ...)
+
+        Returns:
+            str: Job id usable with status() and wait()
+        """
+        job_id = self.create(meta)
+        self.start(job_id, fn, *args, **kwargs)
+        return job_id
+
+    def create(self, meta: dict = None) -> str:
+        """Register a queued job that has not been handed to the pool yet (see start)"""
+        self._prune()
+
+        job_id = str(uuid.uuid4())
+        future = asyncio.get_event_loop().create_future()
+        self._jobs[job_id] = {
+            "info": {
+                "job_id": job_id,
+                "status": "queued",
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                **(meta or {}),
+            },
+            "concurrent_future": None,
+            "future": future,
+        }
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        logger.info(f"Job {job_id} queued ({len(self._jobs)} tracked)")
+        return job_id
+
+    def _discard_pool(self, executor: ProcessPoolExecutor):
+        """Drop a broken pool so the next job starts a fresh one"""
+        if self._executor is executor:
+            logger.warning("Process pool broke (a worker died); starting a new one for later jobs")
+            executor.shutdown(wait=False)
+            self._executor = None
+
+    def start(self, job_id: str, fn, *args, **kwargs):
+        """Hand a job created with create() to the process pool"""
+        job = self._jobs[job_id]
+        job["info"]["started_at"] = time.time()
+        executor = self.executor
+        try:
+            job["concurrent_future"] = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # Broke before its jobs reported back; this job was never in it
+            self._discard_pool(executor)
+            executor = self.executor
+            job["concurrent_future"] = executor.submit(fn, *args, **kwargs)
+
+        def relay(pool_future: asyncio.Future):
+            if not pool_future.cancelled() and isinstance(pool_future.exception(), BrokenProcessPool):
+                self._discard_pool(executor)
+            if job["future"].done():
+                return
+            if pool_future.cancelled():
+                job["future"].cancel()
+            elif pool_future.exception() is not None:
+                job["future"].set_exception(pool_future.exception())
+            else:
+                job["future"].set_result(pool_future.result())
+
+        asyncio.wrap_future(job["concurrent_future"]).add_done_callback(relay)
+
+    def add_completed(self, result, meta: dict = None) -> str:
+        """Register a job that is already done (e.g. a cache hit) so clients can poll it as usual"""
+        self._prune()
+
+        job_id = str(uuid.uuid4())
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(result)
+        now = time.time()
+        self._jobs[job_id] = {
+            "info": {
+                "job_id": job_id,
+                "status": "completed",
+                "created_at": now,
+                "started_at": now,
+                "finished_at": now,
+                "result": result,
+                "error": None,
+                **(meta or {}),
+            },
+            "concurrent_future": None,
+            "future": future,
+        }
+        return job_id
+
+    def fail(self, job_id: str, error: Exception):
+        """Fail a job that never reached the pool"""
+        future = self._jobs[job_id]["future"]
+        if not future.done():
+            future.set_exception(error)
+
+    def add_done_callback(self, job_id: str, callback):
+        """Call callback(status_dict) on the event loop once the job finishes"""
+        job = self._jobs[job_id]
+        # Registered after _finish, so the status is final when callback runs
+        job["future"].add_done_callback(lambda f: callback(self.status(job_id)))
+
+    def _finish(self, job_id: str, future: asyncio.Future):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        info = job["info"]
+        info["finished_at"] = time.time()
+        if future.cancelled():
+            info["status"] = "cancelled"
+        elif future.exception() is not None:
+            info["status"] = "failed"
+            info["error"] = str(future.exception())
+            logger.error(f"Job {job_id} failed: {future.exception()}")
+        else:
+            info["status"] = "completed"
+            info["result"] = future.result()
+            logger.info(f"Job {job_id} completed in {info['finished_at'] - info['created_at']:.2f}s")
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["info"]["finished_at"] is not None and job["info"]["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def status(self, job_id: str) -> dict:
+        """Return a snapshot of the job, or None if the id is unknown"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        info = dict(job["info"])
+        if info["status"] == "queued" and job["concurrent_future"] is not None and job["concurrent_future"].running():
+            info["status"] = "running"
+        return info
+
+    async def wait(self, job_id: str):
+        """Wait for a job and return its result, re-raising any worker exception"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        # Shielded so one cancelled waiter does not cancel the others
+        return await asyncio.shield(job["future"])
+
+    def in_flight(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job["future"].done())
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+class QueueJobManager:
+    """
+    JobManager interface over a shared JobQueue
+
+    Work runs in queue worker processes (see job_queue), possibly on other
+    hosts. Status is read from the queue, so any API process can answer for
+    any job; wait() and done callbacks resolve in the process that asked,
+    driven by a poller on its event loop. The poller also keeps a snapshot of
+    the queue's counts, so admission and stats never query SQLite on the loop.
+    """
+
+    def __init__(self, queue, job_ttl: float = 3600.0, poll_interval: float = 0.1,
+                 stats_interval: float = 1.0):
+        self.queue = queue
+        self.job_ttl = job_ttl
+        self.poll_interval = poll_interval
+        self.stats_interval = stats_interval
+        # Futures resolved with the final status dict, by job id
+        self._watched = {}
+        self._poller = None
+        self._last_prune = 0.0
+        # Snapshot refreshed every stats_interval: JobQueue.counts(), mean run
+        # time per tier (None until one completes) and live workers
+        self.counts = {}
+        self.service_seconds = {}
+        self.tiers = set()
+        self._live_workers = 0
+        self._last_refresh = 0.0
+        logger.info(f"QueueJobManager using {queue.path}")
+
+    @property
+    def max_workers(self) -> int:
+        """Live queue workers across every host, as of the last snapshot"""
+        return max(1, self._live_workers)
+
+    def prewarm(self):
+        """Workers warm themselves up; only the result poller needs starting"""
+        self._ensure_poller()
+
+    async def enqueue(self, fn, args=(), kwargs=None, **options) -> str:
+        """Queue fn(*args, **kwargs) with JobQueue.enqueue's options, writing off the event loop"""
+        job_id = await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(self.queue.enqueue, fn, args, kwargs, **options)
+        )
+        tier = options.get("tier")
+        if tier is not None:
+            # Count it until the next snapshot, so a burst cannot overrun max_queue
+            entry = self.counts.setdefault(tier, {"queued": 0, "running": 0, "oldest_enqueued_at": time.time()})
+            entry["queued"] += 1
+        self.watch(job_id)
+        return job_id
+
+    async def submit(self, fn, *args, meta: dict = None, **kwargs) -> str:
+        """Queue fn(*args, **kwargs) as untiered work and return its job id"""
+        return await self.enqueue(fn, args, kwargs, meta=meta)
+
+    def add_completed(self, result, meta: dict = None) -> str:
+        return self.queue.add_completed(result, meta)
+
+    def watch(self, job_id: str) -> asyncio.Future:
+        """Future resolved with the job's final status dict"""
+        future = self._watched.get(job_id)
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self._watched[job_id] = future
+            self._ensure_poller()
+        return future
+
+    def add_done_callback(self, job_id: str, callback):
+        """Call callback(status_dict) on the event loop once the job finishes"""
+        self.watch(job_id).add_done_callback(lambda f: callback(f.result()))
+
+    def status(self, job_id: str) -> dict:
+        return self.queue.get(job_id)
+
+    async def wait(self, job_id: str):
+        """Wait for a job and return its result, raising RuntimeError with the worker's error"""
+        if job_id not in self._watched and self.queue.get(job_id) is None:
+            raise KeyError(job_id)
+        # Shielded so one cancelled waiter does not cancel the others
+        info = await asyncio.shield(self.watch(job_id))
+        if info["status"] != "completed":
+            raise RuntimeError(info["error"])
+        return info["result"]
+
+    def in_flight(self) -> int:
+        return sum(tier["queued"] + tier["running"] for tier in self.counts.values())
+
+    def _snapshot(self, tiers: list) -> tuple:
+        counts = self.queue.counts()
+        service = {tier: self.queue.service_seconds(tier) for tier in set(tiers) | set(counts)}
+        return counts, service, self.queue.live_workers()
+
+    def _ensure_poller(self):
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll())
+
+    async def _poll(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if self._watched:
+                    finished = await loop.run_in_executor(None, self.queue.finished, list(self._watched))
+                    for job_id, info in finished.items():
+                        if info["status"] == "failed":
+                            logger.error(f"Job {job_id} failed: {info['error']}")
+                        future = self._watched.pop(job_id, None)
+                        if future is not None and not future.done():
+                            future.set_result(info)
+                if time.time() - self._last_refresh >= self.stats_interval:
+                    self._last_refresh = time.time()
+                    self.counts, self.service_seconds, self._live_workers = await loop.run_in_executor(
+                        None, self._snapshot, list(self.tiers)
+                    )
+                if time.time() - self._last_prune > 60.0:
+                    self._last_prune = time.time()
+                    await loop.run_in_executor(None, self.queue.prune, self.job_ttl)
+            except Exception as e:
+                logger.error(f"Job queue poll failed: {e}")
+
+    def shutdown(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
@@ -0,0 +1,210 @@
+"""
+Streaming loudness normalization for CrysGarage
+Measures ITU-R BS.1770 integrated loudness and applies gain block by block,
+so memory stays bounded no matter how long the track is
+"""
+
+import logging
+
+import numpy as np
+import scipy.signal
+import pyloudnorm as pyln
+
+from audio_decoder import iter_blocks, probe, read_audio
+from genre_presets import GenreProcessor, preset_name, process_blocks
+from mastering_chain import write_mastered
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+STREAM_BLOCK_FRAMES = 65536
+
+# BS.1770 channel weights (L, R, C, Ls, Rs), same as pyloudnorm
+CHANNEL_GAINS = np.array([1.0, 1.0, 1.0, 1.41, 1.41])
+ABSOLUTE_GATE = -70.0
+OVERLAP = 0.75
+
+
+class StreamingLoudnessMeter:
+    """
+    Incremental equivalent of pyln.Meter(rate).integrated_loudness
+
+    Feed (frames, channels) blocks to process() in order, then call
+    integrated_loudness(). K-weighting filter state carries across blocks and
+    only one gating block of filtered samples plus one mean-square value per
+    400 ms gating block are kept.
+    """
+
+    def __init__(self, rate: int, channels: int, total_frames: int, block_size: float = 0.400):
+        self.rate = rate
+        self.channels = channels
+        self.block_size = block_size
+
+        # Reuse pyloudnorm's K-weighting design so results match the in-memory path
+        meter = pyln.Meter(rate, block_size=block_size)
+        self._filters = []
+        for stage in meter._filters.values():
+            order = max(len(stage.a), len(stage.b)) - 1
+            self._filters.append({
+                "b": stage.b,
+                "a": stage.a,
+                "gain": stage.passband_gain,
+                "zi": np.zeros((order, channels)),
+            })
+
+        step = 1.0 - OVERLAP
+        duration = total_frames / rate
+        self._num_blocks = int(np.round((duration - block_size) / (block_size * step))) + 1
+        self._step = step
+        self._z = np.zeros((channels, max(self._num_blocks, 0)))
+        self._next_block = 0
+        self._pending = np.zeros((0, channels))
+        self._pending_start = 0
+
+    def _bounds(self, j: int):
+        lower = int(self.block_size * (j * self._step) * self.rate)
+        upper = int(self.block_size * (j * self._step + 1) * self.rate)
+        return lower, upper
+
+    def _consume(self, final: bool = False):
+        available_end = self._pending_start + len(self._pending)
+        scale = 1.0 / (self.block_size * self.rate)
+
+        while self._next_block < self._num_blocks:
+            lower, upper = self._bounds(self._next_block)
+            if upper > available_end and not final:
+                break
+            window = self._pending[lower - self._pending_start:upper - self._pending_start]
+            self._z[:, self._next_block] = scale * window.sum(axis=0)
+            self._next_block += 1
+
+        # Drop samples no remaining gating block needs
+        if self._next_block < self._num_blocks:
+            keep_from = self._bounds(self._next_block)[0]
+        else:
+            keep_from = available_end
+        drop = keep_from - self._pending_start
+        if drop > 0:
+            self._pending = self._pending[drop:]
+            self._pending_start = keep_from
+
+    def process(self, block: np.ndarray):
+        """Filter one (frames, channels) block and accumulate its gating energies"""
+        filtered = np.asarray(block, dtype=np.float64)
+        for stage in self._filters:
+            filtered, stage["zi"] = scipy.signal.lfilter(stage["b"], stage["a"], filtered, axis=0, zi=stage["zi"])
+            filtered *= stage["gain"]
+
+        np.square(filtered, out=filtered)
+        self._pending = np.concatenate([self._pending, filtered]) if len(self._pending) else filtered
+        self._consume()
+
+    def integrated_loudness(self) -> float:
+        """Gated integrated loudness in LUFS over everything processed so far"""
+        self._consume(final=True)
+        z = self._z
+        gains = CHANNEL_GAINS[:self.channels, np.newaxis]
+
+        with np.errstate(divide="ignore"):
+            block_loudness = -0.691 + 10.0 * np.log10((gains * z).sum(axis=0))
+
+        gated = block_loudness >= ABSOLUTE_GATE
+        if not gated.any():
+            return float("-inf")
+        relative_gate = -0.691 + 10.0 * np.log10((gains[:, 0] * z[:, gated].mean(axis=1)).sum()) - 10.0
+
+        gated = (block_loudness > relative_gate) & (block_loudness > ABSOLUTE_GATE)
+        if not gated.any():
+            return float("-inf")
+        with np.errstate(divide="ignore"):
+            return float(-0.691 + 10.0 * np.log10((gains[:, 0] * z[:, gated].mean(axis=1)).sum()))
+
+
+def _timed_blocks(path: str, info: dict, block_frames: int, timings: dict):
+    """Yield float32 blocks, charging the read time to the decode stage"""
+    blocks = iter_blocks(path, block_frames, info=info)
+    while True:
+        with stage_timer(timings, "decode"):
+            block = next(blocks, None)
+        if block is None:
+            return
+        yield block
+
+
+def measure_file_loudness(path: str, block_frames: int = STREAM_BLOCK_FRAMES, timings: dict = None) -> float:
+    """Integrated loudness of a file in one bounded-memory pass"""
+    info = probe(path)
+    if info["decoder"] == "ffmpeg":
+        # ffmpeg only estimates the frame count, and the gating grid needs the exact one
+        with stage_timer(timings, "decode"):
+            data, rate = read_audio(path, info=info)
+        with stage_timer(timings, "loudness_measure"):
+            meter = StreamingLoudnessMeter(rate, data.shape[1], data.shape[0])
+            meter.process(data)
+            return meter.integrated_loudness()
+
+    meter = StreamingLoudnessMeter(info["sample_rate"], info["channels"], info["frames"])
+    for block in _timed_blocks(path, info, block_frames, timings):
+        with stage_timer(timings, "loudness_measure"):
+            meter.process(block)
+    with stage_timer(timings, "loudness_measure"):
+        return meter.integrated_loudness()
+
+
+def normalize_file_streaming(input_path: str, output_path: str, target_lufs: float,
+                             loudness: float = None, genre: str = None, block_frames: int = STREAM_BLOCK_FRAMES,
+                             timings: dict = None, peaks_path: str = None) -> dict:
+    """
+    Normalize a file to target_lufs with two block-streaming passes
+
+    The second pass runs the gain through the mastering chain, so peaks the
+    gain pushes over the true-peak ceiling are limited instead of clipped.
+    A genre with a preset (see genre_presets) is applied ahead of the chain;
+    it changes the loudness, so its output is measured in an extra pass.
+
+    Args:
+        input_path: Any file libsndfile can read, or a decoded intermediate (see audio_decoder.probe)
+        output_path: Destination; the container follows its extension
+        target_lufs: Target integrated loudness
+        loudness: Already measured loudness of input_path, skips the first pass
+        genre: Genre form value; ignored when it has no preset
+        timings: Optional dict that accumulates seconds per stage
+        peaks_path: Where to write the output's waveform peak pyramid, if anywhere
+
+    Returns:
+        dict: loudness, gain_db, sample_rate, channels, frames, limiter_reduction_db
+    """
+    if loudness is None:
+        loudness = measure_file_loudness(input_path, block_frames, timings)
+    preset = preset_name(genre)
+
+    info = probe(input_path)
+    sr, channels, frames = info["sample_rate"], info["channels"], info["frames"]
+
+    def blocks():
+        timed = _timed_blocks(input_path, info, block_frames, timings)
+        if preset is None:
+            return timed
+        return process_blocks(timed, GenreProcessor(preset, sr, channels, loudness), timings)
+
+    mastered_loudness = loudness
+    if preset is not None:
+        meter = StreamingLoudnessMeter(sr, channels, frames)
+        for block in blocks():
+            with stage_timer(timings, "loudness_measure"):
+                meter.process(block)
+        with stage_timer(timings, "loudness_measure"):
+            mastered_loudness = meter.integrated_loudness()
+
+    gain_db = target_lufs - mastered_loudness if np.isfinite(mastered_loudness) else 0.0
+    chain = write_mastered(blocks(), output_path, sr, channels, gain_db, timings,
+                           peaks_path=peaks_path, block_frames=block_frames)
+
+    return {
+        "loudness": loudness,
+        "gain_db": gain_db,
+        "sample_rate": sr,
+        "channels": channels,
+        "frames": frames,
+        "limiter_reduction_db": chain.reduction_db,
+    }
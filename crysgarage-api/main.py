@@ -1,26 +1,36 @@
+import asyncio
+import math
 import os
 import logging
 import tempfile
 import uuid
-from typing import Optional
+import json
+import time
+import zipfile
+from typing import List, Optional
 from urllib.parse import urlparse
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 
-# Audio processing imports
-try:
-    import librosa
-    import soundfile as sf
-    import pyloudnorm as pyln
-    from pydub import AudioSegment
-    AUDIO_PROCESSING_AVAILABLE = True
-except ImportError as e:
-    logging.warning(f"Audio processing libraries not available: {e}")
-    AUDIO_PROCESSING_AVAILABLE = False
+# Heavy audio libraries (soundfile, pyloudnorm, scipy) are imported lazily
+# inside the functions that use them and warmed up in the background
+import audio_stack
+from audio_stack import AUDIO_PROCESSING_AVAILABLE
 
-from audio_converter import AudioConverter
+from audio_converter import AudioConverter, FILE_EXTENSIONS
+from audio_decoder import probe, read_audio
+from decoded_store import DecodedStore
+from downloads import file_response
+from job_queue import VISIBILITY_TIMEOUT, JobQueue
+from jobs import JobManager, QueueJobManager
+from metrics import REGISTRY, stage_timer
+from peaks import PEAKS_SUFFIX
+from result_cache import ResultCache
+from retention import RetentionManager
+from scheduler import QueueFull, QueueScheduler, TierScheduler
+from uploads import UploadSessions, extract_zip_tracks, save_upload
 
 
 logging.basicConfig(level=logging.INFO)
@@ -37,13 +47,63 @@ app.add_middleware(
 )
 
 audio_converter = AudioConverter()
+# With a shared queue, jobs run in `python job_queue.py` workers instead of this
+# process's pool, so worker processes on several hosts can split the load
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH")
+if JOB_QUEUE_PATH:
+    job_manager = QueueJobManager(JobQueue(
+        JOB_QUEUE_PATH, visibility_timeout=float(os.environ.get("JOB_VISIBILITY_TIMEOUT", VISIBILITY_TIMEOUT)),
+    ))
+else:
+    job_manager = JobManager(initializer=audio_stack.warm_up)
 
-PROCESSED_FILES_DIR = "/var/www/mastering/processed"
-UPLOAD_DIR = "/var/www/mastering/uploads"
+PROCESSED_FILES_DIR = os.environ.get("PROCESSED_FILES_DIR", "/var/www/mastering/processed")
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "/var/www/mastering/uploads")
+
+# Most tracks (or zip members) accepted by one /master/batch request
+BATCH_MAX_TRACKS = int(os.environ.get("BATCH_MAX_TRACKS", 100))
+
+# /analyze-upload serves the advanced tier, so it queues with that tier's jobs
+ANALYSIS_TIER = "advanced"
+
+# Inputs at least this large are mastered with bounded-memory block streaming
+STREAMING_THRESHOLD_BYTES = int(os.environ.get("STREAMING_THRESHOLD_BYTES", 20 * 1024 * 1024))
+
+# Peaks of a file_id never change once written
+PEAKS_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 os.makedirs(PROCESSED_FILES_DIR, exist_ok=True)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+result_cache = ResultCache(os.path.join(PROCESSED_FILES_DIR, ".cache"))
+# Serializes result-cache lookups with the submits they lead to (see _queue_saved_upload)
+submit_lock = asyncio.Lock()
+
+# Uploads decoded once to raw float32, shared by analysis, mastering and previews
+decoded_store = DecodedStore(
+    os.environ.get("DECODED_DIR", os.path.join(PROCESSED_FILES_DIR, ".decoded")),
+    ttl=float(os.environ.get("DECODED_TTL_SECONDS", 3600)),
+    quota_bytes=int(os.environ.get("DECODED_STORE_QUOTA", 10 * 1024 * 1024 * 1024)),
+)
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "crysgarage_stage_seconds", "Wall time per mastering stage", ["stage", "tier", "format"]
+)
+BYTES_PROCESSED = REGISTRY.counter("crysgarage_bytes_processed_total", "Uploaded bytes mastered", ["tier"])
+AUDIO_SECONDS_PROCESSED = REGISTRY.counter(
+    "crysgarage_audio_seconds_processed_total", "Seconds of audio mastered", ["tier"]
+)
+REALTIME_FACTOR = REGISTRY.histogram(
+    "crysgarage_realtime_factor", "Audio seconds mastered per wall second, per job", ["tier"],
+    buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "crysgarage_event_loop_lag_seconds", "Delay between a scheduled and actual event loop wakeup",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+EVENT_LOOP_LAG_MAX = REGISTRY.gauge("crysgarage_event_loop_lag_max_seconds", "Largest event loop lag seen")
+JOBS_IN_FLIGHT = REGISTRY.gauge("crysgarage_jobs_in_flight", "Jobs queued or running in the worker pool")
+
 TIER_CONFIGS = {
     "free": {
         "name": "Free Tier",
@@ -52,6 +112,12 @@ TIER_CONFIGS = {
         "max_file_size": 50 * 1024 * 1024,
         "processing_time": 30,
         "target_lufs": -14.0,
+        # Scheduling: 0 is most urgent; processing_time is the queue deadline in seconds
+        "priority": 2,
+        "max_concurrent_share": 0.5,
+        "max_queue": 20,
+        # Bytes kept in PROCESSED_FILES_DIR/free before least recently used files are evicted
+        "storage_quota": int(os.environ.get("STORAGE_QUOTA_FREE", 5 * 1024 * 1024 * 1024)),
     },
     "professional": {
         "name": "Professional Tier",
@@ -60,6 +126,12 @@ TIER_CONFIGS = {
         "max_file_size": 100 * 1024 * 1024,
         "processing_time": 60,
         "target_lufs": -12.0,
+        # Scheduling: 0 is most urgent; processing_time is the queue deadline in seconds
+        "priority": 1,
+        "max_concurrent_share": 1.0,
+        "max_queue": 50,
+        # Bytes kept in PROCESSED_FILES_DIR/professional before least recently used files are evicted
+        "storage_quota": int(os.environ.get("STORAGE_QUOTA_PROFESSIONAL", 20 * 1024 * 1024 * 1024)),
     },
     "advanced": {
         "name": "Advanced Tier",
@@ -68,61 +140,203 @@ TIER_CONFIGS = {
         "max_file_size": 200 * 1024 * 1024,
         "processing_time": 90,
         "target_lufs": -10.0,
+        # Scheduling: 0 is most urgent; processing_time is the queue deadline in seconds
+        "priority": 0,
+        "max_concurrent_share": 1.0,
+        "max_queue": 100,
+        # Bytes kept in PROCESSED_FILES_DIR/advanced before least recently used files are evicted
+        "storage_quota": int(os.environ.get("STORAGE_QUOTA_ADVANCED", 50 * 1024 * 1024 * 1024)),
     },
 }
 
+# Orphaned uploads older than this are removed; sweeps run every RETENTION_INTERVAL seconds
+UPLOAD_TTL_SECONDS = float(os.environ.get("UPLOAD_TTL_SECONDS", 6 * 3600))
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", 60))
+
+scheduler = (QueueScheduler if JOB_QUEUE_PATH else TierScheduler)(job_manager, TIER_CONFIGS)
+upload_sessions = UploadSessions(UPLOAD_DIR)
+
+retention = RetentionManager(
+    PROCESSED_FILES_DIR, UPLOAD_DIR, {tier: config["storage_quota"] for tier, config in TIER_CONFIGS.items()},
+    upload_ttl=UPLOAD_TTL_SECONDS,
+)
+
 
-def process_audio_file(input_path: str, output_path: str, tier: str = "professional", genre: str = "default"):
+def _use_streaming(input_path: str) -> bool:
+    """Large files that libsndfile or the decoded store can read are mastered block by block"""
+    if os.path.getsize(input_path) < STREAMING_THRESHOLD_BYTES:
+        return False
+    try:
+        # Compressed containers decode through ffmpeg, whose frame count is
+        # only an estimate, so they take the in-memory path
+        return probe(input_path)["decoder"] in ("sndfile", "memmap")
+    except RuntimeError:
+        return False
+
+
+def process_audio_file(input_path: str, output_path: str, tier: str = "professional", genre: str = "default",
+                       streaming: Optional[bool] = None, loudness: Optional[float] = None,
+                       stats: Optional[dict] = None, reference_profile: Optional[dict] = None,
+                       source_path: Optional[str] = None, peaks_path: Optional[str] = None):
     """
-    Actually process audio using librosa and pyloudnorm
+    Normalize to the tier target through the mastering chain (gain, true-peak limiter, dither)
+
+    Genres with a preset (see genre_presets) get its EQ and multiband dynamics
+    first; "auto preset" copies the input unchanged.
+    Files above STREAMING_THRESHOLD_BYTES (or any file when streaming=True) are
+    normalized with two bounded-memory soundfile passes instead of a full decode.
+    A known input loudness (e.g. measured after a preview) skips the measurement.
+    When a stats dict is passed it receives per-stage seconds ("stages") and
+    the length of the processed audio ("audio_seconds").
+    With a reference_profile the input is matched to that reference instead of
+    the tier target, and stats receives the applied corrections ("matching").
+    When input_path is a decoded intermediate, source_path is the original
+    upload; copies (auto preset, failure fallback) are taken from it.
+    With a peaks_path the mastering pass also writes the output's waveform
+    peak pyramid there (see peaks); copies get none.
+
+    Returns the measured input loudness in LUFS, or None if nothing was measured.
     """
+    timings = stats.setdefault("stages", {}) if stats is not None else None
+    source_path = source_path or input_path
+
+    if reference_profile is not None and AUDIO_PROCESSING_AVAILABLE:
+        from matching import match_file
+
+        logger.info(f"Reference matching: {input_path}")
+        info = match_file(input_path, output_path, reference_profile, timings=timings,
+                          peaks_path=peaks_path)
+        if stats is not None:
+            stats["audio_seconds"] = info["audio_seconds"]
+            stats["matching"] = {key: info[key] for key in ("output_lufs", "eq_db", "side_gain")}
+        # Matching measures the Mid channel, which is not the BS.1770 loudness other paths reuse
+        return None
+
     # Handle auto preset genre - minimal processing
     if genre == "auto preset":
         logger.info(f"Auto preset genre detected - minimal processing for {input_path}")
         import shutil
-        shutil.copy2(input_path, output_path)
-        logger.info(f"Auto preset: copied {input_path} to {output_path}")
-        return
+        shutil.copy2(source_path, output_path)
+        logger.info(f"Auto preset: copied {source_path} to {output_path}")
+        return None
 
     
     if not AUDIO_PROCESSING_AVAILABLE:
         logger.warning("Audio processing not available, creating dummy file")
         with open(output_path, "wb") as f:
             f.write(b"dummy processed audio" * 1000)
-        return
+        return None
     
     try:
+        import pyloudnorm as pyln
+        from genre_presets import GenreProcessor, preset_name
+        from loudness import normalize_file_streaming
+        from mastering_chain import write_mastered
+
         logger.info(f"Processing audio: {input_path} for tier {tier}")
         
-        # Load audio
-        audio, sr = librosa.load(input_path, sr=None, mono=False)
-        logger.info(f"Loaded audio: shape={audio.shape}, sr={sr}")
-        
         # Get target LUFS from tier config
         target_lufs = TIER_CONFIGS.get(tier, {}).get("target_lufs", -14.0)
         
-        # Normalize loudness
-        meter = pyln.Meter(sr)
+        if streaming or (streaming is None and _use_streaming(input_path)):
+            info = normalize_file_streaming(input_path, output_path, target_lufs, loudness=loudness, genre=genre,
+                                            timings=timings, peaks_path=peaks_path)
+            if stats is not None:
+                stats["audio_seconds"] = info["frames"] / info["sample_rate"]
+            logger.info(f"Streamed normalization from {info['loudness']:.2f} LUFS to {target_lufs} LUFS "
+                        f"(limiter {info['limiter_reduction_db']:.2f} dB, "
+                        f"{info['frames']} frames, {info['channels']} ch, sr={info['sample_rate']})")
+            return info["loudness"]
         
-        # Handle stereo/mono
-        if audio.ndim == 1:
-            loudness = meter.integrated_loudness(audio)
-            audio_normalized = pyln.normalize.loudness(audio, loudness, target_lufs)
-        else:
-            loudness = meter.integrated_loudness(audio.T)
-            audio_normalized = pyln.normalize.loudness(audio.T, loudness, target_lufs).T
+        # Load audio as float32 (frames, channels), mono included
+        with stage_timer(timings, "decode"):
+            audio, sr = read_audio(input_path)
+        logger.info(f"Loaded audio: shape={audio.shape}, sr={sr}")
+        if stats is not None:
+            stats["audio_seconds"] = audio.shape[0] / sr
+        
+        # Measure loudness
+        meter = pyln.Meter(sr)
+        if loudness is None:
+            with stage_timer(timings, "loudness_measure"):
+                loudness = meter.integrated_loudness(audio)
+        mastered_loudness = loudness
         
-        logger.info(f"Normalized from {loudness:.2f} LUFS to {target_lufs} LUFS")
+        # Genre EQ and dynamics change the loudness, so the gain follows their output
+        preset = preset_name(genre)
+        if preset is not None:
+            GenreProcessor(preset, sr, audio.shape[1], loudness).process(audio, timings)
+            with stage_timer(timings, "loudness_measure"):
+                mastered_loudness = meter.integrated_loudness(audio)
+        gain_db = target_lufs - mastered_loudness if math.isfinite(mastered_loudness) else 0.0
         
-        # Save processed audio
-        sf.write(output_path, audio_normalized.T if audio.ndim > 1 else audio_normalized, sr)
-        logger.info(f"Saved processed audio to {output_path}")
+        # Gain, true-peak limiting and dither in place, straight into the output file
+        chain = write_mastered([audio], output_path, sr, audio.shape[1], gain_db, timings,
+                               peaks_path=peaks_path)
+        logger.info(f"Normalized from {loudness:.2f} LUFS to {target_lufs} LUFS "
+                    f"(limiter {chain.reduction_db:.2f} dB), saved to {output_path}")
+        return loudness
         
     except Exception as e:
         logger.error(f"Audio processing failed: {e}")
         # Fallback to copying input file
         import shutil
-        shutil.copy2(input_path, output_path)
+        shutil.copy2(source_path, output_path)
+        return None
+
+
+EVENT_LOOP_PROBE_INTERVAL = 0.5
+
+
+async def _monitor_event_loop():
+    """Sleep for a fixed interval and record how late the loop wakes us up"""
+    loop = asyncio.get_event_loop()
+    worst = 0.0
+    while True:
+        scheduled = loop.time() + EVENT_LOOP_PROBE_INTERVAL
+        await asyncio.sleep(EVENT_LOOP_PROBE_INTERVAL)
+        lag = max(0.0, loop.time() - scheduled)
+        EVENT_LOOP_LAG.observe(lag)
+        if lag > worst:
+            worst = lag
+            EVENT_LOOP_LAG_MAX.set(worst)
+
+
+async def _run_retention():
+    """Build the retention index once, then sweep on a fixed interval off the event loop"""
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, retention.scan)
+    while True:
+        try:
+            await loop.run_in_executor(None, retention.sweep)
+            await loop.run_in_executor(None, decoded_store.sweep)
+        except Exception as e:
+            logger.error(f"Retention sweep failed: {e}", exc_info=True)
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+
+@app.on_event("startup")
+async def start_monitors():
+    JOBS_IN_FLIGHT.set_function(job_manager.in_flight)
+    app.state.event_loop_monitor = asyncio.ensure_future(_monitor_event_loop())
+    app.state.retention_task = asyncio.ensure_future(_run_retention())
+    # Neither call blocks: workers warm up in their initializer, the API process on a thread
+    job_manager.prewarm()
+    audio_stack.start_background_warm_up()
+
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    for task_name in ("event_loop_monitor", "retention_task"):
+        task = getattr(app.state, task_name, None)
+        if task is not None:
+            task.cancel()
+    job_manager.shutdown()
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/health")
@@ -131,6 +345,7 @@ async def health_check():
         "status": "healthy",
         "service": "unified-backend-production",
         "audio_processing": AUDIO_PROCESSING_AVAILABLE,
+        "warmup": audio_stack.status(),
         "version": "2.0.0"
     }
 
@@ -159,6 +374,528 @@ async def credits_balance_for_user(user_id: str):
     }
 
 
+def _mastered_response(file_id: str, tier: str, genre: str, output_path: str) -> dict:
+    """Build the response shape the frontend expects for a finished master"""
+    mastered_rel = f"/files/{tier}/{os.path.basename(output_path)}"
+    mastered_abs = f"https://crysgarage.studio{mastered_rel}"
+    file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+
+    return {
+        "file_id": file_id,
+        "status": "completed",
+        "processed_file": mastered_rel,
+        "mastered_url": mastered_abs,
+        "masteredUrl": mastered_abs,
+        "processedUrl": mastered_abs,
+        "processed_audio_url": mastered_abs,  # For frontend download compatibility
+        "file_url": mastered_abs,  # Additional alias for frontend compatibility
+        "size": file_size,
+        "tier": tier,
+        "genre": genre,
+    }
+
+
+def _finite_or_none(value):
+    return value if value is not None and math.isfinite(value) else None
+
+
+def _decoded_source(upload_path: str, content_hash: Optional[str], timings: Optional[dict] = None) -> str:
+    """The upload's decoded intermediate (decoding it now if needed), or the upload itself"""
+    if content_hash is None or not AUDIO_PROCESSING_AVAILABLE:
+        return upload_path
+    try:
+        return decoded_store.ensure(content_hash, upload_path, timings)
+    except Exception as e:
+        logger.warning(f"Decoded store unavailable for {upload_path}, reading it directly: {e}")
+        return upload_path
+
+
+def _peaks_path(tier: str, file_id: str) -> str:
+    return os.path.join(PROCESSED_FILES_DIR, tier, f"peaks_{file_id}{PEAKS_SUFFIX}")
+
+
+def run_mastering_job(upload_path: str, output_path: str, file_id: str, tier: str, genre: str,
+                      loudness: Optional[float] = None, export: Optional[dict] = None,
+                      reference_path: Optional[str] = None, reference_profile: Optional[dict] = None,
+                      content_hash: Optional[str] = None) -> dict:
+    """
+    Worker-process entry point: master one upload and build its response
+
+    With export settings the mastered WAV is encoded to the requested format,
+    sample rate, bitrate and bit depth before the response is built. With a
+    reference (an uploaded file, or its cached profile) the upload is matched
+    to it; a freshly computed profile is returned for the parent to cache.
+    With a content_hash the upload is read through the decoded store.
+    The master's waveform peaks are written next to it for /peaks.
+    """
+    mastered_path = output_path if export is None else f"{output_path}.master.wav"
+    peaks_path = _peaks_path(tier, file_id)
+    stats = {"stages": {}, "audio_seconds": 0.0}
+    started = time.perf_counter()
+    try:
+        if reference_path is not None and reference_profile is None:
+            from matching import reference_profile as analyze_reference
+            with stage_timer(stats["stages"], "reference_analysis"):
+                reference_profile = analyze_reference(reference_path)
+        if genre != "auto preset":
+            input_path = _decoded_source(upload_path, content_hash, stats["stages"])
+        else:
+            input_path = upload_path
+        measured = process_audio_file(input_path, mastered_path, tier=tier, genre=genre, loudness=loudness,
+                                      stats=stats, reference_profile=reference_profile, source_path=upload_path,
+                                      peaks_path=peaks_path)
+        if export is not None:
+            with stage_timer(stats["stages"], "encode"):
+                audio_converter.convert_audio(
+                    mastered_path, output_path, export["format"], export["sample_rate"],
+                    mp3_bitrate_kbps=export["mp3_bitrate_kbps"], wav_bit_depth=export["wav_bit_depth"],
+                    # A WAV under an .mp3 name must fail the job, not be cached as the master
+                    copy_on_failure=False,
+                )
+    finally:
+        # Clean up upload and intermediate master
+        for path in {upload_path, mastered_path, reference_path} - {output_path, None}:
+            if os.path.exists(path):
+                os.remove(path)
+
+    result = _mastered_response(file_id, tier, genre, output_path)
+    result["input_lufs"] = _finite_or_none(measured)
+    result["format"] = export["format"] if export else "WAV"
+    result["audio_seconds"] = stats["audio_seconds"]
+    result["processing_seconds"] = time.perf_counter() - started
+    result["timings"] = {stage: round(seconds, 4) for stage, seconds in stats["stages"].items()}
+    if os.path.exists(peaks_path):
+        result["peaks_url"] = f"https://crysgarage.studio/peaks/{file_id}"
+    if reference_profile is not None:
+        result["reference_profile"] = reference_profile
+        result["matching"] = stats.get("matching")
+    return result
+
+
+def run_loudness_job(upload_path: str, content_hash: Optional[str] = None):
+    """
+    Worker-process entry point: measure whole-track loudness, then drop the upload
+
+    The measurement reads the decoded intermediate, so a later full master of
+    the same upload does not decode it again.
+    """
+    from loudness import measure_file_loudness
+
+    try:
+        return _finite_or_none(measure_file_loudness(_decoded_source(upload_path, content_hash)))
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+
+def _parse_export_settings(target_format: str, target_sample_rate: str,
+                           mp3_bitrate_kbps: Optional[str], wav_bit_depth: Optional[str]) -> dict:
+    """Validate /master output options, raising 400 on anything unsupported"""
+    output_format = (target_format or "WAV").upper()
+    if output_format not in audio_converter.supported_formats:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {target_format}")
+
+    try:
+        sample_rate = int(target_sample_rate)
+        bitrate = int(mp3_bitrate_kbps) if mp3_bitrate_kbps else 320
+        bit_depth = int(wav_bit_depth) if wav_bit_depth else 16
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid export setting: {e}")
+
+    if not 8000 <= sample_rate <= 192000:
+        raise HTTPException(status_code=400, detail=f"Unsupported sample rate: {sample_rate}")
+    if not 32 <= bitrate <= 512:
+        raise HTTPException(status_code=400, detail=f"Unsupported MP3 bitrate: {bitrate}")
+    if bit_depth not in (16, 24, 32):
+        raise HTTPException(status_code=400, detail=f"Unsupported bit depth: {bit_depth}")
+
+    return {
+        "format": output_format,
+        "sample_rate": sample_rate,
+        "mp3_bitrate_kbps": bitrate,
+        "wav_bit_depth": bit_depth,
+    }
+
+
+def _admit(tier: str, count: int = 1):
+    """Turn a full tier queue into 429 before any upload bytes are read"""
+    try:
+        scheduler.admit(tier, count)
+    except QueueFull as e:
+        logger.warning(f"Rejecting {count} {tier} job(s): {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def _submit_mastering(upload: UploadFile, tier: str, genre: str, export: Optional[dict] = None) -> str:
+    """Save an upload and queue it for mastering, returning the job id"""
+    _admit(tier)
+    file_id = str(uuid.uuid4())
+
+    # Save uploaded file
+    upload_path = os.path.join(UPLOAD_DIR, f"{file_id}_input")
+    upload_stats = await save_upload(upload, upload_path, TIER_CONFIGS[tier]["max_file_size"])
+    STAGE_SECONDS.observe(
+        upload_stats["seconds"], stage="upload_receive", tier=tier, format=export["format"] if export else "WAV"
+    )
+
+    return await _queue_saved_upload(file_id, upload_stats, upload.filename, tier, genre, export)
+
+
+async def _queue_saved_upload(file_id: str, upload_stats: dict, filename: str, tier: str, genre: str,
+                        export: Optional[dict] = None, reference: Optional[dict] = None) -> str:
+    """
+    Queue an upload already on disk, going through the result cache first
+
+    reference (for matching) holds the reference's sha256 plus either its saved
+    path or its cached profile.
+    """
+    upload_path = upload_stats["path"]
+    reference_path = reference["path"] if reference else None
+
+    def discard_uploads():
+        for path in (upload_path, reference_path):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    output_dir = os.path.join(PROCESSED_FILES_DIR, tier)
+    os.makedirs(output_dir, exist_ok=True)
+    extension = FILE_EXTENSIONS[export["format"]] if export else "wav"
+    output_path = os.path.join(output_dir, f"mastered_{file_id}.{extension}")
+
+    meta = {
+        "file_id": file_id,
+        "tier": tier,
+        "genre": genre,
+        "upload_bytes": upload_stats["bytes"],
+        "upload_throughput_mbps": round(upload_stats.get("throughput_mbps", 0.0), 2),
+    }
+
+    # Identical upload + parameters: reuse the finished file or join the running render
+    extra = ["reference", reference["sha256"]] if reference else []
+    if export:
+        cache_key = ResultCache.make_key(
+            upload_stats["sha256"], tier, genre, TIER_CONFIGS[tier]["target_lufs"], export["format"],
+            export["sample_rate"], extra=[export["mp3_bitrate_kbps"], export["wav_bit_depth"]] + extra,
+        )
+    else:
+        cache_key = ResultCache.make_key(
+            upload_stats["sha256"], tier, genre, TIER_CONFIGS[tier]["target_lufs"], "WAV", "source",
+            extra=extra or None,
+        )
+    # Submitting awaits the queue in queue mode, so hold the lock from the
+    # lookup until the render is marked in flight
+    async with submit_lock:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            discard_uploads()
+            retention.touch(result_cache.output_path(cache_key))
+            logger.info(f"Result cache hit for {filename}: {cached['file_url']}")
+            return job_manager.add_completed(cached, meta=meta)
+
+        inflight_job_id = result_cache.inflight(cache_key)
+        if inflight_job_id is not None and job_manager.status(inflight_job_id) is not None:
+            discard_uploads()
+            logger.info(f"Joining in-flight render {inflight_job_id} for {filename}")
+            return inflight_job_id
+
+        # Reuse a loudness measurement left behind by an earlier preview
+        known_loudness = result_cache.get_loudness(upload_stats["sha256"])
+
+        content_hash = upload_stats["sha256"]
+        decoded_store.acquire(content_hash)
+        try:
+            job_id = await scheduler.submit(
+                tier, run_mastering_job, upload_path, output_path, file_id, tier, genre,
+                loudness=known_loudness, export=export, meta=meta,
+                reference_path=reference_path, reference_profile=reference["profile"] if reference else None,
+                content_hash=content_hash,
+            )
+        except BaseException:
+            decoded_store.release(content_hash)
+            raise
+        result_cache.mark_inflight(cache_key, job_id)
+    job_manager.add_done_callback(job_id, lambda job: decoded_store.release(content_hash))
+    job_manager.add_done_callback(
+        job_id, lambda job: _cache_finished_master(
+            cache_key, content_hash, output_path, job,
+            reference_hash=reference["sha256"] if reference_path else None,
+        )
+    )
+    return job_id
+
+
+def _record_master_metrics(tier: str, upload_bytes: int, result: dict):
+    for stage, seconds in result.get("timings", {}).items():
+        STAGE_SECONDS.observe(seconds, stage=stage, tier=tier, format=result.get("format", "WAV"))
+    BYTES_PROCESSED.inc(upload_bytes, tier=tier)
+    AUDIO_SECONDS_PROCESSED.inc(result.get("audio_seconds", 0.0), tier=tier)
+    if result.get("processing_seconds"):
+        REALTIME_FACTOR.observe(result.get("audio_seconds", 0.0) / result["processing_seconds"], tier=tier)
+
+
+def _cache_finished_master(cache_key: str, content_hash: str, output_path: str, job: dict,
+                           reference_hash: Optional[str] = None):
+    result_cache.clear_inflight(cache_key)
+    if job is not None and job["status"] == "completed":
+        _record_master_metrics(job["tier"], job.get("upload_bytes", 0), job["result"])
+        result_cache.put(cache_key, output_path, job["result"])
+        retention.track(output_path)
+        if job["result"].get("peaks_url"):
+            retention.track(_peaks_path(job["tier"], job["result"]["file_id"]))
+        if job["result"].get("input_lufs") is not None:
+            result_cache.put_loudness(content_hash, job["result"]["input_lufs"])
+        if reference_hash is not None and job["result"].get("reference_profile") is not None:
+            result_cache.put_profile(reference_hash, job["result"]["reference_profile"])
+
+
+async def _master_preview(upload: UploadFile, tier: str, genre: str) -> dict:
+    """
+    Master a short excerpt as a scheduled job of tier
+
+    Previews share the tier's queue limits and concurrency cap with full
+    masters, so they cannot crowd out the workers. The whole-track loudness is
+    then measured in the background so the later full master of the same file
+    skips its measurement pass.
+    """
+    _admit(tier)
+    file_id = str(uuid.uuid4())
+    upload_path = os.path.join(UPLOAD_DIR, f"{file_id}_input")
+    upload_stats = await save_upload(upload, upload_path, TIER_CONFIGS[tier]["max_file_size"])
+    upload_path = upload_stats["path"]
+    content_hash = upload_stats["sha256"]
+    target_lufs = TIER_CONFIGS[tier]["target_lufs"]
+
+    cache_key = ResultCache.make_key(content_hash, tier, genre, target_lufs, "PREVIEW", "source")
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        os.remove(upload_path)
+        retention.touch(result_cache.output_path(cache_key))
+        return cached
+
+    output_dir = os.path.join(PROCESSED_FILES_DIR, tier)
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"preview_{file_id}.wav")
+
+    from preview import render_preview
+
+    known_loudness = result_cache.get_loudness(content_hash)
+    # Reuse an earlier decode; otherwise the excerpt is read straight from the upload
+    decoded_store.acquire(content_hash)
+    try:
+        job_id = await scheduler.submit(
+            tier, render_preview, decoded_store.get(content_hash) or upload_path, output_path, target_lufs,
+            loudness=known_loudness, apply_gain=genre != "auto preset", genre=genre,
+        )
+        info = await job_manager.wait(job_id)
+    except Exception:
+        os.remove(upload_path)
+        raise
+    finally:
+        decoded_store.release(content_hash)
+
+    result = _mastered_response(file_id, tier, genre, output_path)
+    result.update({
+        "is_preview": True,
+        "preview_start": info["start_seconds"],
+        "preview_duration": info["duration_seconds"],
+    })
+    result_cache.put(cache_key, output_path, result)
+    retention.track(output_path)
+
+    if known_loudness is None and _has_room(tier):
+        decoded_store.acquire(content_hash)
+        try:
+            job_id = await scheduler.submit(tier, run_loudness_job, upload_path, content_hash)
+        except BaseException:
+            decoded_store.release(content_hash)
+            raise
+        job_manager.add_done_callback(job_id, lambda job: decoded_store.release(content_hash))
+        job_manager.add_done_callback(job_id, lambda job: _remember_loudness(content_hash, job))
+    else:
+        os.remove(upload_path)
+
+    return result
+
+
+def _has_room(tier: str) -> bool:
+    """Whether tier's queue can take one more optional job (e.g. a loudness prefetch)"""
+    try:
+        scheduler.admit(tier)
+    except QueueFull:
+        return False
+    return True
+
+
+def _remember_loudness(content_hash: str, job: dict):
+    if job is not None and job["status"] == "completed" and job["result"] is not None:
+        result_cache.put_loudness(content_hash, job["result"])
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    audio: UploadFile = File(...),
+    tier: str = Form("professional"),
+    genre: str = Form("default"),
+    target_format: Optional[str] = Form(None),
+    target_sample_rate: str = Form("44100"),
+    mp3_bitrate_kbps: Optional[str] = Form(None),
+    wav_bit_depth: Optional[str] = Form(None),
+):
+    """
+    Queue a mastering job and return immediately with its id
+
+    Accepts the same optional export fields as /master; without target_format
+    the result is a WAV at the source sample rate.
+    """
+    if tier not in TIER_CONFIGS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier: {tier}")
+    export = None
+    if target_format:
+        export = _parse_export_settings(target_format, target_sample_rate, mp3_bitrate_kbps, wav_bit_depth)
+
+    try:
+        logger.info(f"Job submission: tier={tier}, genre={genre}, file={audio.filename}")
+        job_id = await _submit_mastering(audio, tier, genre, export=export)
+        return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Job submission error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/uploads", status_code=201)
+async def create_upload(
+    filename: str = Form(...),
+    size: int = Form(...),
+    tier: str = Form("advanced"),
+    sha256: Optional[str] = Form(None),
+):
+    """
+    Start a resumable upload; send the bytes with PUT /uploads/{upload_id}
+
+    sha256 (optional) is the whole file's digest, checked on finalize.
+    """
+    if tier not in TIER_CONFIGS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier: {tier}")
+    _admit(tier)
+    session = upload_sessions.create(tier, filename, size, TIER_CONFIGS[tier]["max_file_size"], sha256=sha256)
+    session["upload_url"] = f"/uploads/{session['upload_id']}"
+    return session
+
+
+def _parse_content_range(header: Optional[str]):
+    """'bytes start-end/total' -> (start, length); None when the header is absent"""
+    if header is None:
+        return None
+    try:
+        unit, _, spec = header.strip().partition(" ")
+        span, _, _total = spec.partition("/")
+        first, _, last = span.partition("-")
+        start, end = int(first), int(last)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Malformed Content-Range: {header}")
+    if unit != "bytes" or end < start:
+        raise HTTPException(status_code=400, detail=f"Malformed Content-Range: {header}")
+    return start, end - start + 1
+
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request):
+    """
+    Append one byte range to a resumable upload
+
+    The range comes from Content-Range ("bytes 0-8388607/209715200") or an
+    Upload-Offset header and must start at the current offset. An optional
+    X-Chunk-SHA256 header is verified before the range is committed.
+    """
+    content_range = _parse_content_range(request.headers.get("content-range"))
+    if content_range is not None:
+        start, length = content_range
+    elif request.headers.get("upload-offset", "").isdigit():
+        start, length = int(request.headers["upload-offset"]), None
+    else:
+        raise HTTPException(status_code=400, detail="Content-Range or Upload-Offset header required")
+
+    session = await upload_sessions.append(
+        upload_id, start, request.stream(), length=length, chunk_sha256=request.headers.get("x-chunk-sha256"),
+    )
+    return JSONResponse(session, headers={"Upload-Offset": str(session["offset"])})
+
+
+@app.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str):
+    """Current offset of a resumable upload, for clients resuming after a drop"""
+    session = upload_sessions.status(upload_id)
+    return Response(headers={
+        "Upload-Offset": str(session["offset"]),
+        "Upload-Length": str(session["total_bytes"]),
+        "Cache-Control": "no-store",
+    })
+
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    return upload_sessions.status(upload_id)
+
+
+@app.delete("/uploads/{upload_id}", status_code=204)
+async def abort_upload(upload_id: str):
+    upload_sessions.abort(upload_id)
+    return Response(status_code=204)
+
+
+@app.post("/uploads/{upload_id}/finalize", status_code=202)
+async def finalize_upload(
+    upload_id: str,
+    genre: str = Form("default"),
+    target_format: Optional[str] = Form(None),
+    target_sample_rate: str = Form("44100"),
+    mp3_bitrate_kbps: Optional[str] = Form(None),
+    wav_bit_depth: Optional[str] = Form(None),
+):
+    """
+    Queue a complete resumable upload for mastering
+
+    The part file is renamed in place and handed to the pipeline, so the bytes
+    are never copied again. Returns a job id like POST /jobs.
+    """
+    session = upload_sessions.status(upload_id)
+    tier = session["tier"]
+    export = None
+    if target_format:
+        export = _parse_export_settings(target_format, target_sample_rate, mp3_bitrate_kbps, wav_bit_depth)
+    _admit(tier)
+
+    try:
+        upload_stats = await upload_sessions.finalize(upload_id)
+        job_id = await _queue_saved_upload(upload_stats["file_id"], upload_stats, session["filename"], tier, genre, export)
+        return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Upload finalize error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+@app.get("/queue/stats")
+async def queue_stats():
+    return scheduler.stats()
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return dict(result_cache.stats(), storage=retention.stats(), decoded=decoded_store.stats())
+
+
 @app.post("/master-professional")
 async def master_professional(
     file: UploadFile = File(...),
@@ -168,45 +905,14 @@ async def master_professional(
 ):
     try:
         logger.info(f"Professional mastering: {file.filename}, genre={genre}")
-        file_id = str(uuid.uuid4())
-        
-        # Save uploaded file
-        upload_path = os.path.join(UPLOAD_DIR, f"{file_id}_input.wav")
-        with open(upload_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        logger.info(f"Saved upload: {upload_path} ({len(content)} bytes)")
-        
-        # Process audio
-        output_dir = os.path.join(PROCESSED_FILES_DIR, "professional")
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, f"mastered_{file_id}.wav")
-        
-        process_audio_file(upload_path, output_path, tier="professional", genre=genre)
-        
-        # Clean up upload
-        os.remove(upload_path)
-        
-        mastered_rel = f"/files/professional/mastered_{file_id}.wav"
-        mastered_abs = f"https://crysgarage.studio{mastered_rel}"
-        file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
-        
-        logger.info(f"✅ Professional mastering completed: file_id={file_id}, size={file_size}, file_url={mastered_abs}")
-        
-        return {
-            "file_id": file_id,
-            "status": "completed",
-            "processed_file": mastered_rel,
-            "mastered_url": mastered_abs,
-            "masteredUrl": mastered_abs,
-            "processedUrl": mastered_abs,
-            "processed_audio_url": mastered_abs,  # For frontend download compatibility
-            "file_url": mastered_abs,  # Additional alias for frontend compatibility
-            "size": file_size,
-            "tier": "professional",
-            "genre": genre,
-        }
+        job_id = await _submit_mastering(file, "professional", genre)
+        result = await job_manager.wait(job_id)
+
+        logger.info(f"✅ Professional mastering completed: file_id={result['file_id']}, size={result['size']}, file_url={result['file_url']}")
+
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Professional mastering error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -221,43 +927,10 @@ async def master_advanced(
 ):
     try:
         logger.info(f"Advanced mastering: {file.filename}, genre={genre}")
-        file_id = str(uuid.uuid4())
-        
-        # Save uploaded file
-        upload_path = os.path.join(UPLOAD_DIR, f"{file_id}_input.wav")
-        with open(upload_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        logger.info(f"Saved upload: {upload_path} ({len(content)} bytes)")
-        
-        # Process audio
-        output_dir = os.path.join(PROCESSED_FILES_DIR, "advanced")
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, f"mastered_{file_id}.wav")
-        
-        process_audio_file(upload_path, output_path, tier="advanced", genre=genre)
-        
-        # Clean up upload
-        os.remove(upload_path)
-        
-        mastered_rel = f"/files/advanced/mastered_{file_id}.wav"
-        mastered_abs = f"https://crysgarage.studio{mastered_rel}"
-        file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
-        
-        return {
-            "file_id": file_id,
-            "status": "completed",
-            "processed_file": mastered_rel,
-            "mastered_url": mastered_abs,
-            "masteredUrl": mastered_abs,
-            "processedUrl": mastered_abs,
-            "processed_audio_url": mastered_abs,  # For frontend download compatibility
-            "file_url": mastered_abs,  # Additional alias for frontend compatibility
-            "size": file_size,
-            "tier": "advanced",
-            "genre": genre,
-        }
+        job_id = await _submit_mastering(file, "advanced", genre)
+        return await job_manager.wait(job_id)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Advanced mastering error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -279,97 +952,358 @@ async def master_unified(
     """Unified mastering endpoint - routes to appropriate tier"""
     logger.info(f"Unified master endpoint: tier={tier}, genre={genre}, file={audio.filename}")
 
-    if tier == "advanced":
-        return await master_advanced(file=audio, tier=tier, genre=genre)
-    elif tier == "professional":
-        return await master_professional(file=audio, tier=tier, genre=genre)
-    elif tier == "free":
+    if tier not in TIER_CONFIGS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier: {tier}")
+
+    if is_preview.lower() == "true":
         try:
+            return await _master_preview(audio, tier, genre)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Preview mastering error: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
+
+    export = _parse_export_settings(target_format, target_sample_rate, mp3_bitrate_kbps, wav_bit_depth)
+
+    try:
+        job_id = await _submit_mastering(audio, tier, genre, export=export)
+        return await job_manager.wait(job_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"{TIER_CONFIGS[tier]['name']} mastering error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _probe_duration(path: str, size: int) -> float:
+    """Track length in seconds for scheduling; falls back to a size-based estimate"""
+    try:
+        return probe(path)["duration"]
+    except Exception:
+        # Roughly 16-bit stereo 44.1 kHz
+        return size / 176400.0
+
+
+@app.post("/master/batch")
+async def master_batch(
+    files: List[UploadFile] = File(...),
+    tier: str = Form("professional"),
+    genre: str = Form("default"),
+    target_format: str = Form("MP3"),
+    target_sample_rate: str = Form("44100"),
+    mp3_bitrate_kbps: Optional[str] = Form(None),
+    wav_bit_depth: Optional[str] = Form(None),
+):
+    """
+    Master many tracks (or zip archives of tracks) with shared settings
+
+    Tracks are queued longest-first so the worker pool stays busy until the
+    end. Results stream back as newline-delimited JSON in completion order.
+    """
+    if tier not in TIER_CONFIGS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier: {tier}")
+    export = _parse_export_settings(target_format, target_sample_rate, mp3_bitrate_kbps, wav_bit_depth)
+    max_file_size = TIER_CONFIGS[tier]["max_file_size"]
+    # A batch larger than the queue cap is only admitted into an empty queue
+    _admit(tier, min(len(files), TIER_CONFIGS[tier]["max_queue"]))
+
+    tracks = []
+    try:
+        for upload in files:
             file_id = str(uuid.uuid4())
-            upload_path = os.path.join(UPLOAD_DIR, f"{file_id}_input.wav")
+            upload_path = os.path.join(UPLOAD_DIR, f"{file_id}_input")
+            is_zip = (upload.filename or "").lower().endswith(".zip")
+            limit = max_file_size * BATCH_MAX_TRACKS if is_zip else max_file_size
+            upload_stats = await save_upload(upload, upload_path, limit)
+            upload_path = upload_stats["path"]
 
-            with open(upload_path, "wb") as buffer:
-                content = await audio.read()
-                buffer.write(content)
+            if is_zip or zipfile.is_zipfile(upload_path):
+                remaining = BATCH_MAX_TRACKS - len(tracks)
+                extracted = await asyncio.get_event_loop().run_in_executor(
+                    None, extract_zip_tracks, upload_path, UPLOAD_DIR, max_file_size, remaining
+                )
+                tracks.extend(extracted)
+            else:
+                upload_stats.update({"file_id": file_id, "name": upload.filename})
+                tracks.append(upload_stats)
 
-            output_dir = os.path.join(PROCESSED_FILES_DIR, "free")
-            os.makedirs(output_dir, exist_ok=True)
-            output_path = os.path.join(output_dir, f"mastered_{file_id}.wav")
+            if len(tracks) > BATCH_MAX_TRACKS:
+                raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_TRACKS} tracks")
+    except zipfile.BadZipFile as e:
+        for track in tracks:
+            if os.path.exists(track["path"]):
+                os.remove(track["path"])
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+    except BaseException:
+        for track in tracks:
+            if os.path.exists(track["path"]):
+                os.remove(track["path"])
+        raise
 
-            process_audio_file(upload_path, output_path, tier="free", genre=genre)     
-            os.remove(upload_path)
+    if not tracks:
+        raise HTTPException(status_code=400, detail="No audio tracks in request")
 
-            mastered_rel = f"/files/free/mastered_{file_id}.wav"
-            mastered_abs = f"https://crysgarage.studio{mastered_rel}"
-            file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
-
-            return {
-                "file_id": file_id,
-                "status": "completed",
-                "processed_file": mastered_rel,
-                "mastered_url": mastered_abs,
-                "masteredUrl": mastered_abs,
-                "processedUrl": mastered_abs,
-                "processed_audio_url": mastered_abs,
-                "file_url": mastered_abs,
-                "size": file_size,
-                "tier": "free",
-                "genre": genre,
-            }
+    # Longest-processing-time-first keeps every core busy until the batch drains
+    loop = asyncio.get_event_loop()
+    durations = await asyncio.gather(*[
+        loop.run_in_executor(None, _probe_duration, track["path"], track["bytes"]) for track in tracks
+    ])
+    order = sorted(range(len(tracks)), key=lambda i: durations[i], reverse=True)
+
+    job_ids = {}
+    for i in order:
+        track = tracks[i]
+        job_ids[i] = await _queue_saved_upload(track["file_id"], track, track["name"], tier, genre, export)
+    logger.info(f"Batch mastering: {len(tracks)} track(s), tier={tier}, format={export['format']}")
+
+    async def track_result(i: int) -> dict:
+        line = {"index": i, "filename": tracks[i]["name"], "duration": round(durations[i], 2)}
+        try:
+            line.update({"status": "completed", "result": await job_manager.wait(job_ids[i])})
         except Exception as e:
-            logger.error(f"Free mastering error: {e}", exc_info=True)
-            raise HTTPException(status_code=500, detail=str(e))
-    else:
-        raise HTTPException(status_code=400, detail=f"Unknown tier: {tier}")
+            logger.error(f"Batch track {tracks[i]['name']} failed: {e}")
+            line.update({"status": "failed", "error": str(e)})
+        return line
+
+    async def stream_results():
+        completed = failed = 0
+        for next_result in asyncio.as_completed([track_result(i) for i in job_ids]):
+            line = await next_result
+            if line["status"] == "completed":
+                completed += 1
+            else:
+                failed += 1
+            yield json.dumps(line) + "\n"
+        yield json.dumps({"status": "done", "tracks": len(tracks), "completed": completed, "failed": failed}) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
+
+@app.post("/master-matchering")
 async def master_matchering(
     target: UploadFile = File(...),
     reference: UploadFile = File(...),
     tier: str = Form("free"),
     genre: str = Form("default"),
+    target_format: Optional[str] = Form(None),
+    target_sample_rate: str = Form("44100"),
+    mp3_bitrate_kbps: Optional[str] = Form(None),
+    wav_bit_depth: Optional[str] = Form(None),
 ):
     """
-    Free tier endpoint - uses basic matchering/normalization
-    Same as free tier in /master but with dedicated endpoint name
+    Reference matching: master target towards the loudness, spectral balance and
+    stereo width of reference
+
+    Reference profiles are cached by content hash, so a reused reference is
+    never analyzed twice. Without target_format the result is a WAV.
     """
+    if tier not in TIER_CONFIGS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier: {tier}")
+    export = None
+    if target_format:
+        export = _parse_export_settings(target_format, target_sample_rate, mp3_bitrate_kbps, wav_bit_depth)
+
     try:
-        logger.info(f"Matchering (Free tier): target={target.filename}, reference={reference.filename}, genre={genre}")
-        file_id = str(uuid.uuid4())
-        upload_path = os.path.join(UPLOAD_DIR, f"{file_id}_input.wav")
-        
-        with open(upload_path, "wb") as buffer:
-            content = await target.read()
-            buffer.write(content)
-        
-        output_dir = os.path.join(PROCESSED_FILES_DIR, "free")
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, f"mastered_{file_id}.wav")
-        
-        process_audio_file(upload_path, output_path, tier="free", genre=genre)
-        os.remove(upload_path)
-        
-        mastered_rel = f"/files/free/mastered_{file_id}.wav"
-        mastered_abs = f"https://crysgarage.studio{mastered_rel}"
-        file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
-        
-        return {
-            "file_id": file_id,
-            "status": "completed",
-            "processed_file": mastered_rel,
-            "mastered_url": mastered_abs,
-            "masteredUrl": mastered_abs,
-            "processedUrl": mastered_abs,
-            "processed_audio_url": mastered_abs,  # For frontend download compatibility
-            "file_url": mastered_abs,  # Additional alias for frontend compatibility
-            "size": file_size,
-            "tier": "free",
-            "genre": genre,
+        logger.info(f"Matchering ({tier}): target={target.filename}, reference={reference.filename}, genre={genre}")
+        _admit(tier)
+        from matching import PROFILE_VERSION
+
+        max_file_size = TIER_CONFIGS[tier]["max_file_size"]
+        reference_stats = await save_upload(
+            reference, os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}_reference"), max_file_size
+        )
+        profile = result_cache.get_profile(reference_stats["sha256"], PROFILE_VERSION)
+        if profile is not None:
+            logger.info(f"Reference profile cache hit for {reference.filename}")
+            os.remove(reference_stats["path"])
+        reference_info = {
+            "sha256": reference_stats["sha256"],
+            "path": None if profile is not None else reference_stats["path"],
+            "profile": profile,
         }
+
+        file_id = str(uuid.uuid4())
+        try:
+            upload_stats = await save_upload(target, os.path.join(UPLOAD_DIR, f"{file_id}_input"), max_file_size)
+        except BaseException:
+            if reference_info["path"] is not None and os.path.exists(reference_info["path"]):
+                os.remove(reference_info["path"])
+            raise
+
+        job_id = await _queue_saved_upload(file_id, upload_stats, target.filename, tier, genre, export,
+                                     reference=reference_info)
+        return await job_manager.wait(job_id)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Matchering error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _find_mastered_file(tier: str, file_id: str) -> Optional[str]:
+    """Locate a finished master, preferring lossless copies as the export source"""
+    output_dir = os.path.join(PROCESSED_FILES_DIR, tier)
+    for extension in ("wav", "flac", "ogg", "mp3", "aac"):
+        path = os.path.join(output_dir, f"mastered_{file_id}.{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def run_export_job(input_path: str, tier: str, file_id: str, formats: list, export: dict) -> dict:
+    """
+    Worker-process entry point: fan one mastered file out to several formats
+    """
+    output_dir = os.path.join(PROCESSED_FILES_DIR, tier)
+    output_paths = {
+        fmt: os.path.join(output_dir, f"mastered_{file_id}_{export['sample_rate']}.{FILE_EXTENSIONS[fmt]}")
+        for fmt in formats
+    }
+    report = audio_converter.export_formats(
+        input_path, output_paths, export["sample_rate"],
+        mp3_bitrate_kbps=export["mp3_bitrate_kbps"], wav_bit_depth=export["wav_bit_depth"],
+    )
+
+    files = []
+    for output in report["outputs"]:
+        file_rel = f"/files/{tier}/{os.path.basename(output['path'])}"
+        files.append({
+            "format": output["format"],
+            "url": f"https://crysgarage.studio{file_rel}",
+            "processed_file": file_rel,
+            "size": output["size"],
+            "encode_seconds": round(output["encode_seconds"], 3),
+        })
+
+    return {
+        "file_id": file_id,
+        "status": "completed",
+        "tier": tier,
+        "sample_rate": export["sample_rate"],
+        "decode_seconds": round(report["decode_seconds"], 3),
+        "files": files,
+    }
+
+
+@app.post("/export")
+async def export_master(
+    file_id: str = Form(...),
+    tier: str = Form("professional"),
+    formats: str = Form("MP3,WAV"),
+    target_sample_rate: str = Form("44100"),
+    mp3_bitrate_kbps: Optional[str] = Form(None),
+    wav_bit_depth: Optional[str] = Form(None),
+):
+    """Encode an existing master to several formats from a single decode"""
+    if tier not in TIER_CONFIGS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier: {tier}")
+    try:
+        uuid.UUID(file_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid file id: {file_id}")
+
+    requested = [fmt.strip().upper() for fmt in formats.split(",") if fmt.strip()]
+    if not requested:
+        raise HTTPException(status_code=400, detail="No formats requested")
+    settings = [
+        _parse_export_settings(fmt, target_sample_rate, mp3_bitrate_kbps, wav_bit_depth) for fmt in requested
+    ]
+    export = settings[0]
+    requested = sorted({item["format"] for item in settings}, key=requested.index)
+
+    input_path = _find_mastered_file(tier, file_id)
+    if input_path is None:
+        raise HTTPException(status_code=404, detail=f"No mastered file for {file_id}")
+
+    try:
+        logger.info(f"Export fan-out: file_id={file_id}, tier={tier}, formats={requested}")
+        _admit(tier)
+        job_id = await scheduler.submit(tier, run_export_job, input_path, tier, file_id, requested, export)
+        result = await job_manager.wait(job_id)
+        for item in result["files"]:
+            retention.track(os.path.join(PROCESSED_FILES_DIR, tier, os.path.basename(item["processed_file"])))
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Export error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.api_route("/files/{tier}/{filename}", methods=["GET", "HEAD"])
+async def serve_processed_file(tier: str, filename: str, request: Request):
+    """Serve a file under the URLs that mastering responses hand out"""
+    if tier not in TIER_CONFIGS or os.path.basename(filename) != filename or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="File not found")
+    path = os.path.join(PROCESSED_FILES_DIR, tier, filename)
+    response = file_response(request, path, PROCESSED_FILES_DIR)
+    retention.touch(path)
+    return response
+
+
+@app.api_route("/download/{file_id}", methods=["GET", "HEAD"])
+async def download_file(file_id: str, request: Request, tier: Optional[str] = None,
+                        format: Optional[str] = None):
+    """
+    Download a finished master by id
+
+    Without tier every tier is searched; format picks one copy (e.g. MP3) when
+    several exist. Supports Range requests and conditional GETs.
+    """
+    try:
+        file_id = str(uuid.UUID(file_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"No mastered file for {file_id}")
+    if tier is not None and tier not in TIER_CONFIGS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier: {tier}")
+    if format is not None and format.upper() not in FILE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+
+    for candidate_tier in [tier] if tier else list(TIER_CONFIGS):
+        if format is not None:
+            path = os.path.join(PROCESSED_FILES_DIR, candidate_tier,
+                                f"mastered_{file_id}.{FILE_EXTENSIONS[format.upper()]}")
+            path = path if os.path.exists(path) else None
+        else:
+            path = _find_mastered_file(candidate_tier, file_id)
+        if path is not None:
+            response = file_response(request, path, PROCESSED_FILES_DIR, attachment=True)
+            retention.touch(path)
+            return response
+
+    raise HTTPException(status_code=404, detail=f"No mastered file for {file_id}")
+
+
+@app.api_route("/peaks/{file_id}", methods=["GET", "HEAD"])
+async def serve_peaks(file_id: str, request: Request):
+    """
+    Waveform peak pyramid of a finished master (format in peaks.py)
+
+    A file_id's peaks never change, so they are cacheable for good; clients
+    can Range-request a single zoom level using the level table.
+    """
+    try:
+        file_id = str(uuid.UUID(file_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"No peaks for {file_id}")
+    for tier in TIER_CONFIGS:
+        path = _peaks_path(tier, file_id)
+        if os.path.exists(path):
+            response = file_response(request, path, PROCESSED_FILES_DIR, cache_control=PEAKS_CACHE_CONTROL)
+            retention.touch(path)
+            return response
+    raise HTTPException(status_code=404, detail=f"No peaks for {file_id}")
+
+
+def run_analysis_job(upload_path: str, content_hash: Optional[str] = None) -> dict:
+    """
+    Worker-process entry point: analyze an upload through its decoded intermediate
+    """
+    from analysis import analyze_file
+
+    return analyze_file(_decoded_source(upload_path, content_hash))
+
+
 @app.post("/analyze-upload")
 async def analyze_upload(audio: UploadFile = File(...), user_id: str = Form("upload-user")):
     """
@@ -380,96 +1314,48 @@ async def analyze_upload(audio: UploadFile = File(...), user_id: str = Form("upl
         if not AUDIO_PROCESSING_AVAILABLE:
             raise HTTPException(status_code=500, detail="Audio processing libraries not available")
         
-        import time
-        import numpy as np
-        
         logger.info(f"📊 Analyzing upload for user: {user_id}, file: {audio.filename}")
+        _admit(ANALYSIS_TIER)
         
         # Save temporary file
         timestamp = int(time.time() * 1000)
         temp_path = os.path.join(UPLOAD_DIR, f"analyze_upload_{user_id}_{timestamp}_{audio.filename}")
         
-        with open(temp_path, "wb") as buffer:
-            content = await audio.read()
-            buffer.write(content)
-        
-        # Load audio (stereo preserved)
-        y, sr = librosa.load(temp_path, sr=None, mono=False)
-        if y.ndim == 1:
-            y_stereo = np.vstack([y, y])
-        else:
-            y_stereo = y
-        y_mono = np.mean(y_stereo, axis=0)
-        
-        # LUFS measurement
-        meter = pyln.Meter(sr)
-        loudness = float(meter.integrated_loudness(y_mono))
-        
-        # RMS / Peak / Crest
-        rms = float(np.sqrt(np.mean(y_mono ** 2)) + 1e-12)
-        peak = float(np.max(np.abs(y_mono)) + 1e-12)
-        rms_db = 20 * np.log10(rms)
-        peak_db = 20 * np.log10(peak)
-        crest_factor = float(peak_db - rms_db)
-        
-        # Spectral bands (octave-like bands)
-        bands = [(20, 40), (40, 80), (80, 160), (160, 320), (320, 640), 
-                 (640, 1280), (1280, 2560), (2560, 5120), (5120, 10240), (10240, 20000)]
-        S = np.abs(librosa.stft(y_mono, n_fft=4096, hop_length=1024)) ** 2
-        freqs = librosa.fft_frequencies(sr=sr, n_fft=4096)
-        
-        spectral_bands = []
-        for low, high in bands:
-            idx = np.where((freqs >= low) & (freqs < high))[0]
-            band_power = float(np.mean(S[idx, :]) if idx.size > 0 else 0.0)
-            band_db = 10 * np.log10(band_power + 1e-12)
-            spectral_bands.append({"low": low, "high": high, "power_db": band_db})
-        
-        # Stereo width (M/S energy ratio by band)
-        L, R = y_stereo[0], y_stereo[1]
-        M = 0.5 * (L + R)
-        S_ms = 0.5 * (L - R)
-        Sm = np.abs(librosa.stft(M, n_fft=2048, hop_length=512)) ** 2
-        Ss = np.abs(librosa.stft(S_ms, n_fft=2048, hop_length=512)) ** 2
-        f2 = librosa.fft_frequencies(sr=sr, n_fft=2048)
-        
-        stereo_width_bands = []
-        for low, high in bands:
-            idx = np.where((f2 >= low) & (f2 < high))[0]
-            m_e = float(np.mean(Sm[idx, :]) if idx.size > 0 else 0.0)
-            s_e = float(np.mean(Ss[idx, :]) if idx.size > 0 else 0.0)
-            width = float(s_e / (m_e + 1e-12))
-            stereo_width_bands.append({"low": low, "high": high, "width": width})
-        
-        # Duration
-        duration = float(len(y_mono) / sr)
+        upload_stats = await save_upload(audio, temp_path, TIER_CONFIGS[ANALYSIS_TIER]["max_file_size"])
+        temp_path = upload_stats["path"]
         
-        # Cleanup temp file
+        # Decode (once, into the decoded store) and analyze off the event loop
+        content_hash = upload_stats["sha256"]
+        decoded_store.acquire(content_hash)
         try:
+            job_id = await scheduler.submit(ANALYSIS_TIER, run_analysis_job, temp_path, content_hash)
+            metrics = await job_manager.wait(job_id)
+        finally:
+            decoded_store.release(content_hash)
             if os.path.exists(temp_path):
                 os.remove(temp_path)
-        except Exception:
-            pass
         
         result = {
             "status": "success",
             "metadata": {
-                "lufs": loudness,
-                "duration": duration,
-                "sample_rate": sr,
-                "file_size": len(content)
+                "lufs": metrics["lufs"],
+                "duration": metrics["duration"],
+                "sample_rate": metrics["sample_rate"],
+                "file_size": upload_stats["bytes"]
             },
-            "rms_db": rms_db,
-            "peak_db": peak_db,
-            "crest_factor": crest_factor,
-            "spectral_bands": spectral_bands,
-            "stereo_width_bands": stereo_width_bands
+            "rms_db": metrics["rms_db"],
+            "peak_db": metrics["peak_db"],
+            "crest_factor": metrics["crest_factor"],
+            "spectral_bands": metrics["spectral_bands"],
+            "stereo_width_bands": metrics["stereo_width_bands"]
         }
         
-        logger.info(f"✅ Analysis complete: LUFS={loudness:.1f}, Peak={peak_db:.1f}dB, Duration={duration:.1f}s")
+        logger.info(f"✅ Analysis complete: LUFS={metrics['lufs']:.1f}, Peak={metrics['peak_db']:.1f}dB, Duration={metrics['duration']:.1f}s")
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"/analyze-upload failed: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -487,4 +1373,10 @@ async def track_visitor(data: dict):
 
 if __name__ == "__main__":
     import uvicorn
+    # Upload sessions, decoded-store pins, the retention sweeper and result-cache
+    # single-flight all live in this process, so a second API process on the same
+    # directories would corrupt resumes and delete inputs in use. Scale with
+    # job_queue.py workers instead.
+    if int(os.environ.get("API_WORKERS", 1)) > 1:
+        raise SystemExit("API_WORKERS > 1 is not supported; run one API process and add job_queue.py workers")
     uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
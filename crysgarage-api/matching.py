@@ -0,0 +1,159 @@
+"""
+Reference matching for CrysGarage
+Matches a target's loudness, octave-band balance and per-band stereo width to a
+reference track, measured with the same bands and STFT grid as /analyze-upload
+"""
+
+import logging
+
+import numpy as np
+import pyloudnorm as pyln
+
+from analysis import ANALYSIS_BANDS, analyze_audio
+from audio_decoder import read_audio
+from mastering_chain import write_mastered
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Bump when the profile contents or their meaning change; older cached profiles are ignored
+PROFILE_VERSION = 3
+
+MAX_EQ_DB = 12.0
+SIDE_GAIN_RANGE = (0.5, 2.0)
+# Bands this far below the loudest one carry no usable balance information
+SILENT_BAND_DB = 80.0
+# Linear-phase FIR length (about 10 Hz resolution); taps are kept odd so
+# mode="same" convolution is delay free
+FIR_SECONDS = 0.1
+
+
+def _channels_first(data: np.ndarray) -> np.ndarray:
+    """(frames, channels) decoder output -> the layout analyze_audio expects"""
+    return data[:, 0] if data.shape[1] == 1 else data[:, :2].T
+
+
+def _integrated_lufs(data: np.ndarray, sr: int) -> float:
+    """BS.1770 integrated loudness over every channel of (frames, channels) audio"""
+    return pyln.Meter(sr).integrated_loudness(data)
+
+
+def profile_from_metrics(metrics: dict, sample_rate: int, lufs: float) -> dict:
+    """
+    Compact reference profile: LUFS, band energies and M/S ratios
+
+    lufs is the track's integrated loudness over all channels, the same
+    measure match_file gain-matches against; the analysis engine's own
+    figure is Mid-only and reads lower on wide material.
+    """
+    return {
+        "version": PROFILE_VERSION,
+        "sample_rate": sample_rate,
+        "lufs": lufs if np.isfinite(lufs) else None,
+        "bands_db": [round(band["power_db"], 3) for band in metrics["spectral_bands"]],
+        "widths": [round(band["width"], 5) for band in metrics["stereo_width_bands"]],
+    }
+
+
+def reference_profile(path: str) -> dict:
+    """Decode and analyze a reference track into its profile"""
+    data, sr = read_audio(path)
+    metrics = analyze_audio(_channels_first(data), sr)
+    return profile_from_metrics(metrics, sr, _integrated_lufs(data, sr))
+
+
+def _band_eq_db(target_db, reference_db) -> np.ndarray:
+    """Per-band gain that gives the target the reference's spectral shape (not level)"""
+    target_db = np.asarray(target_db, dtype=np.float64)
+    reference_db = np.asarray(reference_db, dtype=np.float64)
+    usable = ((target_db > target_db.max() - SILENT_BAND_DB)
+              & (reference_db > reference_db.max() - SILENT_BAND_DB))
+    gains = np.zeros_like(target_db)
+    if usable.sum() < 2:
+        return gains
+    # Compare shapes only; overall loudness is matched afterwards
+    offset = (reference_db[usable] - target_db[usable]).mean()
+    gains[usable] = np.clip(reference_db[usable] - target_db[usable] - offset, -MAX_EQ_DB, MAX_EQ_DB)
+    return gains
+
+
+def _side_gains(target_widths, reference_widths) -> np.ndarray:
+    """Per-band Side gain that moves the target's S/M power ratio to the reference's"""
+    target_widths = np.asarray(target_widths, dtype=np.float64)
+    reference_widths = np.asarray(reference_widths, dtype=np.float64)
+    gains = np.ones_like(target_widths)
+    stereo = target_widths > 1e-6
+    gains[stereo] = np.sqrt(reference_widths[stereo] / target_widths[stereo])
+    return np.clip(gains, *SIDE_GAIN_RANGE)
+
+
+def _band_fir(band_gains: np.ndarray, sr: int) -> np.ndarray:
+    """Linear-phase FIR following band_gains (linear) between octave-band centres"""
+    import scipy.signal
+
+    centres = np.array([np.sqrt(low * high) for low, high in ANALYSIS_BANDS])
+    freqs = np.linspace(0.0, sr / 2.0, 1025)
+    # Interpolate on a log-frequency axis, flat outside the outermost centres
+    log_freqs = np.log2(np.clip(freqs, centres[0], centres[-1]))
+    response = np.interp(log_freqs, np.log2(centres), np.log(band_gains))
+    taps = int(sr * FIR_SECONDS) | 1
+    return scipy.signal.firwin2(taps, freqs, np.exp(response), fs=sr).astype(np.float32)
+
+
+def match_file(input_path: str, output_path: str, profile: dict, timings: dict = None,
+               peaks_path: str = None) -> dict:
+    """
+    Master input_path towards a reference profile
+
+    The target is analyzed once; Mid gets the band EQ, Side gets the band EQ
+    times the per-band width correction, and the result is gain-matched to the
+    reference's integrated loudness. With peaks_path the output's waveform
+    peak pyramid is written there too.
+
+    Returns:
+        dict: input_lufs, output_lufs, eq_db and side_gain per band, audio_seconds
+    """
+    import scipy.signal
+
+    with stage_timer(timings, "decode"):
+        data, sr = read_audio(input_path)
+
+    with stage_timer(timings, "analysis"):
+        metrics = analyze_audio(_channels_first(data), sr)
+    with stage_timer(timings, "loudness_measure"):
+        target = profile_from_metrics(metrics, sr, _integrated_lufs(data, sr))
+
+    eq_db = _band_eq_db(target["bands_db"], profile["bands_db"])
+    eq_gains = 10.0 ** (eq_db / 20.0)
+    stereo = data.shape[1] >= 2
+    side_gains = _side_gains(target["widths"], profile["widths"]) if stereo else np.ones(len(ANALYSIS_BANDS))
+
+    with stage_timer(timings, "eq"):
+        mid_fir = _band_fir(eq_gains, sr)
+        if stereo:
+            side_fir = _band_fir(eq_gains * side_gains, sr)
+            mid = 0.5 * (data[:, 0] + data[:, 1])
+            side = 0.5 * (data[:, 0] - data[:, 1])
+            mid = scipy.signal.oaconvolve(mid, mid_fir, mode="same")
+            side = scipy.signal.oaconvolve(side, side_fir, mode="same")
+            matched = np.stack([mid + side, mid - side], axis=1).astype(np.float32)
+        else:
+            matched = scipy.signal.oaconvolve(data, mid_fir[:, np.newaxis], mode="same", axes=0).astype(np.float32)
+
+    with stage_timer(timings, "loudness_measure"):
+        matched_lufs = _integrated_lufs(matched, sr)
+
+    gain_db = 0.0
+    if profile.get("lufs") is not None and np.isfinite(matched_lufs):
+        gain_db = profile["lufs"] - matched_lufs
+    write_mastered([matched], output_path, sr, matched.shape[1], gain_db, timings, peaks_path=peaks_path)
+
+    logger.info(f"Matched {input_path} to reference: {target['lufs']} -> {profile.get('lufs')} LUFS, "
+                f"EQ {np.round(eq_db, 1).tolist()} dB, side {np.round(side_gains, 2).tolist()}")
+    return {
+        "input_lufs": target["lufs"],
+        "output_lufs": profile.get("lufs"),
+        "eq_db": [round(float(value), 2) for value in eq_db],
+        "side_gain": [round(float(value), 3) for value in side_gains],
+        "audio_seconds": data.shape[0] / sr,
+    }
@@ -0,0 +1,160 @@
+"""
+Waveform peak pyramids for CrysGarage
+Min/max/RMS overviews of a master at several zoom levels, built from the blocks
+the mastering chain writes, so drawing a waveform needs kilobytes instead of
+the whole file and no extra pass over the audio
+
+File layout (little-endian):
+    header   "CGPK", version u16, channels u16, sample_rate u32, frames u64,
+             levels u16, reserved u16
+    levels   per level: frames_per_bin u32, bins u32, byte offset of its data u64
+    data     per level: int8 (bins, channels, 3) holding min, max and RMS
+             scaled by 127, finest level first
+A client can Range-request just the level it draws using the level table.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+PEAKS_MAGIC = b"CGPK"
+PEAKS_VERSION = 1
+PEAKS_SUFFIX = ".peaks"
+HEADER = struct.Struct("<4sHHIQHH")
+LEVEL = struct.Struct("<IIQ")
+
+BASE_FRAMES_PER_BIN = 512
+LEVEL_FACTOR = 4
+LEVEL_COUNT = 5
+
+
+class PeakPyramid:
+    """
+    Accumulates the finest level block by block; coarser levels are reduced
+    from it in finish(), so add() is the only per-sample work
+    """
+
+    def __init__(self, sample_rate: int, channels: int, base_frames_per_bin: int = BASE_FRAMES_PER_BIN,
+                 levels: int = LEVEL_COUNT):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.base = base_frames_per_bin
+        self.levels = levels
+        self.frames = 0
+        # Frames of the bin still being filled
+        self._carry = np.empty((base_frames_per_bin, channels), dtype=np.float32)
+        self._carry_len = 0
+        self._mins, self._maxs, self._squares = [], [], []
+
+    def _add_bins(self, data: np.ndarray):
+        # Reducing along a contiguous axis is an order of magnitude faster than
+        # a strided one, so pay for one channel-first copy
+        bins = np.ascontiguousarray(data.T).reshape(self.channels, -1, self.base)
+        self._mins.append(bins.min(axis=2).T)
+        self._maxs.append(bins.max(axis=2).T)
+        self._squares.append(np.einsum("cij,cij->ci", bins, bins).T.astype(np.float64))
+
+    def add(self, block: np.ndarray):
+        """Account for one (frames, channels) float32 block of output"""
+        self.frames += len(block)
+        if self._carry_len:
+            take = min(self.base - self._carry_len, len(block))
+            self._carry[self._carry_len:self._carry_len + take] = block[:take]
+            self._carry_len += take
+            block = block[take:]
+            if self._carry_len < self.base:
+                return
+            self._add_bins(self._carry)
+            self._carry_len = 0
+
+        whole = len(block) - len(block) % self.base
+        if whole:
+            self._add_bins(block[:whole])
+        tail = len(block) - whole
+        if tail:
+            self._carry[:tail] = block[whole:]
+            self._carry_len = tail
+
+    def finish(self) -> list:
+        """
+        Close the last partial bin and reduce every level
+
+        Returns:
+            list: (frames_per_bin, int8 array of shape (bins, channels, 3)) per level
+        """
+        mins, maxs, squares = list(self._mins), list(self._maxs), list(self._squares)
+        counts = np.full(sum(len(part) for part in mins), self.base, dtype=np.float64)
+        if self._carry_len:
+            partial = self._carry[:self._carry_len]
+            mins.append(partial.min(axis=0, keepdims=True))
+            maxs.append(partial.max(axis=0, keepdims=True))
+            squares.append(np.square(partial, dtype=np.float64).sum(axis=0, keepdims=True))
+            counts = np.append(counts, self._carry_len)
+
+        empty = np.zeros((0, self.channels))
+        mins = np.concatenate(mins) if mins else empty
+        maxs = np.concatenate(maxs) if maxs else empty
+        squares = np.concatenate(squares) if squares else empty
+
+        levels = []
+        frames_per_bin = self.base
+        for level in range(self.levels):
+            if level:
+                # Pad to whole groups with neutral values, then reduce LEVEL_FACTOR bins into one
+                pad = -len(mins) % LEVEL_FACTOR
+                mins = np.concatenate([mins, np.full((pad, self.channels), np.inf)]) if pad else mins
+                maxs = np.concatenate([maxs, np.full((pad, self.channels), -np.inf)]) if pad else maxs
+                squares = np.concatenate([squares, np.zeros((pad, self.channels))]) if pad else squares
+                counts = np.concatenate([counts, np.zeros(pad)]) if pad else counts
+                mins = mins.reshape(-1, LEVEL_FACTOR, self.channels).min(axis=1)
+                maxs = maxs.reshape(-1, LEVEL_FACTOR, self.channels).max(axis=1)
+                squares = squares.reshape(-1, LEVEL_FACTOR, self.channels).sum(axis=1)
+                counts = counts.reshape(-1, LEVEL_FACTOR).sum(axis=1)
+                frames_per_bin *= LEVEL_FACTOR
+
+            rms = np.sqrt(squares / np.maximum(counts, 1.0)[:, np.newaxis])
+            stacked = np.stack([mins, maxs, rms], axis=2)
+            levels.append((frames_per_bin, np.clip(np.round(stacked * 127.0), -127, 127).astype(np.int8)))
+        return levels
+
+    def write(self, path: str):
+        """Finish and write the pyramid to path atomically"""
+        levels = self.finish()
+        offset = HEADER.size + LEVEL.size * len(levels)
+        table = []
+        for frames_per_bin, data in levels:
+            table.append(LEVEL.pack(frames_per_bin, len(data), offset))
+            offset += data.nbytes
+
+        # Dot-prefixed like other in-progress outputs, so retention skips it until it is replaced
+        directory, name = os.path.split(path)
+        tmp_path = os.path.join(directory, f".encoding_{name}.{os.getpid()}")
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(PEAKS_MAGIC, PEAKS_VERSION, self.channels, self.sample_rate, self.frames,
+                                len(levels), 0))
+            f.write(b"".join(table))
+            for _, data in levels:
+                f.write(data.tobytes())
+        os.replace(tmp_path, path)
+
+
+def read_peaks(path: str) -> dict:
+    """
+    Parse a peaks file
+
+    Returns:
+        dict: sample_rate, channels, frames and levels, a list of
+              (frames_per_bin, int8 array of shape (bins, channels, 3))
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    magic, version, channels, sample_rate, frames, count, _ = HEADER.unpack_from(raw, 0)
+    if magic != PEAKS_MAGIC or version != PEAKS_VERSION:
+        raise ValueError(f"Not a version {PEAKS_VERSION} peaks file: {path}")
+    levels = []
+    for i in range(count):
+        frames_per_bin, bins, offset = LEVEL.unpack_from(raw, HEADER.size + i * LEVEL.size)
+        data = np.frombuffer(raw, dtype=np.int8, count=bins * channels * 3, offset=offset)
+        levels.append((frames_per_bin, data.reshape(bins, channels, 3)))
+    return {"sample_rate": sample_rate, "channels": channels, "frames": frames, "levels": levels}
@@ -0,0 +1,89 @@
+"""
+Fast preview rendering for CrysGarage
+Seeks straight to a representative excerpt and masters only that segment
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from audio_decoder import probe, read_audio
+from genre_presets import GenreProcessor, preset_name
+from loudness import StreamingLoudnessMeter
+from mastering_chain import write_mastered
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_SECONDS = float(os.environ.get("PREVIEW_SECONDS", 30))
+# Where the excerpt starts, as a fraction of the track (skips intros)
+PREVIEW_OFFSET_RATIO = float(os.environ.get("PREVIEW_OFFSET_RATIO", 0.3))
+PREVIEW_FADE_SECONDS = 0.01
+
+
+def _read_excerpt(input_path: str, seconds: float, offset_ratio: float):
+    """Read seconds of audio starting offset_ratio into the file without decoding the rest"""
+    info = probe(input_path)
+    sr = info["sample_rate"]
+    length = min(info["frames"], int(seconds * sr))
+    start = max(0, min(int(info["frames"] * offset_ratio), info["frames"] - length))
+    data, sr = read_audio(input_path, start_frame=start, frames=length, info=info)
+    return data, sr, start
+
+
+def render_preview(input_path: str, output_path: str, target_lufs: float, loudness: float = None,
+                   apply_gain: bool = True, genre: str = None, seconds: float = PREVIEW_SECONDS,
+                   offset_ratio: float = PREVIEW_OFFSET_RATIO) -> dict:
+    """
+    Master a short excerpt of input_path into output_path
+
+    Args:
+        target_lufs: Tier loudness target
+        loudness: Whole-track loudness if already known; the excerpt then gets
+                  exactly the gain the full master will use
+        apply_gain: False for presets that leave the audio untouched
+        genre: Genre form value; its preset, if any, is applied to the excerpt
+
+    Returns:
+        dict: start_seconds, duration_seconds, excerpt_loudness, gain_db
+    """
+    data, sr, start = _read_excerpt(input_path, seconds, offset_ratio)
+
+    meter = StreamingLoudnessMeter(sr, data.shape[1], data.shape[0])
+    meter.process(data)
+    excerpt_loudness = meter.integrated_loudness()
+    reference = loudness if loudness is not None else excerpt_loudness
+
+    # The full master measures the genre stage's output; the excerpt estimates
+    # it as the whole-track loudness plus the change the stage made here
+    genre_offset = 0.0
+    preset = preset_name(genre)
+    if apply_gain and preset is not None:
+        GenreProcessor(preset, sr, data.shape[1], reference).process(data)
+        meter = StreamingLoudnessMeter(sr, data.shape[1], data.shape[0])
+        meter.process(data)
+        processed_loudness = meter.integrated_loudness()
+        if np.isfinite(processed_loudness) and np.isfinite(excerpt_loudness):
+            genre_offset = processed_loudness - excerpt_loudness
+
+    gain_db = 0.0
+    if apply_gain and np.isfinite(reference):
+        gain_db = target_lufs - reference - genre_offset
+
+    # Short fades so the excerpt edges do not click
+    fade = min(int(PREVIEW_FADE_SECONDS * sr), data.shape[0] // 2)
+    if fade > 0:
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, np.newaxis]
+        data[:fade] *= ramp
+        data[-fade:] *= ramp[::-1]
+
+    # Same chain as the full master, so the excerpt is limited the same way
+    write_mastered([data], output_path, sr, data.shape[1], gain_db)
+    logger.info(f"Preview rendered: {output_path} ({data.shape[0] / sr:.1f}s from {start / sr:.1f}s, gain {gain_db:+.2f} dB)")
+
+    return {
+        "start_seconds": start / sr,
+        "duration_seconds": data.shape[0] / sr,
+        "excerpt_loudness": excerpt_loudness if np.isfinite(excerpt_loudness) else None,
+        "gain_db": gain_db,
+    }
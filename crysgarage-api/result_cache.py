@@ -0,0 +1,148 @@
+"""
+Content-addressed result cache for CrysGarage
+Maps (upload hash, processing parameters) to an already mastered file
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the mastering pipeline changes its output for the same inputs
+PIPELINE_VERSION = 1
+
+
+class ResultCache:
+    """Remember finished masters and coalesce identical in-flight renders"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._entries = {}
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(content_hash: str, tier: str, genre: str, target_lufs, target_format: str, sample_rate,
+                 extra=None) -> str:
+        """Build a cache key from the upload digest and every parameter that changes the output"""
+        params = json.dumps(
+            [PIPELINE_VERSION, content_hash, tier, genre, target_lufs, target_format.upper(), str(sample_rate), extra],
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(params.encode("utf-8")).hexdigest()
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> dict:
+        """Return the cached response for key, or None if missing or its file is gone"""
+        entry = self._entries.get(key)
+        if entry is None:
+            index_path = self._index_path(key)
+            if os.path.exists(index_path):
+                try:
+                    with open(index_path, "r") as f:
+                        entry = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Ignoring unreadable cache entry {index_path}: {e}")
+                    entry = None
+
+        if entry is None or not os.path.exists(entry["output_path"]):
+            if entry is not None:
+                self.invalidate(key)
+            self.misses += 1
+            return None
+
+        self._entries[key] = entry
+        self.hits += 1
+        return dict(entry["result"], cached=True)
+
+    def output_path(self, key: str):
+        """File behind a key that get() has loaded, or None"""
+        entry = self._entries.get(key)
+        return entry["output_path"] if entry is not None else None
+
+    def put(self, key: str, output_path: str, result: dict):
+        entry = {"output_path": output_path, "result": result}
+        self._entries[key] = entry
+        tmp_path = self._index_path(key) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._index_path(key))
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+        if os.path.exists(self._index_path(key)):
+            os.remove(self._index_path(key))
+
+    def _loudness_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"loudness_{content_hash}.json")
+
+    def get_loudness(self, content_hash: str):
+        """Whole-track integrated loudness measured earlier for this upload digest, or None"""
+        path = self._loudness_path(content_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)["integrated_lufs"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable loudness entry {path}: {e}")
+            return None
+
+    def put_loudness(self, content_hash: str, integrated_lufs: float):
+        tmp_path = self._loudness_path(content_hash) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"integrated_lufs": integrated_lufs}, f)
+        os.replace(tmp_path, self._loudness_path(content_hash))
+
+    def _profile_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"profile_{content_hash}.json")
+
+    def get_profile(self, content_hash: str, version: int):
+        """Reference profile computed earlier for this upload digest, or None if missing or outdated"""
+        path = self._profile_path(content_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                profile = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable profile entry {path}: {e}")
+            return None
+        return profile if profile.get("version") == version else None
+
+    def put_profile(self, content_hash: str, profile: dict):
+        tmp_path = self._profile_path(content_hash) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(profile, f, separators=(",", ":"))
+        os.replace(tmp_path, self._profile_path(content_hash))
+
+    def inflight(self, key: str):
+        """Return the job id already rendering this key, if any"""
+        job_id = self._inflight.get(key)
+        if job_id is not None:
+            self.coalesced += 1
+        return job_id
+
+    def mark_inflight(self, key: str, job_id: str):
+        self._inflight[key] = job_id
+
+    def clear_inflight(self, key: str):
+        self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+        }
@@ -0,0 +1,236 @@
+"""
+Disk retention for CrysGarage
+Keeps each tier's processed directory under a byte quota by evicting the least
+recently accessed files, and removes uploads orphaned by failed requests
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BYTES = REGISTRY.gauge("crysgarage_storage_bytes", "Bytes held per tier directory", ["tier"])
+STORAGE_FILES = REGISTRY.gauge("crysgarage_storage_files", "Files held per tier directory", ["tier"])
+EVICTIONS = REGISTRY.counter(
+    "crysgarage_retention_evictions_total", "Files removed by retention", ["tier", "reason"]
+)
+EVICTED_BYTES = REGISTRY.counter(
+    "crysgarage_retention_evicted_bytes_total", "Bytes removed by retention", ["tier", "reason"]
+)
+SWEEP_SECONDS = REGISTRY.histogram(
+    "crysgarage_retention_sweep_seconds", "Wall time of one retention sweep",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+
+# Evict down to this share of the quota so a busy tier does not evict on every write
+LOW_WATER_RATIO = 0.9
+UPLOAD_TIER = "uploads"
+
+
+class RetentionManager:
+    """
+    LRU retention over the processed tier directories plus a TTL on uploads
+
+    The index (path -> size, last access) is built by one scan at startup and
+    then kept current by track() and touch(); sweeps only walk the index. A full
+    rescan still runs every rescan_interval to pick up files written elsewhere.
+    Last access is tracked in memory because production disks are mounted noatime.
+    """
+
+    def __init__(self, processed_dir: str, upload_dir: str, quotas: dict, upload_ttl: float = 6 * 3600,
+                 min_age: float = 300.0, min_free_ratio: float = 0.1, rescan_interval: float = 3600.0):
+        self.processed_dir = processed_dir
+        self.upload_dir = upload_dir
+        self.quotas = dict(quotas)
+        self.upload_ttl = upload_ttl
+        self.min_age = min_age
+        self.min_free_ratio = min_free_ratio
+        self.rescan_interval = rescan_interval
+
+        self._root = os.path.abspath(processed_dir)
+        self._lock = threading.Lock()
+        # tier -> OrderedDict(path -> [size, last_access]), least recently used first
+        self._index = {tier: OrderedDict() for tier in self.quotas}
+        self._bytes = {tier: 0 for tier in self.quotas}
+        self._last_scan = 0.0
+
+    def _tier_of(self, path: str):
+        parent = os.path.dirname(os.path.abspath(path))
+        tier = os.path.basename(parent)
+        if tier in self._index and os.path.dirname(parent) == self._root:
+            return tier
+        return None
+
+    def _insert(self, tier: str, path: str, size: int, last_access: float):
+        entries = self._index[tier]
+        previous = entries.pop(path, None)
+        if previous is not None:
+            self._bytes[tier] -= previous[0]
+        entries[path] = [size, last_access]
+        self._bytes[tier] += size
+
+    def scan(self):
+        """Rebuild the index from disk, seeding last access from atime/mtime"""
+        index = {tier: [] for tier in self.quotas}
+        for tier in self.quotas:
+            tier_dir = os.path.join(self.processed_dir, tier)
+            if not os.path.isdir(tier_dir):
+                continue
+            with os.scandir(tier_dir) as entries:
+                for entry in entries:
+                    # In-progress encodes (.encoding_*) are handled by the TTL sweep
+                    if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    index[tier].append((max(st.st_atime, st.st_mtime), entry.path, st.st_size))
+
+        with self._lock:
+            for tier, files in index.items():
+                known = self._index[tier]
+                # Keep in-memory access times, they are newer than a noatime disk's
+                files = sorted(
+                    (max(last_access, known[path][1]) if path in known else last_access, path, size)
+                    for last_access, path, size in files
+                )
+                self._index[tier] = OrderedDict((path, [size, last_access]) for last_access, path, size in files)
+                self._bytes[tier] = sum(size for _, _, size in files)
+            self._last_scan = time.time()
+        self._publish()
+
+    def track(self, path: str):
+        """Register a freshly written file as most recently used"""
+        tier = self._tier_of(path)
+        if tier is None:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            self._insert(tier, path, size, time.time())
+
+    def touch(self, path: str):
+        """Mark a file as just accessed (download, cache hit)"""
+        tier = self._tier_of(path) if path else None
+        if tier is None:
+            return
+        with self._lock:
+            entry = self._index[tier].get(path)
+            if entry is None:
+                return
+            entry[1] = time.time()
+            self._index[tier].move_to_end(path)
+
+    def _remove(self, tier: str, path: str, reason: str) -> int:
+        """Drop path from the index and the disk; caller holds the lock"""
+        size, _ = self._index[tier].pop(path)
+        self._bytes[tier] -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            logger.warning(f"Retention could not remove {path}: {e}")
+            return 0
+        EVICTIONS.inc(tier=tier, reason=reason)
+        EVICTED_BYTES.inc(size, tier=tier, reason=reason)
+        return size
+
+    def _evict_lru(self, tier: str, target_bytes: int, reason: str, now: float) -> int:
+        """Evict least recently used files of tier until it holds target_bytes; caller holds the lock"""
+        freed = 0
+        entries = self._index[tier]
+        while self._bytes[tier] > target_bytes and entries:
+            path, (size, last_access) = next(iter(entries.items()))
+            if now - last_access < self.min_age:
+                # Everything left is newer; the client may not have fetched it yet
+                break
+            freed += self._remove(tier, path, reason)
+        return freed
+
+    def _sweep_uploads(self, now: float) -> int:
+        removed = 0
+        directories = [(UPLOAD_TIER, self.upload_dir)]
+        directories += [(tier, os.path.join(self.processed_dir, tier)) for tier in self.quotas]
+        for tier, directory in directories:
+            if not os.path.isdir(directory):
+                continue
+            is_upload_dir = tier == UPLOAD_TIER
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    # Uploads left by failed requests, and temp files of interrupted encodes
+                    if not is_upload_dir and not entry.name.startswith(".encoding_"):
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    if now - st.st_mtime < self.upload_ttl:
+                        continue
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        continue
+                    reason = "orphaned_upload" if is_upload_dir else "stale_temp"
+                    EVICTIONS.inc(tier=tier, reason=reason)
+                    EVICTED_BYTES.inc(st.st_size, tier=tier, reason=reason)
+                    removed += 1
+        return removed
+
+    def sweep(self) -> dict:
+        """One retention pass: quotas, low free space, then orphaned uploads"""
+        started = time.perf_counter()
+        now = time.time()
+        if now - self._last_scan >= self.rescan_interval:
+            self.scan()
+
+        freed = {}
+        with self._lock:
+            for tier, quota in self.quotas.items():
+                if self._bytes[tier] > quota:
+                    freed[tier] = self._evict_lru(tier, int(quota * LOW_WATER_RATIO), "quota", now)
+
+            # Writes slow down as the disk fills, so keep a free-space floor across all tiers
+            usage = shutil.disk_usage(self.processed_dir)
+            shortfall = int(usage.total * self.min_free_ratio) - usage.free
+            while shortfall > 0:
+                candidates = [
+                    (entries[next(iter(entries))][1], tier) for tier, entries in self._index.items() if entries
+                ]
+                if not candidates:
+                    break
+                last_access, tier = min(candidates)
+                if now - last_access < self.min_age:
+                    break
+                path = next(iter(self._index[tier]))
+                released = self._remove(tier, path, "disk_free")
+                freed[tier] = freed.get(tier, 0) + released
+                shortfall -= released
+
+        uploads_removed = self._sweep_uploads(now)
+        self._publish()
+        seconds = time.perf_counter() - started
+        SWEEP_SECONDS.observe(seconds)
+
+        if any(freed.values()) or uploads_removed:
+            logger.info(f"Retention sweep freed {sum(freed.values()) / (1024 * 1024):.1f} MB "
+                        f"and removed {uploads_removed} stale upload(s) in {seconds:.3f}s")
+        return {"freed_bytes": freed, "uploads_removed": uploads_removed, "seconds": seconds}
+
+    def _publish(self):
+        with self._lock:
+            for tier in self.quotas:
+                STORAGE_BYTES.set(self._bytes[tier], tier=tier)
+                STORAGE_FILES.set(len(self._index[tier]), tier=tier)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                tier: {"bytes": self._bytes[tier], "files": len(self._index[tier]), "quota": self.quotas[tier]}
+                for tier in self.quotas
+            }
@@ -0,0 +1,241 @@
+"""
+Tier-aware scheduling for CrysGarage mastering jobs
+Queues jobs per tier in front of the worker pool, dispatches by priority and
+deadline, caps per-tier concurrency and rejects work once queues are full
+"""
+
+import logging
+import math
+import time
+from collections import deque
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = REGISTRY.gauge("crysgarage_queue_depth", "Jobs waiting for a worker", ["tier"])
+QUEUE_RUNNING = REGISTRY.gauge("crysgarage_queue_running", "Scheduled jobs running", ["tier"])
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "crysgarage_queue_wait_seconds", "Time from submission until a worker picks the job up", ["tier"],
+    buckets=(0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+QUEUE_REJECTED = REGISTRY.counter("crysgarage_queue_rejected_total", "Submissions refused with 429", ["tier"])
+DEADLINE_MISSED = REGISTRY.counter(
+    "crysgarage_deadline_missed_total", "Jobs that finished after their tier's processing_time", ["tier"]
+)
+
+# Weight of the newest run time in the per-tier service time average
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class QueueFull(Exception):
+    """Raised when a tier's queue is at capacity; retry_after is in seconds"""
+
+    def __init__(self, tier: str, retry_after: int):
+        super().__init__(f"{tier} queue is full, retry in {retry_after}s")
+        self.tier = tier
+        self.retry_after = retry_after
+
+
+class TierScheduler:
+    """
+    Dispatch queued jobs into a JobManager by tier
+
+    Each tier config needs priority (0 is most urgent), max_concurrent_share
+    (share of the workers one tier may occupy), max_queue and processing_time
+    (the deadline in seconds). Among the tiers with a free slot, the head job
+    with the lowest effective priority goes first; every processing_time a job
+    waits improves its priority by one, so lower tiers are delayed but never
+    starved. Ties go to the earliest deadline.
+    """
+
+    def __init__(self, job_manager, tiers: dict):
+        self.job_manager = job_manager
+        self.tiers = tiers
+        self._queues = {tier: deque() for tier in tiers}
+        self._running = {tier: 0 for tier in tiers}
+        self._service_seconds = {tier: float(config["processing_time"]) for tier, config in tiers.items()}
+
+    def max_concurrent(self, tier: str) -> int:
+        share = self.tiers[tier]["max_concurrent_share"]
+        return max(1, math.ceil(share * self.job_manager.max_workers))
+
+    def retry_after(self, tier: str) -> int:
+        """Seconds until a slot is likely to open for tier, from queue depth and recent run times"""
+        waiting = sum(len(queue) for queue in self._queues.values())
+        service = sum(self._service_seconds.values()) / len(self._service_seconds)
+        estimate = (waiting + 1) * service / self.job_manager.max_workers
+        return max(1, int(math.ceil(min(estimate, self.tiers[tier]["processing_time"] * 10))))
+
+    def admit(self, tier: str, count: int = 1):
+        """
+        Raise QueueFull if tier cannot take count more jobs
+
+        Called before an upload is read, so a saturated service turns requests
+        away without receiving their bodies.
+        """
+        if len(self._queues[tier]) + count > self.tiers[tier]["max_queue"]:
+            QUEUE_REJECTED.inc(tier=tier)
+            raise QueueFull(tier, self.retry_after(tier))
+
+    async def submit(self, tier: str, fn, *args, meta: dict = None, **kwargs) -> str:
+        """Queue fn(*args, **kwargs) for tier and return its job id"""
+        job_id = self.job_manager.create(meta)
+        now = time.time()
+        self._queues[tier].append({
+            "job_id": job_id,
+            "fn": fn,
+            "args": args,
+            "kwargs": kwargs,
+            "enqueued_at": now,
+            "deadline": now + self.tiers[tier]["processing_time"],
+        })
+        self._dispatch()
+        self._publish()
+        return job_id
+
+    def _effective_priority(self, tier: str, entry: dict, now: float) -> tuple:
+        waited = now - entry["enqueued_at"]
+        aged = self.tiers[tier]["priority"] - int(waited // self.tiers[tier]["processing_time"])
+        return aged, entry["deadline"]
+
+    def _dispatch(self):
+        now = time.time()
+        while sum(self._running.values()) < self.job_manager.max_workers:
+            candidates = [
+                (self._effective_priority(tier, queue[0], now), tier)
+                for tier, queue in self._queues.items()
+                if queue and self._running[tier] < self.max_concurrent(tier)
+            ]
+            if not candidates:
+                return
+            _, tier = min(candidates)
+            entry = self._queues[tier].popleft()
+            self._start(tier, entry, now)
+
+    def _start(self, tier: str, entry: dict, now: float):
+        job_id = entry["job_id"]
+        QUEUE_WAIT_SECONDS.observe(now - entry["enqueued_at"], tier=tier)
+        self._running[tier] += 1
+        try:
+            self.job_manager.start(job_id, entry["fn"], *entry["args"], **entry["kwargs"])
+        except Exception as e:
+            # Pool unusable (e.g. broken); fail this job rather than the whole queue
+            self._running[tier] -= 1
+            logger.error(f"Could not start job {job_id}: {e}", exc_info=True)
+            self.job_manager.fail(job_id, e)
+            return
+        self.job_manager.add_done_callback(job_id, lambda job: self._finished(tier, entry, job))
+
+    def _finished(self, tier: str, entry: dict, job: dict):
+        self._running[tier] -= 1
+        if job is not None and job.get("started_at") and job.get("finished_at"):
+            run_seconds = job["finished_at"] - job["started_at"]
+            self._service_seconds[tier] += SERVICE_TIME_SMOOTHING * (run_seconds - self._service_seconds[tier])
+            if job["finished_at"] > entry["deadline"]:
+                DEADLINE_MISSED.inc(tier=tier)
+        self._dispatch()
+        self._publish()
+
+    def _publish(self):
+        for tier in self.tiers:
+            QUEUE_DEPTH.set(len(self._queues[tier]), tier=tier)
+            QUEUE_RUNNING.set(self._running[tier], tier=tier)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            tier: {
+                "queued": len(self._queues[tier]),
+                "running": self._running[tier],
+                "max_concurrent": self.max_concurrent(tier),
+                "max_queue": self.tiers[tier]["max_queue"],
+                "oldest_wait_seconds": now - self._queues[tier][0]["enqueued_at"] if self._queues[tier] else 0.0,
+                "avg_service_seconds": round(self._service_seconds[tier], 3),
+                "retry_after": self.retry_after(tier),
+            }
+            for tier in self.tiers
+        }
+
+
+class QueueScheduler:
+    """
+    TierScheduler counterpart for a shared JobQueue
+
+    Each job carries its tier's priority, processing_time (for ageing and the
+    deadline) and max_concurrent_share, and workers apply them when they lease
+    (see JobQueue.lease). Admission and stats read the job manager's snapshot
+    of the whole queue, at most its stats_interval old, so no request handler
+    waits on SQLite; only submit() writes, off the event loop.
+    """
+
+    def __init__(self, job_manager, tiers: dict):
+        self.job_manager = job_manager
+        self.tiers = tiers
+        job_manager.tiers.update(tiers)
+
+    def max_concurrent(self, tier: str) -> int:
+        share = self.tiers[tier]["max_concurrent_share"]
+        return max(1, math.ceil(share * self.job_manager.max_workers))
+
+    def _service_seconds(self, tier: str) -> float:
+        measured = self.job_manager.service_seconds.get(tier)
+        return measured if measured is not None else float(self.tiers[tier]["processing_time"])
+
+    def retry_after(self, tier: str, counts: dict = None) -> int:
+        """Seconds until a slot is likely to open for tier, from queue depth and recent run times"""
+        counts = counts if counts is not None else self.job_manager.counts
+        waiting = sum(entry["queued"] for entry in counts.values())
+        service = sum(self._service_seconds(name) for name in self.tiers) / len(self.tiers)
+        estimate = (waiting + 1) * service / self.job_manager.max_workers
+        return max(1, int(math.ceil(min(estimate, self.tiers[tier]["processing_time"] * 10))))
+
+    def admit(self, tier: str, count: int = 1):
+        """Raise QueueFull if tier cannot take count more jobs"""
+        counts = self.job_manager.counts
+        if counts.get(tier, {}).get("queued", 0) + count > self.tiers[tier]["max_queue"]:
+            QUEUE_REJECTED.inc(tier=tier)
+            raise QueueFull(tier, self.retry_after(tier, counts))
+
+    async def submit(self, tier: str, fn, *args, meta: dict = None, **kwargs) -> str:
+        """Queue fn(*args, **kwargs) for tier and return its job id"""
+        config = self.tiers[tier]
+        job_id = await self.job_manager.enqueue(
+            fn, args, kwargs, tier=tier, meta=meta, priority=config["priority"],
+            aging_seconds=config["processing_time"], max_share=config["max_concurrent_share"],
+            deadline=time.time() + config["processing_time"],
+        )
+        self.job_manager.add_done_callback(job_id, lambda job: self._finished(tier, job))
+        self._publish()
+        return job_id
+
+    def _finished(self, tier: str, job: dict):
+        if job is not None and job.get("started_at"):
+            QUEUE_WAIT_SECONDS.observe(job["started_at"] - job["created_at"], tier=tier)
+            if job["finished_at"] > job["created_at"] + self.tiers[tier]["processing_time"]:
+                DEADLINE_MISSED.inc(tier=tier)
+        self._publish()
+
+    def _publish(self, counts: dict = None):
+        counts = counts if counts is not None else self.job_manager.counts
+        for tier in self.tiers:
+            QUEUE_DEPTH.set(counts.get(tier, {}).get("queued", 0), tier=tier)
+            QUEUE_RUNNING.set(counts.get(tier, {}).get("running", 0), tier=tier)
+
+    def stats(self) -> dict:
+        now = time.time()
+        counts = self.job_manager.counts
+        self._publish(counts)
+        stats = {}
+        for tier in self.tiers:
+            entry = counts.get(tier, {"queued": 0, "running": 0, "oldest_enqueued_at": None})
+            stats[tier] = {
+                "queued": entry["queued"],
+                "running": entry["running"],
+                "max_concurrent": self.max_concurrent(tier),
+                "max_queue": self.tiers[tier]["max_queue"],
+                "oldest_wait_seconds": now - entry["oldest_enqueued_at"] if entry["queued"] else 0.0,
+                "avg_service_seconds": round(self._service_seconds(tier), 3),
+                "retry_after": self.retry_after(tier, counts),
+            }
+        return stats
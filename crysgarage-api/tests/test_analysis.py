@@ -0,0 +1,56 @@
+import numpy as np
+
+from analysis import ANALYSIS_BANDS, analyze_audio
+
+SR = 44100
+
+
+def _stft_power(y: np.ndarray, n_fft: int, hop_length: int) -> np.ndarray:
+    """librosa.stft(center=True) power, as the original /analyze-upload computed it"""
+    padded = np.pad(y, n_fft // 2)
+    frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop_length]
+    window = 0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(n_fft) / n_fft)
+    return (np.abs(np.fft.rfft(frames * window, axis=-1)) ** 2).T
+
+
+def _original_analysis(y: np.ndarray, sr: int) -> dict:
+    y_stereo = np.vstack([y, y]) if y.ndim == 1 else y
+    y_mono = np.mean(y_stereo, axis=0)
+    spectrum = _stft_power(y_mono, 4096, 1024)
+    freqs = np.arange(4096 // 2 + 1) * sr / 4096
+    mid = _stft_power(0.5 * (y_stereo[0] + y_stereo[1]), 2048, 512)
+    side = _stft_power(0.5 * (y_stereo[0] - y_stereo[1]), 2048, 512)
+    f2 = np.arange(2048 // 2 + 1) * sr / 2048
+    bands, widths = [], []
+    for low, high in ANALYSIS_BANDS:
+        idx = np.where((freqs >= low) & (freqs < high))[0]
+        bands.append(10 * np.log10(np.mean(spectrum[idx, :]) + 1e-12))
+        idx = np.where((f2 >= low) & (f2 < high))[0]
+        widths.append(np.mean(side[idx, :]) / (np.mean(mid[idx, :]) + 1e-12))
+    return {"bands": np.array(bands), "widths": np.array(widths), "peak_db": 20 * np.log10(np.abs(y_mono).max())}
+
+
+def _test_signal(channels: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    t = np.arange(20 * SR) / SR
+    common = np.sin(2 * np.pi * 50.0 * t) + 0.3 * rng.standard_normal(len(t))
+    # Each channel differs, more so at low frequencies, so widths are not trivial
+    return np.stack([common + 0.5 * np.sin(2 * np.pi * (30.0 + 7 * ch) * t) + 0.1 * rng.standard_normal(len(t))
+                     for ch in range(channels)]).astype(np.float32) * 0.2
+
+
+def test_matches_original_analysis():
+    for channels in (2, 3):
+        y = _test_signal(channels)
+        metrics = analyze_audio(y, SR)
+        expected = _original_analysis(y.astype(np.float64), SR)
+        bands = np.array([band["power_db"] for band in metrics["spectral_bands"]])
+        widths = np.array([band["width"] for band in metrics["stereo_width_bands"]])
+        np.testing.assert_allclose(bands, expected["bands"], atol=0.01)
+        np.testing.assert_allclose(widths, expected["widths"], rtol=1e-3, atol=1e-6)
+        assert abs(metrics["peak_db"] - expected["peak_db"]) < 1e-3
+
+
+def test_mono_has_no_width():
+    metrics = analyze_audio(_test_signal(1)[0], SR)
+    assert all(band["width"] == 0.0 for band in metrics["stereo_width_bands"])
@@ -0,0 +1,20 @@
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from audio_converter import AudioConverter
+
+
+def test_failed_conversion_raises_without_copy(tmp_path):
+    input_path, output_path = str(tmp_path / "in.wav"), str(tmp_path / "out.xyz")
+    sf.write(input_path, np.zeros((44100, 2), dtype=np.float32), 44100)
+
+    with pytest.raises(ValueError):
+        AudioConverter().convert_audio(input_path, output_path, "XYZ", copy_on_failure=False)
+    assert not os.path.exists(output_path)
+
+    # The default keeps the old behaviour for other callers
+    AudioConverter().convert_audio(input_path, output_path, "XYZ")
+    assert os.path.getsize(output_path) == os.path.getsize(input_path)
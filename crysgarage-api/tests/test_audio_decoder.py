@@ -0,0 +1,20 @@
+import numpy as np
+import soundfile as sf
+
+from audio_decoder import decode_to_raw, iter_blocks, probe
+
+
+def test_memmap_blocks_are_private_copies(tmp_path):
+    audio = np.random.default_rng(0).standard_normal((10000, 2)).astype(np.float32) * 0.1
+    wav_path, raw_path = str(tmp_path / "in.wav"), str(tmp_path / "in.f32")
+    sf.write(wav_path, audio, 44100, subtype="FLOAT")
+    decode_to_raw(wav_path, raw_path)
+    info = probe(raw_path)
+    assert info["decoder"] == "memmap"
+
+    blocks = list(iter_blocks(raw_path, 4096, info=info))
+    for block in blocks:
+        # In-place stages must not dirty pages of the shared mapping
+        assert block.flags.owndata and block.flags.writeable
+        block *= 0.0
+    np.testing.assert_array_equal(np.concatenate(list(iter_blocks(raw_path, 4096, info=info))), audio)
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import signal
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from jobs import JobManager
+
+
+def test_cancelled_waiter_leaves_shared_job_running():
+    async def scenario():
+        manager = JobManager(max_workers=1)
+        job_id = manager.create()
+        leaving = asyncio.ensure_future(manager.wait(job_id))
+        staying = asyncio.ensure_future(manager.wait(job_id))
+        await asyncio.sleep(0)
+
+        leaving.cancel()
+        await asyncio.sleep(0)
+        assert manager.status(job_id)["status"] == "queued"
+
+        manager.fail(job_id, ValueError("boom"))
+        with pytest.raises(ValueError):
+            await staying
+        assert manager.status(job_id)["status"] == "failed"
+
+    asyncio.run(scenario())
+
+
+def _crash():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_pool_recovers_after_worker_dies():
+    async def scenario():
+        manager = JobManager(max_workers=1)
+        try:
+            crashed = await manager.submit(_crash)
+            with pytest.raises(BrokenProcessPool):
+                await manager.wait(crashed)
+            assert manager.status(crashed)["status"] == "failed"
+
+            job_id = await manager.submit(os.getpid)
+            assert await asyncio.wait_for(manager.wait(job_id), 60) != os.getpid()
+        finally:
+            manager.shutdown()
+
+    asyncio.run(scenario())
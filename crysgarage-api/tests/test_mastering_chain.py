@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import scipy.signal
+
+from mastering_chain import DEFAULT_CEILING_DBTP, MasteringChain
+
+SR = 44100
+
+
+def _signals():
+    rng = np.random.default_rng(0)
+    t = np.arange(3 * SR) / SR
+    b, a = scipy.signal.butter(2, [60.0, 8000.0], "bandpass", fs=SR)
+    music = (scipy.signal.lfilter(b, a, rng.standard_normal(len(t))) * (1.0 + 0.8 * np.sin(2 * np.pi * 2.0 * t)) * 0.3
+             + 0.3 * np.sin(2 * np.pi * 55.0 * t) + 0.2 * np.sin(2 * np.pi * 3520.0 * t))
+    return {
+        "tone_fs4_noise": np.sin(2 * np.pi * 11025.0 * t + 0.3) * 0.5 + 0.2 * rng.standard_normal(len(t)),
+        "music": music,
+        "noise": 0.3 * rng.standard_normal(len(t)),
+    }
+
+
+def _render(chain: MasteringChain, audio: np.ndarray) -> np.ndarray:
+    out = [chain.process(audio[start:start + chain.block_frames]).copy()
+           for start in range(0, len(audio), chain.block_frames)]
+    out.append(chain.flush().copy())
+    return np.concatenate(out)
+
+
+@pytest.mark.parametrize("name", list(_signals()))
+def test_true_peak_stays_under_ceiling(name):
+    mono = _signals()[name]
+    audio = np.stack([mono, 0.9 * mono], axis=1).astype(np.float32)
+    out = _render(MasteringChain(SR, 2, gain_db=12.0, dither_bits=16), audio)
+    assert len(out) == len(audio)
+
+    # Independent meter: 16x oversampling with scipy's own polyphase resampler
+    true_peak = np.abs(scipy.signal.resample_poly(out.astype(np.float64), 16, 1, axis=0)).max()
+    assert 20.0 * np.log10(true_peak) <= DEFAULT_CEILING_DBTP
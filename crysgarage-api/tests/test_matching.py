@@ -0,0 +1,32 @@
+import numpy as np
+import pyloudnorm as pyln
+import soundfile as sf
+
+from matching import PROFILE_VERSION, match_file, reference_profile
+
+SR = 44100
+
+
+def _noise(seconds: float, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(int(seconds * SR))
+
+
+def test_match_hits_reference_loudness(tmp_path):
+    # A wide reference (independent channels) reads several dB lower as Mid
+    # only than over both channels, so a Mid-based target would miss
+    reference = np.stack([_noise(8, 1), _noise(8, 2)], axis=1) * 0.05
+    near_mono = _noise(8, 3)
+    target = np.stack([near_mono, near_mono + 0.1 * _noise(8, 4)], axis=1) * 0.02
+    reference_path, target_path, output_path = (str(tmp_path / name) for name in ("ref.wav", "in.wav", "out.wav"))
+    sf.write(reference_path, reference.astype(np.float32), SR, subtype="FLOAT")
+    sf.write(target_path, target.astype(np.float32), SR, subtype="FLOAT")
+
+    meter = pyln.Meter(SR)
+    reference_lufs = meter.integrated_loudness(reference)
+    profile = reference_profile(reference_path)
+    assert profile["version"] == PROFILE_VERSION
+    assert abs(profile["lufs"] - reference_lufs) < 0.01
+
+    match_file(target_path, output_path, profile)
+    output, _ = sf.read(output_path)
+    assert abs(meter.integrated_loudness(output) - reference_lufs) < 0.5
@@ -0,0 +1,52 @@
+import asyncio
+import hashlib
+import os
+
+from uploads import UploadSessions, save_upload
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def test_resume_after_restart_keeps_checksum(tmp_path):
+    body = os.urandom(3 * 1024 * 1024 + 17)
+    split = len(body) // 2
+
+    async def scenario():
+        first = UploadSessions(str(tmp_path))
+        session = first.create("free", "track.bin", len(body), len(body), sha256=hashlib.sha256(body).hexdigest())
+        await first.append(session["upload_id"], 0, _chunks(body[:split]))
+
+        # A restarted API process rebuilds the running hash from the part file
+        second = UploadSessions(str(tmp_path))
+        assert second.status(session["upload_id"])["offset"] == split
+        await second.append(session["upload_id"], split, _chunks(body[split:split + 1000], body[split + 1000:]),
+                            length=len(body) - split)
+        return await second.finalize(session["upload_id"])
+
+    result = asyncio.run(scenario())
+    assert result["sha256"] == hashlib.sha256(body).hexdigest()
+    with open(result["path"], "rb") as f:
+        assert f.read() == body
+
+
+class _FakeUpload:
+    filename = "track.wav"
+
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def read(self, size: int) -> bytes:
+        chunk, self._body = self._body[:size], self._body[size:]
+        return chunk
+
+
+def test_save_upload_hashes_streamed_body(tmp_path):
+    body = b"RIFF" + os.urandom(2 * 1024 * 1024 + 5)
+    stats = asyncio.run(save_upload(_FakeUpload(body), str(tmp_path / "in_input"), len(body)))
+    assert stats["bytes"] == len(body)
+    assert stats["sha256"] == hashlib.sha256(body).hexdigest()
+    with open(stats["path"], "rb") as f:
+        assert f.read() == body
@@ -0,0 +1,378 @@
+"""
+Upload helpers for CrysGarage
+Streams multipart uploads to disk in fixed-size blocks and enforces size caps
+Saved files are named after the container sniffed from their header bytes
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+import zipfile
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from audio_decoder import FORMAT_EXTENSIONS, SNIFF_BYTES, sniff_header
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".flac", ".aac", ".m4a", ".ogg", ".aif", ".aiff"}
+
+
+def _rename_to_container(path: str, header: bytes, filename: str = None):
+    """
+    Give a saved file the extension of its real container
+
+    Falls back to the client's extension when the header is not recognised.
+    Returns the (possibly new) path and the sniffed format or None.
+    """
+    container = sniff_header(header)
+    if container is not None:
+        extension = "." + FORMAT_EXTENSIONS[container]
+    else:
+        extension = os.path.splitext(filename or "")[1].lower()
+        if extension not in AUDIO_EXTENSIONS:
+            return path, None
+
+    renamed = os.path.splitext(path)[0] + extension
+    if renamed != path:
+        os.replace(path, renamed)
+    return renamed, container
+
+
+def _hash_and_write(buffer, chunk: bytes, digest, chunk_digest=None):
+    digest.update(chunk)
+    if chunk_digest is not None:
+        chunk_digest.update(chunk)
+    buffer.write(chunk)
+
+
+async def save_upload(upload: UploadFile, dest_path: str, max_bytes: int, chunk_size: int = UPLOAD_CHUNK_SIZE) -> dict:
+    """
+    Stream an upload to disk without holding the whole body in memory
+
+    Args:
+        upload: Incoming multipart file
+        dest_path: Where to write the bytes; the extension is replaced by the
+                   sniffed container's (e.g. "<id>_input" -> "<id>_input.mp3")
+        max_bytes: Size cap; the upload is aborted with 413 once it is exceeded
+        chunk_size: Bytes read per block
+
+    Returns:
+        dict: path, format, bytes, sha256, seconds and throughput_mbps for the upload
+    """
+    started = time.perf_counter()
+    received = 0
+    digest = hashlib.sha256()
+    header = b""
+
+    try:
+        with open(dest_path, "wb") as buffer:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File exceeds the {max_bytes // (1024 * 1024)} MB limit",
+                    )
+                if len(header) < SNIFF_BYTES:
+                    header += chunk[:SNIFF_BYTES - len(header)]
+                # Hashing and writing 1 MB would block the event loop for every upload
+                await run_in_threadpool(_hash_and_write, buffer, chunk, digest)
+    except BaseException:
+        # Never leave partial uploads behind
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        if received > max_bytes:
+            logger.warning(f"Upload {upload.filename} rejected after {received} bytes (limit {max_bytes})")
+        raise
+
+    dest_path, container = _rename_to_container(dest_path, header, upload.filename)
+    seconds = time.perf_counter() - started
+    throughput = received / (1024 * 1024) / seconds if seconds > 0 else 0.0
+    logger.info(f"Saved upload: {dest_path} ({received} bytes in {seconds:.2f}s, {throughput:.1f} MB/s)")
+
+    return {
+        "path": dest_path,
+        "format": container,
+        "bytes": received,
+        "sha256": digest.hexdigest(),
+        "seconds": seconds,
+        "throughput_mbps": throughput,
+    }
+
+
+def extract_zip_tracks(zip_path: str, dest_dir: str, max_member_bytes: int, max_members: int) -> list:
+    """
+    Extract the audio members of an uploaded archive, one streamed copy per track
+
+    Member sizes are enforced while copying (never trusted from the zip header)
+    and hashed on the way, so each track gets the same stats as save_upload.
+
+    Returns:
+        list: one dict per track with file_id, name, path, format, bytes and sha256
+    """
+    tracks = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            members = [
+                info for info in archive.infolist()
+                if not info.is_dir()
+                and not os.path.basename(info.filename).startswith(".")
+                and os.path.splitext(info.filename)[1].lower() in AUDIO_EXTENSIONS
+            ]
+            if len(members) > max_members:
+                raise HTTPException(status_code=413, detail=f"Archive holds more than {max_members} tracks")
+
+            for info in members:
+                file_id = str(uuid.uuid4())
+                dest_path = os.path.join(dest_dir, f"{file_id}_input")
+                tracks.append({"file_id": file_id, "name": os.path.basename(info.filename), "path": dest_path})
+
+                digest = hashlib.sha256()
+                written = 0
+                header = b""
+                with archive.open(info) as source, open(dest_path, "wb") as buffer:
+                    while True:
+                        chunk = source.read(UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        written += len(chunk)
+                        if written > max_member_bytes:
+                            raise HTTPException(
+                                status_code=413,
+                                detail=f"{info.filename} exceeds the {max_member_bytes // (1024 * 1024)} MB limit",
+                            )
+                        if len(header) < SNIFF_BYTES:
+                            header += chunk[:SNIFF_BYTES - len(header)]
+                        digest.update(chunk)
+                        buffer.write(chunk)
+                dest_path, container = _rename_to_container(dest_path, header, info.filename)
+                tracks[-1].update({"path": dest_path, "format": container, "bytes": written,
+                                   "sha256": digest.hexdigest()})
+    except BaseException:
+        for track in tracks:
+            if os.path.exists(track["path"]):
+                os.remove(track["path"])
+        raise
+    finally:
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+
+    logger.info(f"Extracted {len(tracks)} track(s) from {zip_path}")
+    return tracks
+
+
+class UploadSessions:
+    """
+    Resumable uploads: create a session, append byte ranges at the current
+    offset, then finalize
+
+    Chunks are appended to one .part file in place and hashed as they arrive,
+    so finalizing is a rename, not a copy. Session state is mirrored to a JSON
+    sidecar so uploads survive an API restart (the running SHA-256 is rebuilt
+    from the part file on the first chunk after one). Hashing and writes run
+    on the thread pool, so a large resume never stalls the event loop. Idle
+    sessions expire with the rest of UPLOAD_DIR through the retention TTL.
+    """
+
+    def __init__(self, upload_dir: str):
+        self.upload_dir = upload_dir
+        self._sessions = {}
+        self._digests = {}
+        self._busy = set()
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.upload_dir, f"{upload_id}_input.part")
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.upload_dir, f"{upload_id}.upload.json")
+
+    def _save(self, session: dict):
+        session["updated_at"] = time.time()
+        tmp_path = self._meta_path(session["upload_id"]) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(session, f)
+        os.replace(tmp_path, self._meta_path(session["upload_id"]))
+
+    def _load(self, upload_id: str) -> dict:
+        try:
+            upload_id = str(uuid.UUID(upload_id))
+        except ValueError:
+            raise HTTPException(status_code=404, detail=f"Unknown upload: {upload_id}")
+        session = self._sessions.get(upload_id)
+        if session is None:
+            try:
+                with open(self._meta_path(upload_id), "r") as f:
+                    session = json.load(f)
+            except (OSError, ValueError):
+                raise HTTPException(status_code=404, detail=f"Unknown upload: {upload_id}")
+            self._sessions[upload_id] = session
+        if not os.path.exists(session["path"]):
+            self._forget(upload_id)
+            raise HTTPException(status_code=404, detail=f"Upload {upload_id} expired")
+        return session
+
+    def _forget(self, upload_id: str):
+        self._sessions.pop(upload_id, None)
+        self._digests.pop(upload_id, None)
+        if os.path.exists(self._meta_path(upload_id)):
+            os.remove(self._meta_path(upload_id))
+
+    def _digest(self, session: dict):
+        """Running SHA-256 of the bytes received so far"""
+        digest = self._digests.get(session["upload_id"])
+        if digest is None:
+            digest = hashlib.sha256()
+            with open(session["path"], "rb") as f:
+                remaining = session["offset"]
+                while remaining > 0:
+                    chunk = f.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+            self._digests[session["upload_id"]] = digest
+        return digest
+
+    @staticmethod
+    def describe(session: dict) -> dict:
+        return {key: session[key] for key in ("upload_id", "tier", "filename", "offset", "total_bytes")}
+
+    def create(self, tier: str, filename: str, total_bytes: int, max_bytes: int, sha256: str = None) -> dict:
+        if total_bytes <= 0:
+            raise HTTPException(status_code=400, detail="Upload size must be positive")
+        if total_bytes > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File exceeds the {max_bytes // (1024 * 1024)} MB limit")
+
+        upload_id = str(uuid.uuid4())
+        session = {
+            "upload_id": upload_id,
+            "tier": tier,
+            "filename": filename,
+            "total_bytes": total_bytes,
+            "sha256": sha256.lower() if sha256 else None,
+            "offset": 0,
+            "path": self._part_path(upload_id),
+            "created_at": time.time(),
+        }
+        open(session["path"], "wb").close()
+        self._sessions[upload_id] = session
+        self._digests[upload_id] = hashlib.sha256()
+        self._save(session)
+        logger.info(f"Upload session {upload_id} created for {filename} ({total_bytes} bytes, {tier})")
+        return self.describe(session)
+
+    def status(self, upload_id: str) -> dict:
+        return self.describe(self._load(upload_id))
+
+    async def append(self, upload_id: str, start: int, chunks, length: int = None,
+                     chunk_sha256: str = None) -> dict:
+        """
+        Append the bytes yielded by the async iterator chunks at offset start
+
+        start must equal the current offset (409 otherwise, with the offset in
+        the detail) so a client that lost a response simply asks and resumes.
+        With length (from Content-Range) a short body counts as interrupted, and
+        with chunk_sha256 the range is verified before it is committed; a bad
+        or interrupted range is truncated away and the offset stays put.
+        """
+        session = self._load(upload_id)
+        upload_id = session["upload_id"]
+        if upload_id in self._busy:
+            raise HTTPException(status_code=409, detail="Another chunk for this upload is in progress")
+        if start != session["offset"]:
+            raise HTTPException(status_code=409, detail=f"Expected offset {session['offset']}, got {start}")
+
+        self._busy.add(upload_id)
+        committed = False
+        chunk_digest = hashlib.sha256() if chunk_sha256 else None
+        offset = session["offset"]
+        try:
+            # After a restart this reads back the whole partial file
+            digest = (await run_in_threadpool(self._digest, session)).copy()
+            with open(session["path"], "r+b") as buffer:
+                # Drop any tail left by an earlier interrupted chunk
+                buffer.truncate(offset)
+                buffer.seek(offset)
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    offset += len(chunk)
+                    if offset > session["total_bytes"]:
+                        raise HTTPException(status_code=413, detail="Chunk runs past the declared upload size")
+                    await run_in_threadpool(_hash_and_write, buffer, chunk, digest, chunk_digest)
+
+                if length is not None and offset - start != length:
+                    raise HTTPException(status_code=400, detail=f"Chunk incomplete: {offset - start} of {length} bytes")
+                if chunk_digest is not None and chunk_digest.hexdigest() != chunk_sha256.lower():
+                    raise HTTPException(status_code=400, detail="Chunk checksum mismatch")
+                committed = True
+        finally:
+            if not committed:
+                with open(session["path"], "r+b") as buffer:
+                    buffer.truncate(session["offset"])
+            self._busy.discard(upload_id)
+
+        session["offset"] = offset
+        self._digests[upload_id] = digest
+        self._save(session)
+        return self.describe(session)
+
+    async def finalize(self, upload_id: str) -> dict:
+        """
+        Verify a complete upload and rename it in place for mastering
+
+        Returns:
+            dict: file_id, path, format, bytes and sha256, shaped like save_upload's result
+        """
+        session = self._load(upload_id)
+        upload_id = session["upload_id"]
+        if upload_id in self._busy:
+            raise HTTPException(status_code=409, detail="A chunk for this upload is still in progress")
+        if session["offset"] != session["total_bytes"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload incomplete: {session['offset']} of {session['total_bytes']} bytes received",
+            )
+
+        self._busy.add(upload_id)
+        try:
+            sha256 = (await run_in_threadpool(self._digest, session)).hexdigest()
+        finally:
+            self._busy.discard(upload_id)
+        if session["sha256"] and sha256 != session["sha256"]:
+            self.abort(upload_id)
+            raise HTTPException(status_code=400, detail="Upload checksum mismatch; start a new upload")
+
+        with open(session["path"], "rb") as f:
+            header = f.read(SNIFF_BYTES)
+        path, container = _rename_to_container(session["path"], header, session["filename"])
+        if path == session["path"]:
+            # Unrecognised container: still drop the .part suffix
+            path = os.path.splitext(path)[0]
+            os.replace(session["path"], path)
+        self._forget(upload_id)
+
+        logger.info(f"Upload session {upload_id} finalized: {path} ({session['total_bytes']} bytes)")
+        return {
+            "file_id": upload_id,
+            "path": path,
+            "format": container,
+            "bytes": session["total_bytes"],
+            "sha256": sha256,
+        }
+
+    def abort(self, upload_id: str):
+        session = self._load(upload_id)
+        if os.path.exists(session["path"]):
+            os.remove(session["path"])
+        self._forget(session["upload_id"])